@@ -0,0 +1,7 @@
+from django.contrib import admin
+
+from .models import DailyBookStats, DailyCirculationStats, DailyPaymentStats
+
+admin.site.register(DailyCirculationStats)
+admin.site.register(DailyBookStats)
+admin.site.register(DailyPaymentStats)
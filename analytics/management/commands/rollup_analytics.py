@@ -0,0 +1,33 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from analytics.rollups import rollup
+from borrowings.models import Borrowing
+
+
+class Command(BaseCommand):
+    help = (
+        "Roll up daily analytics for a range of days, by default from the "
+        "first borrowing until today. Use it to backfill the history; the "
+        "rollup_daily_stats task keeps the recent days up to date."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date-from", type=date.fromisoformat)
+        parser.add_argument("--date-to", type=date.fromisoformat)
+
+    def handle(self, *args, **options):
+        date_to = options["date_to"] or timezone.now().date()
+        date_from = options["date_from"] or self.first_day() or date_to
+        if date_from > date_to:
+            raise CommandError("--date-from must not be after --date-to.")
+
+        days = rollup(date_from, date_to)
+        self.stdout.write(f"Rolled up {days} days ({date_from} to {date_to}).")
+
+    def first_day(self):
+        first = Borrowing.objects.aggregate(first=Min("borrowing_date"))
+        return first["first"]
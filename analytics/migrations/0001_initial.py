@@ -0,0 +1,126 @@
+# Generated by Django 5.0.6 on 2026-10-18 10:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ("books", "0004_book_natural_key"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyCirculationStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(unique=True)),
+                ("borrowed_count", models.PositiveIntegerField(default=0)),
+                ("returned_count", models.PositiveIntegerField(default=0)),
+                ("late_return_count", models.PositiveIntegerField(default=0)),
+                ("active_count", models.PositiveIntegerField(default=0)),
+                ("overdue_count", models.PositiveIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name_plural": "daily circulation stats",
+            },
+        ),
+        migrations.CreateModel(
+            name="DailyPaymentStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                (
+                    "type",
+                    models.CharField(
+                        choices=[("PAYMENT", "Payment"), ("FINE", "Fine")],
+                        max_length=10,
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("CREATING", "Creating"),
+                            ("PENDING", "Pending"),
+                            ("PAID", "Paid"),
+                            ("FAILED", "Failed"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("payment_count", models.PositiveIntegerField(default=0)),
+                (
+                    "amount",
+                    models.DecimalField(
+                        decimal_places=2, default=0, max_digits=14
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "daily payment stats",
+            },
+        ),
+        migrations.CreateModel(
+            name="DailyBookStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("borrowed_count", models.PositiveIntegerField(default=0)),
+                ("returned_count", models.PositiveIntegerField(default=0)),
+                ("late_return_count", models.PositiveIntegerField(default=0)),
+                (
+                    "book",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_stats",
+                        to="books.book",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "daily book stats",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="dailypaymentstats",
+            constraint=models.UniqueConstraint(
+                fields=("date", "type", "status"),
+                name="daily_payment_stats_unique",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="dailybookstats",
+            constraint=models.UniqueConstraint(
+                fields=("date", "book"), name="daily_book_stats_unique"
+            ),
+        ),
+    ]
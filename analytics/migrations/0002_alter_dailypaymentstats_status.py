@@ -0,0 +1,27 @@
+# Generated by Django 5.0.6 on 2026-10-18 11:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="dailypaymentstats",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("CREATING", "Creating"),
+                    ("PENDING", "Pending"),
+                    ("PAID", "Paid"),
+                    ("FAILED", "Failed"),
+                    ("EXPIRED", "Expired"),
+                ],
+                max_length=10,
+            ),
+        ),
+    ]
@@ -0,0 +1,75 @@
+from django.db import models
+
+from books.models import Book
+from borrowings.models import Payment
+
+
+class DailyCirculationStats(models.Model):
+    """Library-wide circulation for one day.
+
+    ``active_count`` and ``overdue_count`` describe the borrowings still
+    out at the end of the day; the others count that day's events.
+    """
+
+    date = models.DateField(unique=True)
+    borrowed_count = models.PositiveIntegerField(default=0)
+    returned_count = models.PositiveIntegerField(default=0)
+    late_return_count = models.PositiveIntegerField(default=0)
+    active_count = models.PositiveIntegerField(default=0)
+    overdue_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "daily circulation stats"
+
+    def __str__(self):
+        return f"Circulation on {self.date}"
+
+
+class DailyBookStats(models.Model):
+    """Borrowings and returns of one book on one day.
+
+    Only books with any activity that day have a row.
+    """
+
+    date = models.DateField()
+    book = models.ForeignKey(
+        Book, on_delete=models.CASCADE, related_name="daily_stats"
+    )
+    borrowed_count = models.PositiveIntegerField(default=0)
+    returned_count = models.PositiveIntegerField(default=0)
+    late_return_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "daily book stats"
+        constraints = [
+            # Also serves the date range scan of the top books query.
+            models.UniqueConstraint(
+                fields=["date", "book"], name="daily_book_stats_unique"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.book_id} on {self.date}"
+
+
+class DailyPaymentStats(models.Model):
+    """Payments created on one day, by type and current status."""
+
+    date = models.DateField()
+    type = models.CharField(max_length=10, choices=Payment.Type.choices)
+    status = models.CharField(max_length=10, choices=Payment.Status.choices)
+    payment_count = models.PositiveIntegerField(default=0)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name_plural = "daily payment stats"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "type", "status"],
+                name="daily_payment_stats_unique",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.type} {self.status} on {self.date}"
@@ -0,0 +1,71 @@
+from datetime import timedelta
+
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import DailyCirculationStats
+
+DEFAULT_RANGE_DAYS = 30
+TOP_BOOKS_MAX_LIMIT = 100
+
+
+class DateRangeSerializer(serializers.Serializer):
+    """Inclusive range of days, the last ``DEFAULT_RANGE_DAYS`` by
+    default."""
+
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+
+    def validate(self, data):
+        data.setdefault("date_to", timezone.now().date())
+        data.setdefault(
+            "date_from",
+            data["date_to"] - timedelta(days=DEFAULT_RANGE_DAYS - 1),
+        )
+        if data["date_from"] > data["date_to"]:
+            raise serializers.ValidationError(
+                "date_from must not be after date_to."
+            )
+        return data
+
+
+class TopBooksQuerySerializer(DateRangeSerializer):
+    limit = serializers.IntegerField(
+        min_value=1, max_value=TOP_BOOKS_MAX_LIMIT, default=10
+    )
+
+
+class DailyCirculationStatsSerializer(serializers.ModelSerializer):
+    overdue_rate = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DailyCirculationStats
+        fields = [
+            "date",
+            "borrowed_count",
+            "returned_count",
+            "late_return_count",
+            "active_count",
+            "overdue_count",
+            "overdue_rate",
+        ]
+
+    def get_overdue_rate(self, obj):
+        if not obj.active_count:
+            return 0.0
+        return round(obj.overdue_count / obj.active_count, 4)
+
+
+class TopBookSerializer(serializers.Serializer):
+    book_id = serializers.IntegerField()
+    title = serializers.CharField(source="book__title")
+    author = serializers.CharField(source="book__author")
+    borrowed_count = serializers.IntegerField()
+    returned_count = serializers.IntegerField()
+
+
+class RevenueSerializer(serializers.Serializer):
+    date = serializers.DateField(required=False)
+    type = serializers.CharField()
+    payment_count = serializers.IntegerField()
+    amount = serializers.DecimalField(max_digits=14, decimal_places=2)
@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.utils.timezone import now
+
+from .rollups import rollup
+
+
+@shared_task
+def rollup_daily_stats():
+    """Re-roll today and the trailing ``ANALYTICS_ROLLUP_DAYS`` days."""
+    today = now().date()
+    return rollup(
+        today - timedelta(days=settings.ANALYTICS_ROLLUP_DAYS), today
+    )
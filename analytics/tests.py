@@ -0,0 +1,232 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from analytics.models import (
+    DailyBookStats,
+    DailyCirculationStats,
+    DailyPaymentStats,
+)
+from analytics.rollups import rollup, rollup_day
+from analytics.tasks import rollup_daily_stats
+from books.models import Book
+from borrowings.models import Borrowing, Payment
+
+
+class AnalyticsTestMixin:
+    def setUp(self):
+        self.today = date.today()
+        self.user = get_user_model().objects.create_user(
+            email="user@example.com", password="userpass"
+        )
+        self.books = [
+            Book.objects.create(
+                title=f"Book {i}",
+                author="Author Name",
+                cover=Book.HARD,
+                inventory=10,
+                daily_fee="1.00",
+            )
+            for i in range(3)
+        ]
+
+    def borrow(self, book, borrowed, due, returned=None):
+        borrowing = Borrowing.objects.create(
+            book=book,
+            user=self.user,
+            expected_returning_date=self.today + timedelta(days=30),
+        )
+        # borrowing_date is auto_now_add; move the history into place.
+        Borrowing.objects.filter(pk=borrowing.pk).update(
+            borrowing_date=self.today - timedelta(days=borrowed),
+            expected_returning_date=self.today - timedelta(days=due),
+            actual_returning_date=(
+                None
+                if returned is None
+                else self.today - timedelta(days=returned)
+            ),
+        )
+        return borrowing
+
+    def pay(self, borrowing, amount, payment_type=Payment.Type.PAYMENT):
+        return Payment.objects.create(
+            status=Payment.Status.PAID,
+            type=payment_type,
+            borrowing=borrowing,
+            money_to_pay=amount,
+            user=self.user,
+        )
+
+
+class RollupTest(AnalyticsTestMixin, TestCase):
+    def test_rollup_day_counts_events_and_open_borrowings(self):
+        # Borrowed 5 days ago, due 2 days ago, returned late today.
+        self.borrow(self.books[0], borrowed=5, due=2, returned=0)
+        # Borrowed 5 days ago and returned on time 3 days ago.
+        self.borrow(self.books[0], borrowed=5, due=1, returned=3)
+        # Borrowed 3 days ago, still out and not yet due.
+        self.borrow(self.books[1], borrowed=3, due=-4)
+
+        rollup_day(self.today - timedelta(days=3))
+
+        day = DailyCirculationStats.objects.get(
+            date=self.today - timedelta(days=3)
+        )
+        self.assertEqual(day.borrowed_count, 1)
+        self.assertEqual(day.returned_count, 1)
+        self.assertEqual(day.late_return_count, 0)
+        self.assertEqual(day.active_count, 2)
+        self.assertEqual(day.overdue_count, 0)
+
+        rollup_day(self.today)
+        day = DailyCirculationStats.objects.get(date=self.today)
+        self.assertEqual(day.returned_count, 1)
+        self.assertEqual(day.late_return_count, 1)
+        self.assertEqual(day.active_count, 1)
+
+        rollup_day(self.today - timedelta(days=5))
+        books = DailyBookStats.objects.filter(
+            date=self.today - timedelta(days=5)
+        )
+        self.assertEqual(
+            {row.book_id: row.borrowed_count for row in books},
+            {self.books[0].id: 2},
+        )
+
+    def test_overdue_counts_borrowings_out_at_end_of_day(self):
+        self.borrow(self.books[0], borrowed=10, due=6, returned=1)
+        self.borrow(self.books[1], borrowed=10, due=6)
+
+        rollup_day(self.today - timedelta(days=2))
+
+        day = DailyCirculationStats.objects.get(
+            date=self.today - timedelta(days=2)
+        )
+        self.assertEqual(day.active_count, 2)
+        self.assertEqual(day.overdue_count, 2)
+
+    def test_rollup_replaces_previous_rows(self):
+        borrowing = self.borrow(self.books[0], borrowed=1, due=-5)
+        self.pay(borrowing, "4.00")
+        rollup(self.today - timedelta(days=1), self.today)
+
+        Payment.objects.update(status=Payment.Status.FAILED)
+        Borrowing.objects.filter(pk=borrowing.pk).update(book=self.books[1])
+        rollup(self.today - timedelta(days=1), self.today)
+
+        self.assertEqual(
+            list(DailyBookStats.objects.values_list("book_id", flat=True)),
+            [self.books[1].id],
+        )
+        self.assertEqual(
+            list(DailyPaymentStats.objects.values_list("status", flat=True)),
+            [Payment.Status.FAILED],
+        )
+        self.assertEqual(DailyCirculationStats.objects.count(), 2)
+
+    def test_task_rolls_up_trailing_window(self):
+        with self.settings(ANALYTICS_ROLLUP_DAYS=2):
+            self.assertEqual(rollup_daily_stats(), 3)
+        self.assertEqual(
+            sorted(
+                DailyCirculationStats.objects.values_list("date", flat=True)
+            ),
+            [self.today - timedelta(days=n) for n in (2, 1, 0)],
+        )
+
+    def test_backfill_command_starts_at_first_borrowing(self):
+        self.borrow(self.books[0], borrowed=4, due=1)
+        out = StringIO()
+
+        call_command("rollup_analytics", stdout=out)
+
+        self.assertIn("Rolled up 5 days", out.getvalue())
+        self.assertEqual(DailyCirculationStats.objects.count(), 5)
+
+
+class AnalyticsViewTest(AnalyticsTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.admin = get_user_model().objects.create_superuser(
+            email="admin@example.com", password="adminpass"
+        )
+        self.client.force_authenticate(user=self.admin)
+
+        first = self.borrow(self.books[0], borrowed=2, due=-5)
+        second = self.borrow(self.books[0], borrowed=1, due=-5)
+        self.borrow(self.books[1], borrowed=1, due=-5)
+        self.pay(first, "4.00")
+        self.pay(second, "6.00")
+        self.pay(second, "1.50", Payment.Type.FINE)
+        rollup(self.today - timedelta(days=2), self.today)
+
+    def test_circulation(self):
+        response = self.client.get(
+            reverse("analytics:analytics-circulation"),
+            {"date_from": self.today - timedelta(days=2)},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [day["borrowed_count"] for day in response.data["results"]],
+            [1, 2, 0],
+        )
+        self.assertEqual(response.data["results"][-1]["active_count"], 3)
+        self.assertEqual(response.data["results"][-1]["overdue_rate"], 0.0)
+
+    def test_top_books(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                reverse("analytics:analytics-top-books"), {"limit": 1}
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data["results"],
+            [
+                {
+                    "book_id": self.books[0].id,
+                    "title": "Book 0",
+                    "author": "Author Name",
+                    "borrowed_count": 2,
+                    "returned_count": 0,
+                }
+            ],
+        )
+
+    def test_revenue_by_type(self):
+        response = self.client.get(reverse("analytics:analytics-revenue"))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        totals = {
+            row["type"]: (row["payment_count"], Decimal(row["amount"]))
+            for row in response.data["totals"]
+        }
+        self.assertEqual(
+            totals,
+            {
+                Payment.Type.FINE: (1, Decimal("1.50")),
+                Payment.Type.PAYMENT: (2, Decimal("10.00")),
+            },
+        )
+        self.assertEqual(len(response.data["daily"]), 2)
+
+    def test_invalid_range(self):
+        response = self.client.get(
+            reverse("analytics:analytics-circulation"),
+            {"date_from": self.today, "date_to": self.today - timedelta(1)},
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_staff_only(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse("analytics:analytics-revenue"))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
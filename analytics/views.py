@@ -0,0 +1,101 @@
+from django.db.models import Sum
+from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+from borrowings.models import Payment
+from library_service.replicas import ReplicaReadMixin
+
+from .models import DailyBookStats, DailyCirculationStats, DailyPaymentStats
+from .serializers import (
+    DailyCirculationStatsSerializer,
+    DateRangeSerializer,
+    RevenueSerializer,
+    TopBookSerializer,
+    TopBooksQuerySerializer,
+)
+
+
+class AnalyticsViewSet(ReplicaReadMixin, viewsets.GenericViewSet):
+    """Circulation and revenue figures for staff dashboards.
+
+    Served from the daily rollup tables, which the ``rollup_daily_stats``
+    task keeps up to date, so a request never scans ``Borrowing`` or
+    ``Payment``, and read from the replica when there is one.
+    """
+
+    permission_classes = (IsAdminUser,)
+    pagination_class = None
+
+    def get_range(self, serializer_class=DateRangeSerializer):
+        serializer = serializer_class(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    def in_range(self, queryset, params):
+        return queryset.filter(
+            date__gte=params["date_from"], date__lte=params["date_to"]
+        )
+
+    def range_response(self, params, **data):
+        return Response(
+            {
+                "date_from": params["date_from"],
+                "date_to": params["date_to"],
+                **data,
+            }
+        )
+
+    @action(detail=False, methods=["get"])
+    def circulation(self, request):
+        """Borrowings, returns and overdue rate per day."""
+        params = self.get_range()
+        days = self.in_range(DailyCirculationStats.objects, params).order_by(
+            "date"
+        )
+        return self.range_response(
+            params,
+            results=DailyCirculationStatsSerializer(days, many=True).data,
+        )
+
+    @action(detail=False, methods=["get"], url_path="top-books")
+    def top_books(self, request):
+        """The most borrowed books over the range."""
+        params = self.get_range(TopBooksQuerySerializer)
+        books = (
+            self.in_range(DailyBookStats.objects, params)
+            .values("book_id", "book__title", "book__author")
+            .annotate(
+                borrowed_count=Sum("borrowed_count"),
+                returned_count=Sum("returned_count"),
+            )
+            .order_by("-borrowed_count", "book_id")[: params["limit"]]
+        )
+        return self.range_response(
+            params, results=TopBookSerializer(books, many=True).data
+        )
+
+    @action(detail=False, methods=["get"])
+    def revenue(self, request):
+        """Paid amounts by payment type, in total and per day."""
+        params = self.get_range()
+        paid = self.in_range(
+            DailyPaymentStats.objects.filter(status=Payment.Status.PAID),
+            params,
+        )
+        totals = (
+            paid.values("type")
+            .annotate(payment_count=Sum("payment_count"), amount=Sum("amount"))
+            .order_by("type")
+        )
+        daily = (
+            paid.values("date", "type")
+            .annotate(payment_count=Sum("payment_count"), amount=Sum("amount"))
+            .order_by("date", "type")
+        )
+        return self.range_response(
+            params,
+            totals=RevenueSerializer(totals, many=True).data,
+            daily=RevenueSerializer(daily, many=True).data,
+        )
@@ -0,0 +1,151 @@
+"""WSGI versus ASGI under many concurrent slow clients.
+
+Both runs call Django's own handlers in-process with the same requests,
+all arriving at once. The WSGI handler serves them from a pool of worker
+threads, as a threaded WSGI server would, and a worker stays busy until
+its client has read the whole response. The ASGI handler serves every
+client from one event loop and hits the async endpoints, so a slow
+client only holds a suspended coroutine.
+
+Each request's latency is measured from the start of the run, so it
+includes the time spent waiting for a free worker.
+"""
+
+import asyncio
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.util import setup_testing_defaults
+
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+
+from benchmarks.harness import Recorder
+
+# Paths of the sync endpoint (served over WSGI) and its async variant.
+ENDPOINTS = {
+    "books": ("/api/books/", "/api/async/books/"),
+    "book": ("/api/books/{book}/", "/api/async/books/{book}/"),
+    "borrowings": ("/api/borrowings/", "/api/async/borrowings/"),
+}
+HOST = "localhost"
+
+
+def wsgi_request(app, path, headers, client_latency):
+    """Serve one GET through ``app``; return the status code."""
+    environ = {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": path,
+        "QUERY_STRING": "",
+        "HTTP_HOST": HOST,
+        "wsgi.input": io.BytesIO(),
+    }
+    for name, value in headers.items():
+        environ["HTTP_" + name.upper().replace("-", "_")] = value
+    setup_testing_defaults(environ)
+    statuses = []
+
+    def start_response(status, response_headers, exc_info=None):
+        statuses.append(int(status.split(" ", 1)[0]))
+
+    result = app(environ, start_response)
+    try:
+        for _ in result:
+            pass
+        # The worker writes to the client until it has read everything.
+        time.sleep(client_latency)
+    finally:
+        result.close()
+    return statuses[0]
+
+
+async def asgi_request(app, path, headers, client_latency):
+    """Serve one GET through ``app``; return the status code."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", HOST.encode())]
+        + [
+            (name.lower().encode(), value.encode())
+            for name, value in headers.items()
+        ],
+        "client": ("127.0.0.1", 0),
+        "server": (HOST, 80),
+    }
+    received = False
+    statuses = []
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # The client stays connected until the response is sent.
+        await asyncio.Future()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+        elif not message.get("more_body"):
+            await asyncio.sleep(client_latency)
+
+    await app(scope, receive, send)
+    return statuses[0]
+
+
+def requests_for(endpoints, clients, book):
+    """``(endpoint, sync path, async path)`` for each client, cycling
+    through ``endpoints``."""
+    return [
+        (name, *(path.format(book=book) for path in ENDPOINTS[name]))
+        for name in (endpoints[i % len(endpoints)] for i in range(clients))
+    ]
+
+
+def run_wsgi(requests, headers, threads, client_latency):
+    """Return the recorder and the wall-clock seconds of the run."""
+    app = get_wsgi_application()
+    recorder = Recorder()
+    started = time.perf_counter()
+
+    def serve(request):
+        endpoint, path, _ = request
+        try:
+            ok = wsgi_request(app, path, headers, client_latency) == 200
+        except Exception:
+            ok = False
+        recorder.add(endpoint, time.perf_counter() - started, ok)
+
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(serve, requests))
+    return recorder, time.perf_counter() - started
+
+
+def run_asgi(requests, headers, client_latency):
+    """Return the recorder and the wall-clock seconds of the run."""
+    app = get_asgi_application()
+    recorder = Recorder()
+
+    async def serve(request, started):
+        endpoint, _, path = request
+        try:
+            ok = await asgi_request(app, path, headers, client_latency) == 200
+        except Exception:
+            ok = False
+        recorder.add(endpoint, time.perf_counter() - started, ok)
+
+    async def main():
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(serve(request, started) for request in requests)
+        )
+        return time.perf_counter() - started
+
+    return recorder, asyncio.run(main())
@@ -0,0 +1,190 @@
+"""Endpoint load-test harness.
+
+Scenarios drive the API in-process through DRF's test client, so the
+numbers cover routing, middleware, authentication, serializers and the
+database, but not a web server or the network. Stripe and Telegram are
+replaced by the local fakes from ``helpers.fakes``.
+
+Results are per endpoint: request count, errors, p50/p95/p99 latency and
+requests per second of busy time (what one worker sustains on that
+endpoint). ``compare`` checks them against a stored baseline.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from unittest import mock
+
+import stripe
+from django.conf import settings
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from helpers import telegram_helper
+from helpers.fakes import FakeStripeServer, FakeTelegramServer
+
+WEBHOOK_SECRET = "whsec_benchmark"
+# Latency differences below this are noise, whatever the percentage.
+NOISE_FLOOR_MS = 2.0
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[rank - 1]
+
+
+class Recorder:
+    """Latencies and failures per endpoint, safe to share across
+    threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def reset(self):
+        with self.lock:
+            self.timings.clear()
+            self.errors.clear()
+
+    def add(self, endpoint, seconds, ok):
+        with self.lock:
+            self.timings[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def summary(self):
+        endpoints = {}
+        for endpoint, timings in sorted(self.timings.items()):
+            ordered = sorted(timings)
+            endpoints[endpoint] = {
+                "requests": len(ordered),
+                "errors": self.errors[endpoint],
+                "rps": round(len(ordered) / sum(ordered), 1),
+                "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+            }
+        return endpoints
+
+
+class BenchmarkClient:
+    """An API client that records the latency of every call under an
+    endpoint name such as ``"GET /api/books/"``."""
+
+    def __init__(self, recorder, user=None):
+        self.recorder = recorder
+        self.user = user
+        # A view that raises is recorded as a 500, not a crash.
+        self.client = APIClient(
+            raise_request_exception=False, HTTP_HOST="localhost"
+        )
+        if user is not None:
+            self.client.force_authenticate(user=user)
+
+    def call(self, endpoint, method, path, data=None, expect=200, **extra):
+        started = time.perf_counter()
+        response = getattr(self.client, method)(path, data, **extra)
+        elapsed = time.perf_counter() - started
+        self.recorder.add(endpoint, elapsed, response.status_code == expect)
+        return response
+
+    def timed(self, name, func, *args):
+        """Record a non-HTTP step, e.g. a Celery task run inline."""
+        started = time.perf_counter()
+        ok = True
+        try:
+            return func(*args)
+        except Exception:
+            ok = False
+        finally:
+            self.recorder.add(name, time.perf_counter() - started, ok)
+
+
+@contextmanager
+def local_services():
+    """Point Stripe and Telegram at local fakes for the duration."""
+    with ExitStack() as stack:
+        stripe_server = stack.enter_context(FakeStripeServer())
+        telegram_server = stack.enter_context(FakeTelegramServer())
+        stack.enter_context(
+            mock.patch.object(stripe, "api_base", stripe_server.url)
+        )
+        stack.enter_context(
+            mock.patch.object(stripe, "api_key", "sk_test_benchmark")
+        )
+        dispatcher = telegram_helper.TelegramDispatcher(
+            "123:BENCHMARK",
+            "42",
+            base_url=telegram_server.base_url,
+            rate_limit=0,
+        )
+        stack.callback(dispatcher.close, 5)
+        stack.enter_context(
+            mock.patch.object(telegram_helper, "_dispatcher", dispatcher)
+        )
+        stack.enter_context(
+            mock.patch.object(telegram_helper, "_dispatcher_pid", os.getpid())
+        )
+        stack.enter_context(
+            override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "localhost"],
+                STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET,
+                STRIPE_ASYNC_CHECKOUT=False,
+            )
+        )
+        yield stripe_server, telegram_server
+
+
+def compare(endpoints, baseline, tolerance):
+    """Endpoints that got slower or started failing since ``baseline``.
+
+    Returns ``{endpoint: reason}``. An endpoint regresses when its p95
+    grew by more than ``tolerance`` (a fraction) and by more than the
+    noise floor, or when it has errors the baseline did not have.
+    """
+    regressions = {}
+    for endpoint, result in endpoints.items():
+        before = baseline.get("endpoints", {}).get(endpoint)
+        if before is None:
+            continue
+        if result["errors"] and not before["errors"]:
+            regressions[endpoint] = f"{result['errors']} errors"
+            continue
+        limit = max(
+            before["p95_ms"] * (1 + tolerance),
+            before["p95_ms"] + NOISE_FLOOR_MS,
+        )
+        if result["p95_ms"] > limit:
+            change = result["p95_ms"] / before["p95_ms"] - 1
+            regressions[endpoint] = (
+                f"p95 {before['p95_ms']:.1f} -> {result['p95_ms']:.1f} ms "
+                f"({change:+.0%})"
+            )
+    return regressions
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(path, params, endpoints):
+    with open(path, "w") as f:
+        json.dump(
+            {"params": params, "endpoints": endpoints},
+            f,
+            indent=2,
+            sort_keys=True,
+        )
+        f.write("\n")
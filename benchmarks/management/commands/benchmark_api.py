@@ -0,0 +1,176 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from benchmarks.harness import (
+    Recorder,
+    compare,
+    load_baseline,
+    local_services,
+    save_baseline,
+)
+from benchmarks.scenarios import SCENARIOS, NotSeeded, Workload
+from benchmarks.seed import FULL_SIZE
+
+DEFAULT_BASELINE = Path(__file__).resolve().parents[2] / "baseline.json"
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the scripted API scenarios against the seeded database (see "
+        "seed_library) with Stripe and Telegram stubbed locally, report "
+        "p50/p95/p99 latency and requests/sec per endpoint, and compare "
+        "them with the stored baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scenarios",
+            default=",".join(SCENARIOS),
+            help=f"Comma-separated, from: {', '.join(SCENARIOS)}.",
+        )
+        parser.add_argument("--iterations", type=int, default=100)
+        parser.add_argument(
+            "--warmup",
+            type=int,
+            default=5,
+            help="Untimed iterations first, to fill caches and pools.",
+        )
+        parser.add_argument("--concurrency", type=int, default=1)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+        parser.add_argument(
+            "--save-baseline",
+            action="store_true",
+            help="Store this run as the new baseline.",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.2,
+            help="Allowed p95 growth over the baseline, as a fraction.",
+        )
+        parser.add_argument(
+            "--fail-on-regression",
+            action="store_true",
+            help="Exit with an error if any endpoint regressed.",
+        )
+
+    def handle(self, *args, **options):
+        names = [name for name in options["scenarios"].split(",") if name]
+        unknown = sorted(set(names) - set(SCENARIOS))
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(unknown)}.")
+
+        recorder = Recorder()
+        try:
+            workload = Workload(recorder, seed=options["seed"])
+        except NotSeeded as e:
+            raise CommandError(str(e))
+
+        # Seeded users relative to the full-size library, i.e. the
+        # seed_library --scale; latencies only compare at the same one.
+        scale = round(workload.seeded_users / FULL_SIZE["users"], 6)
+        baseline = load_baseline(options["baseline"])
+        if baseline is not None and not options["save_baseline"]:
+            baseline_scale = baseline.get("params", {}).get("scale")
+            if baseline_scale != scale:
+                raise CommandError(
+                    f"The baseline was recorded at scale {baseline_scale}, "
+                    f"but the database is seeded at scale {scale:g}. Seed a "
+                    "matching library or record a new baseline with "
+                    "--save-baseline."
+                )
+
+        concurrency = options["concurrency"]
+
+        # Every worker replays the same mix with its own random stream.
+        def run(rng, iterations):
+            for _ in range(iterations):
+                for name in names:
+                    SCENARIOS[name](workload, rng)
+
+        def worker(number):
+            rng = random.Random(options["seed"] * 1000 + number)
+            try:
+                run(rng, options["iterations"])
+            finally:
+                if concurrency > 1:
+                    connections.close_all()
+
+        with local_services():
+            run(random.Random(options["seed"]), options["warmup"])
+            recorder.reset()
+            started = time.perf_counter()
+            if concurrency > 1:
+                with ThreadPoolExecutor(concurrency) as executor:
+                    list(executor.map(worker, range(concurrency)))
+            else:
+                worker(0)
+            elapsed = time.perf_counter() - started
+
+        endpoints = recorder.summary()
+        total = sum(result["requests"] for result in endpoints.values())
+        self.report(endpoints, baseline)
+        self.stdout.write(
+            f"\n{total} calls in {elapsed:.1f}s "
+            f"({total / elapsed:.1f}/s with {concurrency} workers)"
+        )
+
+        if options["save_baseline"]:
+            params = {
+                key: options[key]
+                for key in (
+                    "scenarios",
+                    "iterations",
+                    "warmup",
+                    "concurrency",
+                    "seed",
+                )
+            }
+            params["scale"] = scale
+            save_baseline(options["baseline"], params, endpoints)
+            self.stdout.write(f"Baseline saved to {options['baseline']}.")
+            return
+        if baseline is None:
+            self.stdout.write("No baseline to compare with.")
+            return
+
+        regressions = compare(endpoints, baseline, options["tolerance"])
+        if not regressions:
+            self.stdout.write("No regressions against the baseline.")
+            return
+        self.stdout.write("Regressions:")
+        for endpoint, reason in regressions.items():
+            self.stdout.write(f"  {endpoint}: {reason}")
+        if options["fail_on_regression"]:
+            raise CommandError(
+                f"{len(regressions)} endpoints regressed against the "
+                "baseline."
+            )
+
+    def report(self, endpoints, baseline):
+        before = (baseline or {}).get("endpoints", {})
+        width = max(len(endpoint) for endpoint in endpoints)
+        self.stdout.write(
+            f"{'Endpoint':<{width}}  {'n':>5} {'err':>4} {'rps':>7} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'base p95':>9}"
+        )
+        for endpoint, result in endpoints.items():
+            base = before.get(endpoint)
+            change = ""
+            if base and base["p95_ms"]:
+                change = (
+                    f"{base['p95_ms']:9.2f} "
+                    f"({result['p95_ms'] / base['p95_ms'] - 1:+.0%})"
+                )
+            self.stdout.write(
+                f"{endpoint:<{width}}  {result['requests']:>5} "
+                f"{result['errors']:>4} {result['rps']:>7.1f} "
+                f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+                f"{result['p99_ms']:>8.2f} {change}"
+            )
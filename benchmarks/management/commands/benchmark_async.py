@@ -0,0 +1,118 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from benchmarks.concurrency import (
+    ENDPOINTS,
+    HOST,
+    requests_for,
+    run_asgi,
+    run_wsgi,
+)
+from benchmarks.seed import BENCH_USER_PREFIX
+from books.models import Book
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve many concurrent slow clients from the seeded database (see "
+        "seed_library) through the WSGI handler with a thread pool and "
+        "through the ASGI handler with the async endpoints, and compare "
+        "throughput and latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--endpoints",
+            default=",".join(ENDPOINTS),
+            help=f"Comma-separated, from: {', '.join(ENDPOINTS)}.",
+        )
+        parser.add_argument(
+            "--clients",
+            type=int,
+            default=1000,
+            help="Concurrent clients, one request each.",
+        )
+        parser.add_argument(
+            "--client-latency",
+            type=float,
+            default=1.0,
+            help="Seconds each client takes to read its response.",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=32,
+            help="Worker threads of the WSGI server.",
+        )
+        parser.add_argument(
+            "--servers",
+            default="wsgi,asgi",
+            help="Comma-separated, from: wsgi, asgi.",
+        )
+
+    def handle(self, *args, **options):
+        endpoints = [name for name in options["endpoints"].split(",") if name]
+        unknown = sorted(set(endpoints) - set(ENDPOINTS))
+        if unknown:
+            raise CommandError(f"Unknown endpoints: {', '.join(unknown)}.")
+        servers = [name for name in options["servers"].split(",") if name]
+        unknown = sorted(set(servers) - {"wsgi", "asgi"})
+        if unknown:
+            raise CommandError(f"Unknown servers: {', '.join(unknown)}.")
+
+        user = (
+            get_user_model()
+            .objects.filter(email__startswith=BENCH_USER_PREFIX)
+            .order_by("pk")
+            .first()
+        )
+        book = Book.objects.order_by("pk").first()
+        if user is None or book is None:
+            raise CommandError(
+                "No benchmark data; run seed_library on this database first."
+            )
+        requests = requests_for(endpoints, options["clients"], book.pk)
+        headers = {"Authorization": f"Bearer {AccessToken.for_user(user)}"}
+        connections.close_all()
+
+        self.stdout.write(
+            f"{options['clients']} clients, each reading its response in "
+            f"{options['client_latency'] * 1000:.0f} ms; WSGI with "
+            f"{options['threads']} threads."
+        )
+        self.stdout.write(
+            f"{'Server':<6} {'Endpoint':<12} {'n':>5} {'err':>4} "
+            f"{'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+        )
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, HOST]):
+            for server in servers:
+                if server == "wsgi":
+                    recorder, elapsed = run_wsgi(
+                        requests,
+                        headers,
+                        options["threads"],
+                        options["client_latency"],
+                    )
+                else:
+                    recorder, elapsed = run_asgi(
+                        requests, headers, options["client_latency"]
+                    )
+                self.report(server, recorder.summary(), elapsed)
+
+    def report(self, server, endpoints, elapsed):
+        total = sum(result["requests"] for result in endpoints.values())
+        for endpoint, result in endpoints.items():
+            self.stdout.write(
+                f"{server:<6} {endpoint:<12} {result['requests']:>5} "
+                f"{result['errors']:>4} {'':>8} {result['p50_ms']:>9.1f} "
+                f"{result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f}"
+            )
+        self.stdout.write(
+            f"{server:<6} {'all':<12} {total:>5} "
+            f"{sum(r['errors'] for r in endpoints.values()):>4} "
+            f"{total / elapsed:>8.1f}   in {elapsed:.2f}s"
+        )
@@ -0,0 +1,84 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+from benchmarks.seed import seed_books, vocabulary
+from books.models import Book
+from books.search import search_books
+
+PAGE_SIZE = 20
+
+
+def icontains_page(query):
+    """The naive alternative: a substring scan over both columns."""
+    condition = Q()
+    for term in query.split():
+        condition &= Q(title__icontains=term) | Q(author__icontains=term)
+    return list(Book.objects.filter(condition).order_by("id")[:PAGE_SIZE])
+
+
+def search_page(query):
+    queryset = search_books(Book.objects.all(), query)
+    return list(queryset.order_by("-rank", "id")[:PAGE_SIZE])
+
+
+def sample_queries(count, seed=0):
+    """Whole words, prefixes and two-word queries, common and rare."""
+    rng = random.Random(seed)
+    words = vocabulary(5000)
+    queries = []
+    for i in range(count):
+        word = rng.choice(words)
+        if i % 3 == 1:
+            word = word[: max(3, len(word) // 2)]
+        elif i % 3 == 2:
+            word = f"{word} {rng.choice(words)[:4]}"
+        queries.append(word)
+    return queries
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed books and compare the latency of the indexed ?search= "
+        "query with a naive icontains scan. Seeded rows are rolled back "
+        "unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000)
+        parser.add_argument("--queries", type=int, default=30)
+        parser.add_argument("--keep", action="store_true")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.stdout.write(f"Seeding {options['rows']} books...")
+            seed_books(options["rows"])
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+
+            queries = sample_queries(options["queries"])
+            for name, run in (
+                ("search", search_page),
+                ("icontains", icontains_page),
+            ):
+                self.report(name, run, queries)
+
+            if not options["keep"]:
+                transaction.set_rollback(True)
+
+    def report(self, name, run, queries):
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            run(query)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(
+            f"{name:<10} median {statistics.median(timings):8.1f} ms   "
+            f"p95 {p95:8.1f} ms   max {timings[-1]:8.1f} ms"
+        )
@@ -0,0 +1,102 @@
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from benchmarks.management.commands.benchmark_overdue_scan import peak_rss_mb
+from benchmarks.seed import (
+    seed_books,
+    seed_borrowings,
+    seed_payments,
+    seed_users,
+)
+from borrowings.models import Borrowing
+from borrowings.views import BorrowingViewSet, PaymentViewSet
+
+VIEWSETS = {
+    "borrowings": BorrowingViewSet,
+    "payments": PaymentViewSet,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed borrowings (and payments), stream them through the staff "
+        "export endpoint and report throughput and peak memory. Seeded "
+        "rows are rolled back unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=5_000_000)
+        parser.add_argument("--books", type=int, default=10_000)
+        parser.add_argument("--users", type=int, default=50_000)
+        parser.add_argument(
+            "--target", choices=sorted(VIEWSETS), default="borrowings"
+        )
+        parser.add_argument(
+            "--output", choices=("csv", "ndjson"), default="csv"
+        )
+        parser.add_argument("--gzip", action="store_true")
+        parser.add_argument("--keep", action="store_true")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.stdout.write(f"Seeding {options['rows']} borrowings...")
+            book_ids = seed_books(options["books"])
+            user_ids = seed_users(options["users"])
+            seed_borrowings(options["rows"], book_ids, user_ids)
+            del book_ids, user_ids
+            if options["target"] == "payments":
+                self.stdout.write("Seeding their payments...")
+                seed_payments(
+                    Borrowing.objects.values_list("id", "user_id").iterator()
+                )
+
+            self.run_export(options)
+
+            if not options["keep"]:
+                transaction.set_rollback(True)
+
+    def run_export(self, options):
+        staff = get_user_model().objects.create_user(
+            email="bench-export@example.com", password="!", is_staff=True
+        )
+        headers = {"HTTP_ACCEPT_ENCODING": "gzip"} if options["gzip"] else {}
+        request = APIRequestFactory().get(
+            "/export/", {"output": options["output"]}, **headers
+        )
+        force_authenticate(request, user=staff)
+        view = VIEWSETS[options["target"]].as_view({"get": "export"})
+
+        rss_before = peak_rss_mb()
+        tracemalloc.start()
+        started = time.perf_counter()
+
+        response = view(request)
+        first_byte = None
+        size = 0
+        for chunk in response.streaming_content:
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+            size += len(chunk)
+
+        elapsed = time.perf_counter() - started
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.stdout.write(f"Exported:            {size / 1024 / 1024:.1f} MB")
+        self.stdout.write(f"Time to first byte:  {first_byte or 0:.3f}s")
+        self.stdout.write(f"Export runtime:      {elapsed:.2f}s")
+        self.stdout.write(
+            f"Throughput:          {options['rows'] / elapsed:,.0f} rows/s"
+        )
+        self.stdout.write(
+            f"Export Python peak:  {traced_peak / 1024 / 1024:.1f} MB"
+        )
+        self.stdout.write(
+            f"Process peak RSS:    {peak_rss_mb():.1f} MB "
+            f"(before export: {rss_before:.1f} MB)"
+        )
@@ -0,0 +1,71 @@
+import csv
+import json
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from benchmarks.seed import generate_books
+from books.importer import FORMATS, IMPORT_BATCH_SIZE, import_books
+
+FIELDS = ("title", "author", "cover", "inventory", "daily_fee")
+
+
+def write_catalog(stream, count, input_format):
+    rows = (
+        {field: getattr(book, field) for field in FIELDS}
+        for book in generate_books(count)
+    )
+    if input_format == "csv":
+        writer = csv.DictWriter(stream, FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        for row in rows:
+            stream.write(json.dumps(row) + "\n")
+    stream.flush()
+
+
+class Command(BaseCommand):
+    help = (
+        "Write a catalog file and import it twice with import_books: once "
+        "into an empty table and once more as a pure upsert. Reports "
+        "rows/sec for both passes. Imported rows are rolled back unless "
+        "--keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=500_000)
+        parser.add_argument("--input-format", choices=FORMATS, default="csv")
+        parser.add_argument(
+            "--batch-size", type=int, default=IMPORT_BATCH_SIZE
+        )
+        parser.add_argument("--keep", action="store_true")
+
+    def handle(self, *args, **options):
+        input_format = options["input_format"]
+        with tempfile.NamedTemporaryFile(
+            "w+", suffix=f".{input_format}", newline="", encoding="utf-8"
+        ) as stream:
+            self.stdout.write(f"Writing {options['rows']} records...")
+            write_catalog(stream, options["rows"], input_format)
+
+            with transaction.atomic():
+                for name in ("insert", "upsert"):
+                    stream.seek(0)
+                    self.run_import(name, stream, options)
+                if not options["keep"]:
+                    transaction.set_rollback(True)
+
+    def run_import(self, name, stream, options):
+        started = time.perf_counter()
+        report = import_books(
+            stream, options["input_format"], options["batch_size"]
+        )
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{name:<7} {report.imported} rows in {elapsed:.2f}s "
+            f"({report.imported / elapsed:,.0f} rows/s, "
+            f"{report.failed} failed)"
+        )
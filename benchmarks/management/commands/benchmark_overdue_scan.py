@@ -0,0 +1,72 @@
+import resource
+import time
+import tracemalloc
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from benchmarks.seed import seed_books, seed_borrowings, seed_users
+from borrowings.tasks import check_borrowings_overdue
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed borrowings and measure the runtime and peak memory of the "
+        "nightly overdue scan. Seeded rows are rolled back unless --keep "
+        "is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000)
+        parser.add_argument("--books", type=int, default=10_000)
+        parser.add_argument("--users", type=int, default=50_000)
+        parser.add_argument("--keep", action="store_true")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.stdout.write(f"Seeding {options['rows']} borrowings...")
+            book_ids = seed_books(options["books"])
+            user_ids = seed_users(options["users"])
+            seed_borrowings(options["rows"], book_ids, user_ids)
+            del book_ids, user_ids
+
+            self.run_scan()
+
+            if not options["keep"]:
+                transaction.set_rollback(True)
+
+    def run_scan(self):
+        alerts = 0
+
+        def record(message):
+            nonlocal alerts
+            alerts += 1
+
+        rss_before = peak_rss_mb()
+        tracemalloc.start()
+        started = time.perf_counter()
+
+        with mock.patch(
+            "borrowings.tasks.send_message", new=record
+        ), mock.patch("borrowings.tasks.flush_messages"):
+            check_borrowings_overdue()
+
+        elapsed = time.perf_counter() - started
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.stdout.write(f"Overdue alerts:      {alerts}")
+        self.stdout.write(f"Scan runtime:        {elapsed:.2f}s")
+        self.stdout.write(
+            f"Scan Python peak:    {traced_peak / 1024 / 1024:.1f} MB"
+        )
+        self.stdout.write(
+            f"Process peak RSS:    {peak_rss_mb():.1f} MB "
+            f"(before scan: {rss_before:.1f} MB)"
+        )
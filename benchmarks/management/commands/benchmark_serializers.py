@@ -0,0 +1,103 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from benchmarks.seed import (
+    seed_books,
+    seed_borrowings,
+    seed_payments,
+    seed_users,
+)
+from books.models import Book
+from books.serializers import BookSerializer
+from borrowings.models import Borrowing, Payment
+from borrowings.serializers import BorrowingReadSerializer, PaymentSerializer
+from library_service.records import ValuesPlan
+
+SERIALIZERS = {
+    "books": (Book, BookSerializer),
+    "borrowings": (Borrowing, BorrowingReadSerializer),
+    "payments": (Payment, PaymentSerializer),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed borrowings with their payments, then render them (and "
+        "books) with the DRF serializers and with their values() plans, "
+        "and report objects/sec of each. Seeded rows are rolled back "
+        "unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows",
+            type=int,
+            default=10_000,
+            help="Objects rendered per run.",
+        )
+        parser.add_argument("--books", type=int, default=10_000)
+        parser.add_argument("--users", type=int, default=1_000)
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Runs of each; the fastest counts.",
+        )
+        parser.add_argument("--keep", action="store_true")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.stdout.write(f"Seeding {options['rows']} borrowings...")
+            book_ids = seed_books(max(options["books"], options["rows"]))
+            user_ids = seed_users(options["users"])
+            seed_borrowings(options["rows"], book_ids, user_ids)
+            del book_ids, user_ids
+            seed_payments(
+                Borrowing.objects.values_list("id", "user_id").iterator()
+            )
+
+            self.stdout.write(
+                f"{'':<11} {'serializer/s':>13} {'values/s':>11} "
+                f"{'speedup':>8}"
+            )
+            for name, (model, serializer_class) in SERIALIZERS.items():
+                self.compare(name, model, serializer_class, options)
+
+            if not options["keep"]:
+                transaction.set_rollback(True)
+
+    def compare(self, name, model, serializer_class, options):
+        queryset = model.objects.order_by("pk")[: options["rows"]]
+        plan = ValuesPlan.for_serializer(serializer_class)
+
+        def serialize():
+            serializer = serializer_class()
+            rows = queryset
+            if hasattr(serializer, "setup_eager_loading"):
+                rows = serializer.setup_eager_loading(rows)
+            return serializer_class(rows, many=True).data
+
+        def render():
+            return plan.render(list(plan.values(queryset)))
+
+        expected = serialize()
+        if [dict(item) for item in expected] != render():
+            self.stderr.write(f"{name}: the outputs differ.")
+        count = len(expected)
+        before = count / self.fastest(serialize, options["repeat"])
+        after = count / self.fastest(render, options["repeat"])
+        self.stdout.write(
+            f"{name:<11} {before:>13,.0f} {after:>11,.0f} "
+            f"{after / before:>7.1f}x"
+        )
+
+    @staticmethod
+    def fastest(func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
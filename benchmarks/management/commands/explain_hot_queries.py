@@ -0,0 +1,122 @@
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from benchmarks.seed import (
+    seed_books,
+    seed_borrowings,
+    seed_payments,
+    seed_users,
+)
+from books.models import Book
+from books.search import search_books
+from borrowings.models import Borrowing, Payment
+from borrowings.tasks import overdue_borrowings
+
+SEQUENTIAL_SCAN_PATTERNS = {
+    # "SCAN <table>" without "USING ... INDEX" is a full table scan.
+    "sqlite": r"\bSCAN {table}\b(?! USING)",
+    "postgresql": r"\bSeq Scan on {table}\b",
+}
+
+
+def hot_queries(user_id, session_id, search_query):
+    """Queries on the request path and in scheduled jobs, with the table
+    each one must reach through an index."""
+    tomorrow = timezone.now().date() + timedelta(days=1)
+    borrowings = Borrowing._meta.db_table
+    payments = Payment._meta.db_table
+    return [
+        (
+            "Book search page",
+            search_books(Book.objects.all(), search_query).order_by(
+                "-rank", "id"
+            )[:20],
+            Book._meta.db_table,
+        ),
+        (
+            "User borrowings page",
+            Borrowing.objects.filter(user_id=user_id).order_by(
+                "borrowing_date", "id"
+            )[:20],
+            borrowings,
+        ),
+        (
+            "User active borrowings",
+            Borrowing.objects.filter(
+                user_id=user_id, actual_returning_date__isnull=True
+            ),
+            borrowings,
+        ),
+        ("Overdue scan", overdue_borrowings(tomorrow), borrowings),
+        (
+            "Payment by session id",
+            Payment.objects.filter(session_id=session_id),
+            payments,
+        ),
+        (
+            "User payments page",
+            Payment.objects.filter(user_id=user_id).order_by("id")[:20],
+            payments,
+        ),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a dataset, EXPLAIN each hot query and fail if any of them "
+        "reads its main table with a sequential scan. Seeded rows are "
+        "rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=50_000)
+        parser.add_argument("--books", type=int, default=2_000)
+        parser.add_argument("--users", type=int, default=5_000)
+
+    def handle(self, *args, **options):
+        pattern = SEQUENTIAL_SCAN_PATTERNS.get(connection.vendor)
+        if pattern is None:
+            raise CommandError(
+                f"No plan checks for the {connection.vendor} backend."
+            )
+
+        with transaction.atomic():
+            self.seed(options)
+            failures = self.check_plans(pattern)
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError("Sequential scans in: " + ", ".join(failures))
+        self.stdout.write(self.style.SUCCESS("All hot queries use indexes."))
+
+    def seed(self, options):
+        book_ids = seed_books(options["books"])
+        user_ids = seed_users(options["users"])
+        seed_borrowings(options["rows"], book_ids, user_ids)
+        seed_payments(
+            Borrowing.objects.values_list("id", "user_id").iterator()
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def check_plans(self, pattern):
+        payment = Payment.objects.order_by("?").first()
+        book = Book.objects.order_by("?").first()
+        failures = []
+        for name, queryset, table in hot_queries(
+            payment.user_id, payment.session_id, book.title.split()[0]
+        ):
+            plan = queryset.explain()
+            scans = re.search(pattern.format(table=table), plan)
+            status = "SEQ SCAN" if scans else "ok"
+            self.stdout.write(f"[{status}] {name}")
+            self.stdout.write(
+                "\n".join(f"    {line}" for line in plan.splitlines())
+            )
+            if scans:
+                failures.append(name)
+        return failures
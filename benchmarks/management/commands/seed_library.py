@@ -0,0 +1,92 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from analytics.rollups import rollup
+from benchmarks.seed import (
+    BENCH_USER_PREFIX,
+    FULL_SIZE,
+    seed_books,
+    seed_borrowings,
+    seed_payments,
+    seed_users,
+)
+from borrowings.models import Borrowing
+
+# Borrowings are generated and inserted this many at a time, so that the
+# ids of 10M rows never sit in memory at once.
+BORROWING_CHUNK = 1_000_000
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with a library of realistic size for "
+        "benchmark_api: 100k books, 1M users and 10M borrowings by "
+        "default, with a payment per borrowing. The rows are kept."
+    )
+
+    def add_arguments(self, parser):
+        for name, count in FULL_SIZE.items():
+            parser.add_argument(f"--{name}", type=int, default=count)
+        parser.add_argument(
+            "--scale",
+            type=float,
+            default=1.0,
+            help="Multiply every count, e.g. 0.01 for a quick local run.",
+        )
+        parser.add_argument("--skip-payments", action="store_true")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        scale = options["scale"]
+        books, users, borrowings = (
+            max(1, int(options[name] * scale))
+            for name in ("books", "users", "borrowings")
+        )
+        if (
+            get_user_model()
+            .objects.filter(email__startswith=BENCH_USER_PREFIX)
+            .exists()
+        ):
+            raise CommandError("The database has already been seeded.")
+
+        seed = options["seed"]
+        started = time.perf_counter()
+        with transaction.atomic():
+            self.stdout.write(f"Seeding {books} books...")
+            book_ids = seed_books(books, seed=seed)
+            self.stdout.write(f"Seeding {users} users...")
+            user_ids = seed_users(users)
+            last_borrowing = Borrowing.objects.aggregate(last=Max("pk"))
+            for offset in range(0, borrowings, BORROWING_CHUNK):
+                count = min(BORROWING_CHUNK, borrowings - offset)
+                self.stdout.write(
+                    f"Seeding borrowings {offset + 1}-{offset + count}..."
+                )
+                seed_borrowings(count, book_ids, user_ids, seed=seed + offset)
+            del book_ids, user_ids
+
+            if not options["skip_payments"]:
+                self.stdout.write("Seeding payments...")
+                seed_payments(
+                    Borrowing.objects.filter(
+                        pk__gt=last_borrowing["last"] or 0
+                    )
+                    .values_list("pk", "user_id")
+                    .iterator(chunk_size=10_000),
+                    seed=seed,
+                )
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        today = timezone.now().date()
+        rollup(today - timedelta(days=30), today)
+        self.stdout.write(
+            f"Seeded in {time.perf_counter() - started:.0f}s; analytics "
+            f"rolled up for the last 30 days."
+        )
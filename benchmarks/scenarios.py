@@ -0,0 +1,191 @@
+"""Scripted user journeys for ``benchmark_api``.
+
+Each scenario is a function of ``(workload, rng)`` that runs one
+iteration of a journey through the API and records every call. Endpoint
+names use the route template (``/api/borrowings/{id}/return/``) so that
+results group across ids.
+"""
+
+import itertools
+import json
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from benchmarks.harness import WEBHOOK_SECRET, BenchmarkClient
+from benchmarks.seed import BENCH_USER_PREFIX, vocabulary
+from books.models import Book
+from borrowings.models import Borrowing, Payment
+from borrowings.tasks import send_pending_notifications
+from helpers.fakes import stripe_signature
+
+BENCH_STAFF_EMAIL = "bench-staff@example.com"
+CHECKOUT_BOOKS = 3
+
+
+class NotSeeded(Exception):
+    pass
+
+
+class Workload:
+    """The seeded users and books the scenarios pick from."""
+
+    def __init__(self, recorder, sample_size=1000, seed=0):
+        self.recorder = recorder
+        users = get_user_model().objects.filter(
+            email__startswith=BENCH_USER_PREFIX
+        )
+        bounds = users.aggregate(first=Min("pk"), last=Max("pk"))
+        if bounds["first"] is None:
+            raise NotSeeded("No benchmark users; run seed_library first.")
+        # Seeded users and books have contiguous primary keys.
+        self.user_range = (bounds["first"], bounds["last"])
+        self.seeded_users = bounds["last"] - bounds["first"] + 1
+        self.book_ids = list(
+            Book.objects.filter(inventory__gte=CHECKOUT_BOOKS * 2)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:sample_size]
+        )
+        if len(self.book_ids) < CHECKOUT_BOOKS:
+            raise NotSeeded("Not enough books in stock to check out.")
+        self.staff, _ = get_user_model().objects.get_or_create(
+            email=BENCH_STAFF_EMAIL, defaults={"is_staff": True}
+        )
+        self.words = vocabulary(5000, seed)
+        self.events = itertools.count(1)
+
+    def user(self, rng):
+        pk = rng.randint(*self.user_range)
+        return get_user_model().objects.get(pk=pk)
+
+    def client(self, user=None):
+        return BenchmarkClient(self.recorder, user)
+
+    def next_event_id(self):
+        return f"evt_bench_{time.time_ns()}_{next(self.events)}"
+
+
+def browse(workload, rng):
+    """Page through the catalog, search it and open a book."""
+    client = workload.client()
+    response = client.call("GET /api/books/", "get", "/api/books/")
+    next_page = response.json().get("next")
+    if next_page:
+        client.call("GET /api/books/?cursor=", "get", next_page)
+    query = rng.choice(workload.words)
+    if rng.random() < 0.5:
+        query = query[: max(3, len(query) // 2)]
+    client.call(
+        "GET /api/books/?search=", "get", "/api/books/", {"search": query}
+    )
+    client.call(
+        "GET /api/books/{id}/",
+        "get",
+        f"/api/books/{rng.choice(workload.book_ids)}/",
+    )
+
+
+def checkout(workload, rng):
+    """Borrow, pay through the webhook and return, as one user."""
+    client = workload.client(workload.user(rng))
+    due = (timezone.now().date() + timedelta(days=14)).isoformat()
+    book_ids = rng.sample(workload.book_ids, CHECKOUT_BOOKS + 1)
+
+    borrowing_ids = []
+    response = client.call(
+        "POST /api/borrowings/",
+        "post",
+        "/api/borrowings/",
+        {"book": book_ids[0], "expected_returning_date": due},
+        expect=201,
+    )
+    if response.status_code == 201:
+        # The create serializer does not echo the id.
+        borrowing_ids.append(
+            Borrowing.objects.filter(user=client.user, book_id=book_ids[0])
+            .latest("pk")
+            .pk
+        )
+    response = client.call(
+        "POST /api/borrowings/checkout/",
+        "post",
+        "/api/borrowings/checkout/",
+        {"books": book_ids[1:], "expected_returning_date": due},
+        format="json",
+        expect=201,
+    )
+    if response.status_code == 201:
+        borrowing_ids += [borrowing["id"] for borrowing in response.json()]
+
+    session_ids = set(
+        Payment.objects.filter(borrowing_id__in=borrowing_ids).values_list(
+            "session_id", flat=True
+        )
+    )
+    stripe_client = workload.client()
+    for session_id in sorted(filter(None, session_ids)):
+        payload = json.dumps(
+            {
+                "id": workload.next_event_id(),
+                "object": "event",
+                "type": "checkout.session.completed",
+                "data": {
+                    "object": {
+                        "id": session_id,
+                        "object": "checkout.session",
+                        "payment_status": "paid",
+                    }
+                },
+            }
+        )
+        stripe_client.call(
+            "POST /api/payments/webhook/",
+            "post",
+            "/api/payments/webhook/",
+            payload,
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE=stripe_signature(payload, WEBHOOK_SECRET),
+        )
+        client.call(
+            "GET /api/payments/success/",
+            "get",
+            "/api/payments/success/",
+            {"session_id": session_id},
+        )
+
+    client.call(
+        "GET /api/borrowings/?is_active=",
+        "get",
+        "/api/borrowings/",
+        {"is_active": "true"},
+    )
+    client.call("GET /api/payments/", "get", "/api/payments/")
+    client.call("GET /api/users/me/summary/", "get", "/api/users/me/summary/")
+    for borrowing_id in borrowing_ids:
+        client.call(
+            "POST /api/borrowings/{id}/return/",
+            "post",
+            f"/api/borrowings/{borrowing_id}/return/",
+        )
+    client.timed("task send_pending_notifications", send_pending_notifications)
+
+
+def staff(workload, rng):
+    """The staff dashboards and lists."""
+    client = workload.client(workload.staff)
+    for name in ("circulation", "top-books", "revenue"):
+        path = f"/api/analytics/{name}/"
+        client.call(f"GET {path}", "get", path)
+    client.call(
+        "GET /api/borrowings/ (staff)",
+        "get",
+        "/api/borrowings/",
+        {"is_active": rng.choice(("true", "false"))},
+    )
+    client.call("GET /api/payments/ (staff)", "get", "/api/payments/")
+
+
+SCENARIOS = {"browse": browse, "checkout": checkout, "staff": staff}
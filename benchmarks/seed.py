@@ -0,0 +1,163 @@
+import contextlib
+import itertools
+import random
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from books.models import Book
+from borrowings.models import Borrowing, Payment
+
+BATCH_SIZE = 5000
+BENCH_USER_PREFIX = "bench-user-"
+# A library of realistic size, which seed_library --scale multiplies.
+FULL_SIZE = {"books": 100_000, "users": 1_000_000, "borrowings": 10_000_000}
+SYLLABLES = (
+    "an bel cor da el fin gar hol is jor ka lin mor nes or pra quil ren "
+    "sol tam ul ver wyn xan yor zel"
+).split()
+
+
+def vocabulary(size, seed=0):
+    """``size`` distinct pronounceable made-up words."""
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))))
+    return sorted(words)
+
+
+@contextlib.contextmanager
+def historical_borrowing_dates():
+    """Let ``bulk_create`` keep explicit ``borrowing_date`` values."""
+    field = Borrowing._meta.get_field("borrowing_date")
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+def _bulk_insert(model, objects, batch_size):
+    ids = []
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) == batch_size:
+            ids.extend(o.pk for o in model.objects.bulk_create(batch))
+            batch = []
+    if batch:
+        ids.extend(o.pk for o in model.objects.bulk_create(batch))
+    return ids
+
+
+def generate_books(count, seed=0):
+    """Yield ``count`` unsaved books with two-to-six word titles.
+
+    Words are drawn from a fixed vocabulary with a skewed distribution,
+    so some words are common and others rare, as in a real catalog.
+    """
+    rng = random.Random(seed)
+    words = vocabulary(5000, seed)
+    rng.shuffle(words)
+    cum_weights = list(
+        itertools.accumulate(1 / (rank + 1) for rank in range(len(words)))
+    )
+    names = [word.capitalize() for word in words[:2000]]
+
+    for i in range(count):
+        picked = rng.choices(
+            words, cum_weights=cum_weights, k=rng.randint(2, 6)
+        )
+        yield Book(
+            title=" ".join(picked).capitalize(),
+            # Distinct for the first 4M books, so that the natural key
+            # (title, author, cover) never collides.
+            author=f"{names[i % 2000]} {names[i // 2000 % 2000]}",
+            cover=rng.choice((Book.HARD, Book.SOFT)),
+            inventory=rng.randint(0, 20),
+            daily_fee=f"{rng.randint(10, 500) / 100:.2f}",
+        )
+
+
+def seed_books(count, batch_size=BATCH_SIZE, seed=0):
+    return _bulk_insert(Book, generate_books(count, seed), batch_size)
+
+
+def seed_users(count, batch_size=BATCH_SIZE):
+    user_model = get_user_model()
+    users = (
+        # Unusable password: hashing a million passwords is not the point.
+        user_model(email=f"{BENCH_USER_PREFIX}{i}@example.com", password="!")
+        for i in range(count)
+    )
+    return _bulk_insert(user_model, users, batch_size)
+
+
+def seed_borrowings(
+    count,
+    book_ids,
+    user_ids,
+    active_ratio=0.05,
+    history_days=365,
+    batch_size=BATCH_SIZE,
+    seed=0,
+):
+    """Insert ``count`` borrowings spread over the last ``history_days``.
+
+    Roughly ``active_ratio`` of them are still out; the rest were returned,
+    which matches the shape of a long-running library: a small active set
+    on top of a large returned history.
+    """
+    rng = random.Random(seed)
+    today = timezone.now().date()
+
+    def generate():
+        for _ in range(count):
+            borrowing_date = today - timedelta(
+                days=rng.randint(0, history_days)
+            )
+            loan_days = rng.randint(7, 30)
+            expected_returning_date = borrowing_date + timedelta(
+                days=loan_days
+            )
+            actual_returning_date = None
+            if rng.random() >= active_ratio:
+                actual_returning_date = min(
+                    today,
+                    borrowing_date
+                    + timedelta(days=rng.randint(1, loan_days + 10)),
+                )
+            yield Borrowing(
+                book_id=rng.choice(book_ids),
+                user_id=rng.choice(user_ids),
+                borrowing_date=borrowing_date,
+                expected_returning_date=expected_returning_date,
+                actual_returning_date=actual_returning_date,
+            )
+
+    with historical_borrowing_dates():
+        return _bulk_insert(Borrowing, generate(), batch_size)
+
+
+def seed_payments(borrowings, paid_ratio=0.8, batch_size=BATCH_SIZE, seed=0):
+    """Insert one borrowing-fee payment per ``(borrowing_id, user_id)``."""
+    rng = random.Random(seed)
+    payments = (
+        Payment(
+            status=(
+                Payment.Status.PAID
+                if rng.random() < paid_ratio
+                else Payment.Status.PENDING
+            ),
+            type=Payment.Type.PAYMENT,
+            borrowing_id=borrowing_id,
+            user_id=user_id,
+            session_url=f"https://checkout.stripe.com/pay/cs_bench_{i}",
+            session_id=f"cs_bench_{i}",
+            money_to_pay=f"{rng.randint(100, 5000) / 100:.2f}",
+        )
+        for i, (borrowing_id, user_id) in enumerate(borrowings)
+    )
+    return _bulk_insert(Payment, payments, batch_size)
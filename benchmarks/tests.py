@@ -0,0 +1,264 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, TransactionTestCase
+
+from benchmarks.harness import compare, percentile
+from benchmarks.management.commands import explain_hot_queries
+from books.models import Book
+from borrowings.models import Borrowing, Payment
+
+
+class BenchmarkCommandsTest(TestCase):
+    def test_benchmark_overdue_scan_rolls_back_seeded_rows(self):
+        out = StringIO()
+        call_command(
+            "benchmark_overdue_scan",
+            rows=200,
+            books=10,
+            users=10,
+            stdout=out,
+        )
+        self.assertIn("Scan runtime", out.getvalue())
+        self.assertIn("Process peak RSS", out.getvalue())
+        self.assertFalse(Borrowing.objects.exists())
+
+    def test_benchmark_book_search_compares_with_icontains(self):
+        out = StringIO()
+        call_command("benchmark_book_search", rows=500, queries=6, stdout=out)
+        self.assertIn("search", out.getvalue())
+        self.assertIn("icontains", out.getvalue())
+        self.assertFalse(Book.objects.exists())
+
+    def test_benchmark_export_streams_seeded_rows(self):
+        out = StringIO()
+        call_command(
+            "benchmark_export",
+            rows=300,
+            books=10,
+            users=10,
+            target="payments",
+            gzip=True,
+            stdout=out,
+        )
+        self.assertIn("Throughput", out.getvalue())
+        self.assertFalse(Payment.objects.exists())
+
+    def test_benchmark_import_reports_throughput(self):
+        out = StringIO()
+        call_command(
+            "benchmark_import", rows=300, input_format="jsonl", stdout=out
+        )
+        self.assertIn("upsert  300 rows", out.getvalue())
+        self.assertFalse(Book.objects.exists())
+
+    def test_benchmark_serializers_matches_outputs(self):
+        out, err = StringIO(), StringIO()
+        call_command(
+            "benchmark_serializers",
+            rows=50,
+            books=10,
+            users=5,
+            repeat=1,
+            stdout=out,
+            stderr=err,
+        )
+        for name in ("books", "borrowings", "payments"):
+            self.assertIn(name, out.getvalue())
+        self.assertEqual(err.getvalue(), "")
+        self.assertFalse(Borrowing.objects.exists())
+
+    def test_explain_hot_queries_passes_with_indexes(self):
+        out = StringIO()
+        call_command(
+            "explain_hot_queries", rows=2000, books=50, users=100, stdout=out
+        )
+        self.assertIn("All hot queries use indexes.", out.getvalue())
+        self.assertFalse(Payment.objects.exists())
+
+    def test_explain_hot_queries_fails_on_sequential_scan(self):
+        unindexed = [
+            (
+                "Payments by amount",
+                Payment.objects.filter(money_to_pay="10.00"),
+                Payment._meta.db_table,
+            )
+        ]
+        with patch.object(
+            explain_hot_queries, "hot_queries", return_value=unindexed
+        ):
+            with self.assertRaisesMessage(CommandError, "Payments by amount"):
+                call_command(
+                    "explain_hot_queries",
+                    rows=200,
+                    books=10,
+                    users=10,
+                    stdout=StringIO(),
+                )
+
+
+class ApiBenchmarkTest(TestCase):
+    def setUp(self):
+        handle, self.baseline = tempfile.mkstemp(suffix=".json")
+        os.close(handle)
+        os.remove(self.baseline)
+        self.addCleanup(
+            lambda: os.path.exists(self.baseline) and os.remove(self.baseline)
+        )
+
+    def seed(self):
+        call_command(
+            "seed_library",
+            books=20,
+            users=10,
+            borrowings=50,
+            stdout=StringIO(),
+        )
+
+    def run_benchmark(self, **options):
+        out = StringIO()
+        call_command(
+            "benchmark_api",
+            iterations=2,
+            warmup=0,
+            baseline=self.baseline,
+            stdout=out,
+            **options,
+        )
+        return out.getvalue()
+
+    def test_seed_library_refuses_to_seed_twice(self):
+        self.seed()
+        self.assertEqual(Borrowing.objects.count(), 50)
+        self.assertEqual(Payment.objects.count(), 50)
+        with self.assertRaisesMessage(CommandError, "already been seeded"):
+            self.seed()
+
+    def test_benchmark_api_requires_seeded_database(self):
+        with self.assertRaisesMessage(CommandError, "seed_library"):
+            self.run_benchmark()
+
+    def test_benchmark_api_reports_every_endpoint_and_saves_baseline(self):
+        self.seed()
+
+        output = self.run_benchmark(save_baseline=True)
+
+        with open(self.baseline) as f:
+            baseline = json.load(f)
+        endpoints = baseline["endpoints"]
+        for endpoint in (
+            "GET /api/books/?search=",
+            "POST /api/borrowings/checkout/",
+            "POST /api/payments/webhook/",
+            "POST /api/borrowings/{id}/return/",
+            "GET /api/analytics/top-books/",
+        ):
+            self.assertIn(endpoint, output)
+            self.assertEqual(endpoints[endpoint]["errors"], 0, endpoint)
+        self.assertEqual(
+            Payment.objects.filter(
+                session_id__startswith="cs_fake_",
+                status=Payment.Status.PAID,
+            ).count(),
+            8,
+        )
+
+        # Two iterations are too few for a meaningful comparison.
+        self.assertIn("No regressions", self.run_benchmark(tolerance=100))
+
+    def test_benchmark_api_fails_on_regression(self):
+        self.seed()
+        self.run_benchmark(scenarios="browse", save_baseline=True)
+        with open(self.baseline) as f:
+            baseline = json.load(f)
+        for result in baseline["endpoints"].values():
+            result["p95_ms"] = 0.001
+        with open(self.baseline, "w") as f:
+            json.dump(baseline, f)
+
+        # The browse endpoints can answer within the noise floor.
+        with patch("benchmarks.harness.NOISE_FLOOR_MS", 0):
+            with self.assertRaisesMessage(CommandError, "regressed"):
+                self.run_benchmark(scenarios="browse", fail_on_regression=True)
+
+    def test_benchmark_api_refuses_baseline_of_another_scale(self):
+        self.seed()
+        self.run_benchmark(scenarios="browse", save_baseline=True)
+        with open(self.baseline) as f:
+            baseline = json.load(f)
+        self.assertEqual(baseline["params"]["scale"], 0.00001)
+        baseline["params"]["scale"] = 0.01
+        with open(self.baseline, "w") as f:
+            json.dump(baseline, f)
+
+        with self.assertRaisesMessage(CommandError, "scale 0.01"):
+            self.run_benchmark(scenarios="browse")
+
+    def test_percentile_uses_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.95), 95)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([7], 0.99), 7)
+
+    def test_compare_ignores_noise_and_flags_new_errors(self):
+        baseline = {
+            "endpoints": {
+                "GET /a": {"p95_ms": 2.0, "errors": 0},
+                "GET /b": {"p95_ms": 50.0, "errors": 0},
+                "GET /c": {"p95_ms": 50.0, "errors": 0},
+            }
+        }
+        results = {
+            "GET /a": {"p95_ms": 3.5, "errors": 0},
+            "GET /b": {"p95_ms": 70.0, "errors": 0},
+            "GET /c": {"p95_ms": 40.0, "errors": 2},
+            "GET /new": {"p95_ms": 999.0, "errors": 0},
+        }
+
+        regressions = compare(results, baseline, tolerance=0.2)
+
+        self.assertEqual(sorted(regressions), ["GET /b", "GET /c"])
+
+
+class AsyncBenchmarkTest(TransactionTestCase):
+    # The handlers serve requests from threads with their own database
+    # connections, which only see committed rows.
+
+    def run_benchmark(self, **options):
+        out = StringIO()
+        call_command(
+            "benchmark_async",
+            clients=6,
+            client_latency=0,
+            threads=2,
+            stdout=out,
+            **options,
+        )
+        return out.getvalue()
+
+    def test_requires_seeded_database(self):
+        with self.assertRaisesMessage(CommandError, "seed_library"):
+            self.run_benchmark()
+
+    def test_serves_every_endpoint_over_wsgi_and_asgi(self):
+        call_command(
+            "seed_library",
+            books=5,
+            users=3,
+            borrowings=10,
+            stdout=StringIO(),
+        )
+
+        output = self.run_benchmark()
+
+        rows = [line.split() for line in output.splitlines()]
+        served = {(row[0], row[1]): row[2:4] for row in rows if len(row) > 3}
+        for server in ("wsgi", "asgi"):
+            for endpoint in ("books", "book", "borrowings"):
+                self.assertEqual(served[server, endpoint], ["2", "0"])
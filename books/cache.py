@@ -0,0 +1,136 @@
+"""Read-through cache for the public book catalog.
+
+Each book's serialized payload is cached under its own key, and a list
+page is cached as just the ids it contains. Changing a book (e.g. its
+inventory on borrow/return) therefore only evicts that book's entry, and
+cached pages pick up the fresh payload on their next read. Creating,
+deleting or editing a book can change which books a page contains, so it
+also bumps the catalog generation that is part of every page key.
+"""
+
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+GENERATION_KEY = "catalog:generation"
+
+
+def book_key(pk):
+    return f"catalog:book:{pk}"
+
+
+def _hash(value):
+    raw = json.dumps(value, cls=DjangoJSONEncoder, sort_keys=True)
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def get_generation():
+    # A fresh, never-reused value if the key was evicted, so page entries
+    # written under an older generation are not picked up again.
+    cache.add(GENERATION_KEY, time.time_ns(), None)
+    return cache.get(GENERATION_KEY)
+
+
+async def aget_generation():
+    await cache.aadd(GENERATION_KEY, time.time_ns(), None)
+    return await cache.aget(GENERATION_KEY)
+
+
+def page_key(request, generation=None):
+    url = request.build_absolute_uri()
+    if generation is None:
+        generation = get_generation()
+    return f"catalog:page:{generation}:{_hash(url)}"
+
+
+def make_entry(data, updated_at):
+    return {
+        "data": data,
+        "etag": _hash(data),
+        "modified": int(updated_at.timestamp()),
+    }
+
+
+def store_books(books, serialize):
+    """Serialize ``books`` and cache each payload; return the entries.
+
+    Books are ``values()`` rows with at least ``id`` and ``updated_at``.
+    """
+    entries = [
+        make_entry(data, book["updated_at"])
+        for book, data in zip(books, serialize(books))
+    ]
+    cache.set_many(
+        {book_key(book["id"]): entry for book, entry in zip(books, entries)},
+        settings.CATALOG_CACHE_TIMEOUT,
+    )
+    return entries
+
+
+def get_books(ids, load, serialize):
+    """Return cached entries for ``ids`` in order, loading any misses.
+
+    Ids whose book no longer exists are left out.
+    """
+    cached = cache.get_many([book_key(pk) for pk in ids])
+    missing = [pk for pk in ids if book_key(pk) not in cached]
+    if missing:
+        books = list(load(missing))
+        for book, entry in zip(books, store_books(books, serialize)):
+            cached[book_key(book["id"])] = entry
+    return [cached[book_key(pk)] for pk in ids if book_key(pk) in cached]
+
+
+async def astore_books(books, serialize):
+    entries = [
+        make_entry(data, book["updated_at"])
+        for book, data in zip(books, serialize(books))
+    ]
+    await cache.aset_many(
+        {book_key(book["id"]): entry for book, entry in zip(books, entries)},
+        settings.CATALOG_CACHE_TIMEOUT,
+    )
+    return entries
+
+
+async def aget_books(ids, load, serialize):
+    """``get_books`` for async views."""
+    cached = await cache.aget_many([book_key(pk) for pk in ids])
+    missing = [pk for pk in ids if book_key(pk) not in cached]
+    if missing:
+        books = [book async for book in load(missing)]
+        entries = await astore_books(books, serialize)
+        for book, entry in zip(books, entries):
+            cached[book_key(book["id"])] = entry
+    return [cached[book_key(pk)] for pk in ids if book_key(pk) in cached]
+
+
+def page_etag(entries, *extra):
+    return _hash([entry["etag"] for entry in entries] + list(extra))
+
+
+def last_modified(entries):
+    return max((entry["modified"] for entry in entries), default=None)
+
+
+def invalidate_books(ids):
+    """Evict the given books once the current transaction commits."""
+    keys = [book_key(pk) for pk in ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_catalog():
+    """Retire every cached list page once the transaction commits."""
+
+    def bump():
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            get_generation()
+
+    transaction.on_commit(bump)
@@ -0,0 +1,150 @@
+"""Bulk catalog import from CSV or JSON Lines.
+
+Records are read from the stream and validated a batch at a time, then
+upserted on the natural key (title, author, cover) with a single
+``INSERT ... ON CONFLICT DO UPDATE`` per batch. A bad record is reported
+with its number and skipped; it does not stop the rest of the import.
+"""
+
+import csv
+import json
+
+from django.db import DatabaseError, transaction
+from rest_framework import serializers
+
+from .cache import invalidate_books, invalidate_catalog
+from .models import Book
+
+IMPORT_BATCH_SIZE = 1000
+# Errors kept in the report; the rest are only counted.
+MAX_REPORTED_ERRORS = 1000
+
+NATURAL_KEY = ("title", "author", "cover")
+UPDATE_FIELDS = ("inventory", "daily_fee", "updated_at")
+FORMATS = ("csv", "jsonl")
+
+
+class BookImportSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Book
+        fields = ["title", "author", "cover", "inventory", "daily_fee"]
+        # Existing books are updated rather than rejected as duplicates,
+        # and the unique check would cost a query per record.
+        validators = []
+
+
+class ImportReport:
+    def __init__(self):
+        self.records = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, record, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"record": record, "errors": errors})
+
+    def as_dict(self):
+        return {
+            "records": self.records,
+            "imported": self.imported,
+            "failed": self.failed,
+            "errors": self.errors,
+        }
+
+
+def read_csv(stream):
+    yield from csv.DictReader(stream)
+
+
+def read_jsonl(stream):
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"Invalid JSON: {e}")
+            continue
+        if not isinstance(record, dict):
+            yield ValueError("Expected a JSON object.")
+            continue
+        yield record
+
+
+READERS = {"csv": read_csv, "jsonl": read_jsonl}
+
+
+def guess_format(filename):
+    if filename.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    return "csv"
+
+
+def batches(records, size):
+    batch = []
+    for number, record in enumerate(records, start=1):
+        batch.append((number, record))
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def upsert_books(books):
+    """Insert ``books``, updating the stock and fee of existing ones."""
+    # Within one statement a key may only be touched once; keep the last.
+    unique = {tuple(getattr(b, f) for f in NATURAL_KEY): b for b in books}
+    return Book.objects.bulk_create(
+        unique.values(),
+        update_conflicts=True,
+        unique_fields=NATURAL_KEY,
+        update_fields=UPDATE_FIELDS,
+    )
+
+
+def import_batch(batch, report, validator):
+    report.records += len(batch)
+    valid = []
+    for number, record in batch:
+        if isinstance(record, Exception):
+            report.add_error(number, {"non_field_errors": [str(record)]})
+            continue
+        try:
+            valid.append((number, Book(**validator.run_validation(record))))
+        except serializers.ValidationError as e:
+            report.add_error(number, e.detail)
+    if not valid:
+        return
+
+    try:
+        with transaction.atomic():
+            books = upsert_books([book for _, book in valid])
+            invalidate_books([book.pk for book in books])
+    except DatabaseError as e:
+        for number, _ in valid:
+            report.add_error(number, {"non_field_errors": [str(e)]})
+        return
+    report.imported += len(valid)
+
+
+def import_books(
+    stream, input_format="csv", batch_size=IMPORT_BATCH_SIZE, progress=None
+):
+    """Import books from the text ``stream`` and return an
+    ``ImportReport``. ``progress`` is called with the report after each
+    batch."""
+    report = ImportReport()
+    # One serializer validates every record, the way a ListSerializer
+    # would, but a bad record does not discard the good ones around it.
+    validator = BookImportSerializer()
+    records = READERS[input_format](stream)
+    for batch in batches(records, batch_size):
+        import_batch(batch, report, validator)
+        if progress is not None:
+            progress(report)
+    if report.imported:
+        invalidate_catalog()
+    return report
@@ -0,0 +1,61 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from books.importer import (
+    FORMATS,
+    IMPORT_BATCH_SIZE,
+    guess_format,
+    import_books,
+)
+
+# Errors printed at the end of a run; the full count is always shown.
+ERRORS_SHOWN = 20
+
+
+class Command(BaseCommand):
+    help = (
+        "Import books from a CSV or JSON Lines file (or - for stdin), "
+        "updating the inventory and daily fee of books that already exist "
+        "with the same title, author and cover."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--input-format", choices=FORMATS)
+        parser.add_argument(
+            "--batch-size", type=int, default=IMPORT_BATCH_SIZE
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        input_format = options["input_format"] or guess_format(path)
+
+        if path == "-":
+            report = self.run(sys.stdin, input_format, options)
+        else:
+            with open(path, newline="", encoding="utf-8") as stream:
+                report = self.run(stream, input_format, options)
+
+        for error in report.errors[:ERRORS_SHOWN]:
+            self.stderr.write(f"Record {error['record']}: {error['errors']}")
+        summary = (
+            f"Imported {report.imported} of {report.records} records, "
+            f"{report.failed} failed."
+        )
+        style = self.style.WARNING if report.failed else self.style.SUCCESS
+        self.stdout.write(style(summary))
+
+    def run(self, stream, input_format, options):
+        return import_books(
+            stream,
+            input_format,
+            batch_size=options["batch_size"],
+            progress=self.progress,
+        )
+
+    def progress(self, report):
+        self.stdout.write(
+            f"{report.records} records read, {report.imported} imported, "
+            f"{report.failed} failed"
+        )
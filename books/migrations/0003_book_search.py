@@ -0,0 +1,78 @@
+# Generated by Django 5.0.6 on 2026-10-18 10:29
+
+import books.search
+import django.db.models.deletion
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations, models
+
+from . import _sqlite_fts
+
+SEARCH_INDEX_NAME = "book_search_idx"
+
+
+def search_index():
+    # Must stay identical to books.search.search_vector().
+    return GinIndex(
+        SearchVector("title", weight="A", config="simple")
+        + SearchVector("author", weight="B", config="simple"),
+        name=SEARCH_INDEX_NAME,
+    )
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.add_index(
+            apps.get_model("books", "Book"), search_index()
+        )
+    elif vendor == "sqlite":
+        _sqlite_fts.create_index(schema_editor)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.remove_index(
+            apps.get_model("books", "Book"), search_index()
+        )
+    elif vendor == "sqlite":
+        _sqlite_fts.drop_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0002_book_updated_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BookSearchIndex",
+            fields=[
+                (
+                    "book",
+                    models.OneToOneField(
+                        db_column="rowid",
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name="search_index",
+                        serialize=False,
+                        to="books.book",
+                    ),
+                ),
+                ("title", models.TextField()),
+                ("author", models.TextField()),
+                (
+                    "document",
+                    books.search.FullTextField(db_column="books_book_fts"),
+                ),
+                ("rank", models.FloatField()),
+            ],
+            options={
+                "db_table": "books_book_fts",
+                "managed": False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.0.6 on 2026-10-18 10:43
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+from . import _sqlite_fts
+
+
+def merge_duplicate_books(apps, schema_editor):
+    """Fold the books that share a natural key into the oldest one.
+
+    The catalog allowed duplicates before this constraint. Each group
+    keeps its lowest id with the copies of the whole group; the
+    borrowings of the others move to it before they are deleted.
+    """
+    Book = apps.get_model("books", "Book")
+    Borrowing = apps.get_model("borrowings", "Borrowing")
+    groups = (
+        Book.objects.values("title", "author", "cover")
+        .annotate(
+            count=Count("id"), keep=Min("id"), inventory=Sum("inventory")
+        )
+        .filter(count__gt=1)
+        .order_by()
+    )
+    for group in groups:
+        duplicates = Book.objects.filter(
+            title=group["title"], author=group["author"], cover=group["cover"]
+        ).exclude(pk=group["keep"])
+        Borrowing.objects.filter(book__in=duplicates).update(
+            book_id=group["keep"]
+        )
+        Book.objects.filter(pk=group["keep"]).update(
+            inventory=group["inventory"]
+        )
+        duplicates.delete()
+
+
+def restore_search_triggers(apps, schema_editor):
+    # Adding the constraint rebuilt books_book on SQLite, dropping the
+    # triggers that keep the FTS index in sync.
+    if schema_editor.connection.vendor == "sqlite":
+        _sqlite_fts.create_triggers(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0003_book_search"),
+        ("borrowings", "0013_payment_created_at"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_books, migrations.RunPython.noop),
+        # Also needed when unapplying, after the constraint is removed.
+        migrations.RunPython(
+            migrations.RunPython.noop, restore_search_triggers
+        ),
+        migrations.AddConstraint(
+            model_name="book",
+            constraint=models.UniqueConstraint(
+                fields=("title", "author", "cover"),
+                name="book_natural_key_unique",
+            ),
+        ),
+        migrations.RunPython(
+            restore_search_triggers, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,72 @@
+"""SQL for the SQLite FTS5 index over book titles and authors.
+
+SQLite applies most schema changes to ``books_book`` by rebuilding the
+table, which drops its triggers. Migrations that alter ``books_book``
+therefore call ``create_triggers()`` again afterwards.
+"""
+
+TABLE_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS books_book_fts USING fts5(
+        title, author,
+        content='books_book', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    # Title hits weigh ten times as much as author hits.
+    "INSERT INTO books_book_fts(books_book_fts, rank) "
+    "VALUES ('rank', 'bm25(10.0, 1.0)')",
+]
+
+TRIGGER_SQL = [
+    """
+    CREATE TRIGGER IF NOT EXISTS books_book_fts_insert
+    AFTER INSERT ON books_book BEGIN
+        INSERT INTO books_book_fts(rowid, title, author)
+        VALUES (new.id, new.title, new.author);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS books_book_fts_delete
+    AFTER DELETE ON books_book BEGIN
+        INSERT INTO books_book_fts(books_book_fts, rowid, title, author)
+        VALUES ('delete', old.id, old.title, old.author);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS books_book_fts_update
+    AFTER UPDATE OF title, author ON books_book BEGIN
+        INSERT INTO books_book_fts(books_book_fts, rowid, title, author)
+        VALUES ('delete', old.id, old.title, old.author);
+        INSERT INTO books_book_fts(rowid, title, author)
+        VALUES (new.id, new.title, new.author);
+    END
+    """,
+]
+
+REBUILD_SQL = "INSERT INTO books_book_fts(books_book_fts) VALUES ('rebuild')"
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS books_book_fts_insert",
+    "DROP TRIGGER IF EXISTS books_book_fts_delete",
+    "DROP TRIGGER IF EXISTS books_book_fts_update",
+    "DROP TABLE IF EXISTS books_book_fts",
+]
+
+
+def create_index(schema_editor):
+    for sql in TABLE_SQL:
+        schema_editor.execute(sql)
+    create_triggers(schema_editor)
+
+
+def create_triggers(schema_editor):
+    """(Re)create the sync triggers and reindex from ``books_book``."""
+    for sql in TRIGGER_SQL:
+        schema_editor.execute(sql)
+    schema_editor.execute(REBUILD_SQL)
+
+
+def drop_index(schema_editor):
+    for sql in DROP_SQL:
+        schema_editor.execute(sql)
@@ -1,4 +1,60 @@
 from django.db import models
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .cache import invalidate_books
+from .search import FullTextField
+
+
+class BookManager(models.Manager):
+    def reserve(self, book_id):
+        """Take one copy of a book in a single conditional UPDATE.
+
+        Returns False when no copy is left, so concurrent checkouts can
+        neither oversell nor overwrite each other's inventory.
+        """
+        reserved = self.filter(pk=book_id, inventory__gt=0).update(
+            inventory=F("inventory") - 1, updated_at=timezone.now()
+        )
+        if reserved:
+            invalidate_books([book_id])
+        return bool(reserved)
+
+    def reserve_many(self, counts):
+        """Take ``counts[book_id]`` copies of each book in one UPDATE.
+
+        Books without enough copies are left alone and False is returned;
+        the caller then rolls back its transaction to undo the rest.
+        """
+        wanted = Case(
+            *(When(pk=pk, then=Value(count)) for pk, count in counts.items()),
+            output_field=IntegerField(),
+        )
+        reserved = self.filter(pk__in=counts, inventory__gte=wanted).update(
+            inventory=F("inventory") - wanted, updated_at=timezone.now()
+        )
+        invalidate_books(list(counts))
+        return reserved == len(counts)
+
+    def release(self, book_id):
+        """Put one copy of a book back in a single UPDATE."""
+        self.filter(pk=book_id).update(
+            inventory=F("inventory") + 1, updated_at=timezone.now()
+        )
+        invalidate_books([book_id])
+
+    def release_many(self, counts):
+        """Put back ``counts[book_id]`` copies of each book in one UPDATE."""
+        if not counts:
+            return
+        returned = Case(
+            *(When(pk=pk, then=Value(count)) for pk, count in counts.items()),
+            output_field=IntegerField(),
+        )
+        self.filter(pk__in=counts).update(
+            inventory=F("inventory") + returned, updated_at=timezone.now()
+        )
+        invalidate_books(list(counts))
 
 
 class Book(models.Model):
@@ -14,6 +70,42 @@ class Book(models.Model):
     cover = models.CharField(max_length=4, choices=COVER_CHOICES)
     inventory = models.PositiveIntegerField(default=1)
     daily_fee = models.DecimalField(max_digits=5, decimal_places=2)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = BookManager()
+
+    class Meta:
+        constraints = [
+            # Natural key that catalog imports upsert on.
+            models.UniqueConstraint(
+                fields=["title", "author", "cover"],
+                name="book_natural_key_unique",
+            ),
+        ]
 
     def __str__(self):
         return self.title
+
+
+class BookSearchIndex(models.Model):
+    """Read-only view of the SQLite FTS5 index over title and author.
+
+    The table and the triggers that keep it in step with ``Book`` only
+    exist on SQLite; see ``books.search``.
+    """
+
+    book = models.OneToOneField(
+        Book,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column="rowid",
+        related_name="search_index",
+    )
+    title = models.TextField()
+    author = models.TextField()
+    document = FullTextField(db_column="books_book_fts")
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = "books_book_fts"
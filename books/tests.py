@@ -1,8 +1,27 @@
+import json
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from unittest import skipUnless
+from unittest.mock import MagicMock
+
+from io import StringIO
+
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import ValidationError
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
 from books.models import Book
+from borrowings.models import Borrowing
+from borrowings.serializers import BorrowingCreateSerializer
 from django.urls import reverse
 
 BOOKS_URL = reverse("books:book-list")
@@ -33,6 +52,7 @@ class BookModelTest(TestCase):
 class BookViewSetTest(TestCase):
 
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.admin_user = get_user_model().objects.create_superuser(
             password="adminpass", email="admin@example.com", is_staff=True
@@ -117,3 +137,449 @@ class BookViewSetTest(TestCase):
         self.client.force_authenticate(self.regular_user)
         response = self.client.delete(f"{BOOKS_URL}{self.book.id}/")
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class BookPaginationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.books = [
+            Book.objects.create(
+                title=f"Book {i}",
+                author="Author Name",
+                cover=Book.HARD,
+                inventory=10,
+                daily_fee="2.50",
+            )
+            for i in range(5)
+        ]
+
+    def test_cursor_walks_all_pages_forward_and_back(self):
+        seen = []
+        url = f"{BOOKS_URL}?page_size=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(book["id"] for book in response.data["results"])
+            last_page = response.data
+            url = response.data["next"]
+
+        self.assertEqual(seen, [book.id for book in self.books])
+
+        response = self.client.get(last_page["previous"])
+        self.assertEqual(
+            [book["id"] for book in response.data["results"]],
+            [self.books[2].id, self.books[3].id],
+        )
+
+    @override_settings(PAGINATION_MAX_PAGE_SIZE=3)
+    def test_page_size_is_capped(self):
+        response = self.client.get(f"{BOOKS_URL}?page_size=1000")
+        self.assertEqual(len(response.data["results"]), 3)
+        self.assertIsNotNone(response.data["next"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(f"{BOOKS_URL}?cursor=garbage")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BookSearchTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.by_title = self.create_book("Dune Messiah", "Frank Herbert")
+        self.by_author = self.create_book("Chapterhouse", "Dunes Writer")
+        self.other = self.create_book("Neuromancer", "William Gibson")
+
+    def create_book(self, title, author):
+        return Book.objects.create(
+            title=title,
+            author=author,
+            cover=Book.HARD,
+            inventory=10,
+            daily_fee="2.50",
+        )
+
+    def search(self, query, **params):
+        return self.client.get(BOOKS_URL, {"search": query, **params})
+
+    def test_title_matches_rank_above_author_matches(self):
+        response = self.search("dune")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [book["id"] for book in response.data["results"]],
+            [self.by_title.id, self.by_author.id],
+        )
+
+    def test_words_match_as_prefixes_and_all_must_match(self):
+        response = self.search("neuro gib")
+        self.assertEqual(
+            [book["id"] for book in response.data["results"]],
+            [self.other.id],
+        )
+        response = self.search("neuro herbert")
+        self.assertEqual(response.data["results"], [])
+
+    def test_punctuation_only_query_matches_nothing(self):
+        response = self.search('"*:(')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["results"], [])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.other.title = "Dune Encyclopedia"
+        self.other.save()
+        self.by_author.delete()
+
+        response = self.search("dune")
+        self.assertEqual(
+            {book["id"] for book in response.data["results"]},
+            {self.by_title.id, self.other.id},
+        )
+
+    def test_cursor_pages_through_ranked_results(self):
+        response = self.search("dune", page_size=1)
+        first = response.data["results"]
+        response = self.client.get(response.data["next"])
+        second = response.data["results"]
+
+        self.assertEqual(
+            [book["id"] for book in first + second],
+            [self.by_title.id, self.by_author.id],
+        )
+        self.assertIsNone(response.data["next"])
+
+
+class BookInventoryTest(TestCase):
+
+    def setUp(self):
+        self.book = Book.objects.create(
+            title="Test Book",
+            author="Author Name",
+            cover=Book.HARD,
+            inventory=1,
+            daily_fee="2.50",
+        )
+
+    def test_reserve_until_out_of_stock(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(Book.objects.reserve(self.book.id))
+        self.assertFalse(Book.objects.reserve(self.book.id))
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 0)
+
+    def test_reserve_many_is_all_or_nothing(self):
+        other = Book.objects.create(
+            title="Other Book",
+            author="Author Name",
+            cover=Book.SOFT,
+            inventory=3,
+            daily_fee="1.00",
+        )
+        with self.assertNumQueries(1):
+            self.assertTrue(
+                Book.objects.reserve_many({self.book.id: 1, other.id: 2})
+            )
+        other.refresh_from_db()
+        self.assertEqual(other.inventory, 1)
+
+        self.assertFalse(
+            Book.objects.reserve_many({self.book.id: 1, other.id: 1})
+        )
+
+    def test_release(self):
+        with self.assertNumQueries(1):
+            Book.objects.release(self.book.id)
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 2)
+
+
+@skipUnless(
+    connection.vendor == "postgresql", "Needs row-level locking (PostgreSQL)"
+)
+class BookInventoryStressTest(TransactionTestCase):
+    threads = 16
+    attempts_per_thread = 50
+    inventory = 300
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            password="userpass", email="user@example.com"
+        )
+        self.book = Book.objects.create(
+            title="Popular Book",
+            author="Author Name",
+            cover=Book.HARD,
+            inventory=self.inventory,
+            daily_fee="2.50",
+        )
+
+    def checkout(self, results):
+        request = MagicMock(user=self.user)
+        data = {
+            "book": self.book.id,
+            "expected_returning_date": date.today() + timedelta(days=7),
+        }
+        try:
+            for _ in range(self.attempts_per_thread):
+                serializer = BorrowingCreateSerializer(
+                    data=data, context={"request": request}
+                )
+                try:
+                    serializer.is_valid(raise_exception=True)
+                    serializer.save()
+                    results.append(True)
+                except ValidationError:
+                    results.append(False)
+        finally:
+            connection.close()
+
+    def test_concurrent_checkouts_never_oversell(self):
+        results = []
+        workers = [
+            threading.Thread(target=self.checkout, args=(results,))
+            for _ in range(self.threads)
+        ]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 0)
+        self.assertEqual(results.count(True), self.inventory)
+        self.assertEqual(
+            Borrowing.objects.filter(book=self.book).count(), self.inventory
+        )
+        sys.stderr.write(
+            f"\n{len(results)} checkout attempts, "
+            f"{len(results) / elapsed:.0f} checkouts/sec\n"
+        )
+
+
+class BookCatalogCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.book = Book.objects.create(
+            title="Test Book",
+            author="Author Name",
+            cover=Book.HARD,
+            inventory=10,
+            daily_fee="2.50",
+        )
+        self.detail_url = f"{BOOKS_URL}{self.book.id}/"
+
+    def test_repeated_reads_skip_the_database(self):
+        self.client.get(BOOKS_URL)
+        self.client.get(self.detail_url)
+
+        with self.assertNumQueries(0):
+            list_response = self.client.get(BOOKS_URL)
+            detail_response = self.client.get(self.detail_url)
+
+        self.assertEqual(
+            list_response.data["results"][0]["title"], "Test Book"
+        )
+        self.assertEqual(detail_response.data["inventory"], 10)
+
+    def test_inventory_change_evicts_only_that_book(self):
+        self.client.get(BOOKS_URL)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.reserve(self.book.id)
+
+        # The page's id list is still cached; only the book is reloaded.
+        with self.assertNumQueries(1):
+            response = self.client.get(BOOKS_URL)
+        self.assertEqual(response.data["results"][0]["inventory"], 9)
+        self.assertEqual(self.client.get(self.detail_url).data["inventory"], 9)
+
+    def test_new_book_appears_in_cached_list(self):
+        self.client.get(BOOKS_URL)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(
+                title="Another Book",
+                author="Author Name",
+                cover=Book.SOFT,
+                inventory=1,
+                daily_fee="1.00",
+            )
+
+        response = self.client.get(BOOKS_URL)
+        self.assertEqual(len(response.data["results"]), 2)
+
+    def test_conditional_get(self):
+        response = self.client.get(self.detail_url)
+        self.assertIn("Last-Modified", response)
+
+        response = self.client.get(
+            self.detail_url, HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        etag = self.client.get(BOOKS_URL)["ETag"]
+        response = self.client.get(BOOKS_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.reserve(self.book.id)
+        response = self.client.get(BOOKS_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_missing_book(self):
+        response = self.client.get(f"{BOOKS_URL}999/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class AsyncBookEndpointTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.books = [
+            Book.objects.create(
+                title=f"Dune {i}",
+                author="Frank Herbert",
+                cover=Book.HARD,
+                inventory=10,
+                daily_fee="2.50",
+            )
+            for i in range(3)
+        ]
+
+    async def test_list_matches_sync_endpoint(self):
+        for query in ("", "?page_size=2", "?search=dune"):
+            response = await self.async_client.get(
+                f"{reverse('books:book-list-async')}{query}"
+            )
+            expected = await sync_to_async(self.client.get)(
+                f"{BOOKS_URL}{query}"
+            )
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            data = response.json()
+            self.assertEqual(data["results"], expected.json()["results"])
+            if data["next"]:
+                self.assertIn("/api/async/books/", data["next"])
+
+    async def test_retrieve(self):
+        url = reverse("books:book-detail-async", args=[self.books[0].pk])
+
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["title"], "Dune 0")
+
+        response = await self.async_client.get(
+            url, headers={"If-None-Match": response["ETag"]}
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = await self.async_client.get(
+            reverse("books:book-detail-async", args=[999])
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_only_reads_are_allowed(self):
+        response = await self.async_client.post(
+            reverse("books:book-list-async")
+        )
+        self.assertEqual(
+            response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED
+        )
+
+
+class BookImportTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.admin_user = get_user_model().objects.create_superuser(
+            password="adminpass", email="admin@example.com"
+        )
+        self.existing = Book.objects.create(
+            title="Dune",
+            author="Frank Herbert",
+            cover=Book.HARD,
+            inventory=1,
+            daily_fee="1.00",
+        )
+
+    def test_command_upserts_and_reports_bad_records(self):
+        content = (
+            "title,author,cover,inventory,daily_fee\n"
+            "Dune,Frank Herbert,HARD,7,1.50\n"
+            "Dune,Frank Herbert,SOFT,3,0.80\n"
+            "Broken,Someone,PAPER,1,1.00\n"
+            "Emma,Jane Austen,SOFT,-2,1.00\n"
+            "Emma,Jane Austen,SOFT,2,1.00\n"
+        )
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as f:
+            f.write(content)
+            f.flush()
+            out, err = StringIO(), StringIO()
+            call_command(
+                "import_books", f.name, batch_size=2, stdout=out, stderr=err
+            )
+
+        self.assertIn("Imported 3 of 5 records, 2 failed.", out.getvalue())
+        self.assertIn("Record 3:", err.getvalue())
+        self.assertIn("Record 4:", err.getvalue())
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.inventory, 7)
+        self.assertEqual(str(self.existing.daily_fee), "1.50")
+        self.assertEqual(Book.objects.count(), 3)
+
+    def test_duplicates_within_a_batch_keep_the_last(self):
+        lines = [
+            {
+                "title": "Emma",
+                "author": "Jane Austen",
+                "cover": "SOFT",
+                "inventory": inventory,
+                "daily_fee": "1.00",
+            }
+            for inventory in (1, 2)
+        ]
+        content = "\n".join(json.dumps(line) for line in lines)
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as f:
+            f.write(content)
+            f.flush()
+            call_command("import_books", f.name, stdout=StringIO())
+
+        self.assertEqual(Book.objects.get(title="Emma").inventory, 2)
+
+    def test_endpoint_imports_jsonl_upload(self):
+        content = (
+            '{"title": "Emma", "author": "Jane Austen", "cover": "SOFT",'
+            ' "inventory": 2, "daily_fee": "1.00"}\n'
+            "not json\n"
+        )
+        self.client.force_authenticate(user=self.admin_user)
+
+        response = self.client.post(
+            f"{BOOKS_URL}import/",
+            {"file": SimpleUploadedFile("books.jsonl", content.encode())},
+            format="multipart",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["imported"], 1)
+        self.assertEqual(response.data["failed"], 1)
+        self.assertEqual(response.data["errors"][0]["record"], 2)
+        response = self.client.get(BOOKS_URL, {"search": "austen"})
+        self.assertEqual(response.data["results"][0]["title"], "Emma")
+
+    def test_endpoint_requires_staff_and_a_file(self):
+        response = self.client.post(f"{BOOKS_URL}import/")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.client.force_authenticate(user=self.admin_user)
+        response = self.client.post(f"{BOOKS_URL}import/")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,5 +1,8 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
+
+from library_service.async_views import async_action
+
 from .views import BookViewSet
 
 router = DefaultRouter()
@@ -9,4 +12,14 @@ app_name = "books"
 
 urlpatterns = [
     path("", include(router.urls)),
+    path(
+        "async/books/",
+        async_action(BookViewSet, "list"),
+        name="book-list-async",
+    ),
+    path(
+        "async/books/<int:pk>/",
+        async_action(BookViewSet, "retrieve"),
+        name="book-detail-async",
+    ),
 ]
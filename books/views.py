@@ -1,12 +1,37 @@
-from rest_framework import viewsets
+import io
+
+from django.core.cache import cache
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.http import Http404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAdminUser, AllowAny
+from rest_framework.response import Response
+
+from library_service.records import ValuesListMixin
+from library_service.replicas import (
+    REPLICA_DATABASE,
+    ReplicaReadMixin,
+    read_database,
+)
+
+from . import cache as catalog_cache
+from . import importer
 from .models import Book
+from .search import BookSearchFilter
 from .serializers import BookSerializer
 
 
-class BookViewSet(viewsets.ModelViewSet):
+class BookViewSet(ReplicaReadMixin, ValuesListMixin, viewsets.ModelViewSet):
     queryset = Book.objects.all()
     serializer_class = BookSerializer
+    ordering = ("id",)
+    search_ordering = ("-rank", "id")
+    filter_backends = (BookSearchFilter,)
 
     def get_permissions(self):
         if self.action in ["create", "update", "destroy"]:
@@ -14,3 +39,183 @@ class BookViewSet(viewsets.ModelViewSet):
         elif self.action in ["list", "retrieve"]:
             return [AllowAny()]
         return super().get_permissions()
+
+    def get_ordering(self):
+        if BookSearchFilter().get_search_query(self.request):
+            return self.search_ordering
+        return self.ordering
+
+    def serialize_books(self, books):
+        return self.get_values_plan().render(books)
+
+    def load_books(self, ids):
+        # Cached payloads always come from the primary: a lagging replica
+        # would cache a book as it was before the change that evicted it.
+        # The cache stamps each entry with the book's updated_at.
+        return self.get_values_plan().values(
+            self.get_queryset().using(DEFAULT_DB_ALIAS).filter(pk__in=ids),
+            "updated_at",
+        )
+
+    def conditional_response(self, data, etag, modified):
+        response = Response(data)
+        response["ETag"] = quote_etag(etag)
+        if modified is not None:
+            response["Last-Modified"] = http_date(modified)
+        return get_conditional_response(
+            self.request,
+            etag=response["ETag"],
+            last_modified=modified,
+            response=response,
+        )
+
+    def list(self, request, *args, **kwargs):
+        key = catalog_cache.page_key(request)
+        page = cache.get(key)
+        if page is None:
+            queryset = self.filter_queryset(self.get_queryset())
+            books = self.paginate_queryset(
+                self.values_queryset(
+                    self.get_values_plan(), queryset, "updated_at"
+                )
+            )
+            if read_database() == REPLICA_DATABASE:
+                entries = catalog_cache.get_books(
+                    [book["id"] for book in books],
+                    self.load_books,
+                    self.serialize_books,
+                )
+            else:
+                entries = catalog_cache.store_books(
+                    books, self.serialize_books
+                )
+            page = {
+                "ids": [book["id"] for book in books],
+                "next": self.paginator.get_next_link(),
+                "previous": self.paginator.get_previous_link(),
+            }
+            cache.set(key, page, settings.CATALOG_CACHE_TIMEOUT)
+        else:
+            entries = catalog_cache.get_books(
+                page["ids"], self.load_books, self.serialize_books
+            )
+
+        return self.conditional_response(
+            {
+                "next": page["next"],
+                "previous": page["previous"],
+                "results": [entry["data"] for entry in entries],
+            },
+            catalog_cache.page_etag(entries, page["next"], page["previous"]),
+            catalog_cache.last_modified(entries),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            pk = int(kwargs["pk"])
+        except ValueError:
+            raise Http404
+        entries = catalog_cache.get_books(
+            [pk], self.load_books, self.serialize_books
+        )
+        if not entries:
+            raise Http404
+        entry = entries[0]
+        return self.conditional_response(
+            entry["data"], entry["etag"], entry["modified"]
+        )
+
+    async def alist(self, request, *args, **kwargs):
+        """``list`` for the async endpoint."""
+        generation = await catalog_cache.aget_generation()
+        key = catalog_cache.page_key(request, generation)
+        page = await cache.aget(key)
+        if page is None:
+            queryset = self.filter_queryset(self.get_queryset())
+            books = await self.paginator.apaginate_queryset(
+                self.values_queryset(
+                    self.get_values_plan(), queryset, "updated_at"
+                ),
+                request,
+                view=self,
+            )
+            if read_database() == REPLICA_DATABASE:
+                entries = await catalog_cache.aget_books(
+                    [book["id"] for book in books],
+                    self.load_books,
+                    self.serialize_books,
+                )
+            else:
+                entries = await catalog_cache.astore_books(
+                    books, self.serialize_books
+                )
+            page = {
+                "ids": [book["id"] for book in books],
+                "next": self.paginator.get_next_link(),
+                "previous": self.paginator.get_previous_link(),
+            }
+            await cache.aset(key, page, settings.CATALOG_CACHE_TIMEOUT)
+        else:
+            entries = await catalog_cache.aget_books(
+                page["ids"], self.load_books, self.serialize_books
+            )
+
+        return self.conditional_response(
+            {
+                "next": page["next"],
+                "previous": page["previous"],
+                "results": [entry["data"] for entry in entries],
+            },
+            catalog_cache.page_etag(entries, page["next"], page["previous"]),
+            catalog_cache.last_modified(entries),
+        )
+
+    async def aretrieve(self, request, *args, **kwargs):
+        """``retrieve`` for the async endpoint."""
+        try:
+            pk = int(kwargs["pk"])
+        except ValueError:
+            raise Http404
+        entries = await catalog_cache.aget_books(
+            [pk], self.load_books, self.serialize_books
+        )
+        if not entries:
+            raise Http404
+        entry = entries[0]
+        return self.conditional_response(
+            entry["data"], entry["etag"], entry["modified"]
+        )
+
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="import",
+        permission_classes=[IsAdminUser],
+        parser_classes=[MultiPartParser],
+    )
+    def import_catalog(self, request):
+        """Create or update books from an uploaded CSV/JSON Lines file."""
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response(
+                {"file": ["No file was submitted."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        input_format = request.data.get("input_format") or (
+            importer.guess_format(upload.name)
+        )
+        if input_format not in importer.FORMATS:
+            return Response(
+                {"input_format": [f"Must be one of {importer.FORMATS}."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        stream = io.TextIOWrapper(upload.file, encoding="utf-8", newline="")
+        try:
+            report = importer.import_books(stream, input_format)
+        except UnicodeDecodeError:
+            return Response(
+                {"file": ["The file must be UTF-8 encoded."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response(report.as_dict())
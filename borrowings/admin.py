@@ -1,6 +1,15 @@
 from django.contrib import admin
 
-from .models import Borrowing, Payment
+from .models import (
+    Borrowing,
+    BorrowingSummary,
+    Notification,
+    Payment,
+    StripeEvent,
+)
 
 admin.site.register(Borrowing)
 admin.site.register(Payment)
+admin.site.register(Notification)
+admin.site.register(BorrowingSummary)
+admin.site.register(StripeEvent)
@@ -0,0 +1,60 @@
+"""Overdue fines as SQL expressions, so a batch of returns can be priced
+in the same query that selects it."""
+
+from django.conf import settings
+from django.db.models import (
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    Func,
+    IntegerField,
+    Value,
+)
+from django.db.models.functions import Greatest
+
+
+class DaysBetween(Func):
+    """Whole days from the ``start`` date to the ``end`` date."""
+
+    arity = 2
+    arg_joiner = " - "
+    template = "(%(expressions)s)"
+    output_field = IntegerField()
+
+    def __init__(self, end, start, **extra):
+        super().__init__(end, start, **extra)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler,
+            connection,
+            function="julianday",
+            template="CAST(%(function)s(%(expressions)s) AS INTEGER)",
+            arg_joiner=") - julianday(",
+            **extra_context,
+        )
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler,
+            connection,
+            template="DATEDIFF(%(expressions)s)",
+            arg_joiner=", ",
+            **extra_context,
+        )
+
+
+def overdue_fine(returned_on):
+    """Fine owed by a borrowing returned on ``returned_on``.
+
+    ``days_overdue * book.daily_fee * FINE_MULTIPLIER``, or zero when the
+    book comes back on time.
+    """
+    days_overdue = Greatest(
+        DaysBetween(Value(returned_on), F("expected_returning_date")),
+        Value(0),
+    )
+    return ExpressionWrapper(
+        days_overdue * F("book__daily_fee") * Value(settings.FINE_MULTIPLIER),
+        output_field=DecimalField(max_digits=10, decimal_places=2),
+    )
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.6 on 2026-10-18 10:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrowings", "0011_payment_async_checkout"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="notification",
+            name="event",
+            field=models.CharField(
+                choices=[
+                    ("BORROWING_CREATED", "Borrowing created"),
+                    ("BORROWINGS_CHECKED_OUT", "Borrowings checked out"),
+                ],
+                max_length=30,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="payment",
+            name="session_id",
+            field=models.CharField(
+                blank=True, db_index=True, max_length=255, null=True
+            ),
+        ),
+    ]
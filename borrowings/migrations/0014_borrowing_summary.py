@@ -0,0 +1,52 @@
+# Generated by Django 5.0.6 on 2026-10-18 10:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrowings", "0013_payment_created_at"),
+        ("users", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BorrowingSummary",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="borrowing_summary",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("active_count", models.PositiveIntegerField(default=0)),
+                ("overdue_count", models.PositiveIntegerField(default=0)),
+                (
+                    "outstanding_total",
+                    models.DecimalField(
+                        decimal_places=2, default=0, max_digits=12
+                    ),
+                ),
+                (
+                    "last_borrowing_date",
+                    models.DateField(blank=True, null=True),
+                ),
+                ("next_due_date", models.DateField(blank=True, null=True)),
+            ],
+            options={
+                "verbose_name_plural": "borrowing summaries",
+                "indexes": [
+                    models.Index(
+                        fields=["next_due_date"], name="summary_next_due_idx"
+                    )
+                ],
+            },
+        ),
+    ]
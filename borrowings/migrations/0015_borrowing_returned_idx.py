@@ -0,0 +1,22 @@
+# Generated by Django 5.0.6 on 2026-10-18 10:56
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0004_book_natural_key"),
+        ("borrowings", "0014_borrowing_summary"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="borrowing",
+            index=models.Index(
+                fields=["actual_returning_date"], name="borrowing_returned_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.0.6 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrowings", "0015_borrowing_returned_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StripeEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("event_id", models.CharField(max_length=255, unique=True)),
+                ("type", models.CharField(max_length=100)),
+                ("received_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="notification",
+            name="event",
+            field=models.CharField(
+                choices=[
+                    ("BORROWING_CREATED", "Borrowing created"),
+                    ("BORROWINGS_CHECKED_OUT", "Borrowings checked out"),
+                    ("PAYMENT_SUCCEEDED", "Payment succeeded"),
+                ],
+                max_length=30,
+            ),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.db.models import Q, CheckConstraint, F
+from django.utils import timezone
 from books.models import Book
 from users.models import User
 
@@ -10,6 +11,9 @@ class Borrowing(models.Model):
     borrowing_date = models.DateField(auto_now_add=True)
     expected_returning_date = models.DateField()
     actual_returning_date = models.DateField(null=True, blank=True)
+    # Also set by every queryset update(), for conditional and delta
+    # listings.
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         constraints = [
@@ -22,6 +26,40 @@ class Borrowing(models.Model):
                 name="actual_return_date_after_borrow_date",
             ),
         ]
+        indexes = [
+            # A patron's borrowings, in pagination order.
+            models.Index(
+                fields=["user", "borrowing_date", "id"],
+                name="borrowing_user_date_idx",
+            ),
+            # A patron's active/returned borrowings (?is_active=).
+            models.Index(
+                fields=["user", "actual_returning_date"],
+                name="borrowing_user_returned_idx",
+            ),
+            # Staff listing, in pagination order.
+            models.Index(
+                fields=["borrowing_date", "id"],
+                name="borrowing_date_id_idx",
+            ),
+            # Overdue scan: only unreturned borrowings are indexed, which
+            # keeps the index small however long the history grows.
+            models.Index(
+                fields=["expected_returning_date"],
+                condition=Q(actual_returning_date__isnull=True),
+                name="borrowing_open_due_idx",
+            ),
+            # Returns on a given day, for the analytics rollup.
+            models.Index(
+                fields=["actual_returning_date"],
+                name="borrowing_returned_idx",
+            ),
+            # A patron's latest change (ETag) and changes since (?since=).
+            models.Index(
+                fields=["user", "updated_at"],
+                name="borrowing_user_updated_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user} borrowed {self.book}"
@@ -29,8 +67,14 @@ class Borrowing(models.Model):
 
 class Payment(models.Model):
     class Status(models.TextChoices):
+        CREATING = "CREATING", "Creating"
         PENDING = "PENDING", "Pending"
         PAID = "PAID", "Paid"
+        FAILED = "FAILED", "Failed"
+        EXPIRED = "EXPIRED", "Expired"
+
+    # Payments the user still owes.
+    OUTSTANDING_STATUSES = (Status.CREATING, Status.PENDING)
 
     class Type(models.TextChoices):
         PAYMENT = "PAYMENT", "Payment"
@@ -41,12 +85,146 @@ class Payment(models.Model):
     )
     type = models.CharField(max_length=10, choices=Type.choices)
     borrowing = models.ForeignKey(Borrowing, on_delete=models.CASCADE)
-    session_url = models.URLField()
-    session_id = models.CharField(max_length=255)
+    session_url = models.URLField(blank=True)
+    # Shared by the payments of a basket checked out in one session.
+    session_id = models.CharField(
+        max_length=255, db_index=True, null=True, blank=True
+    )
     money_to_pay = models.DecimalField(max_digits=10, decimal_places=2)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Also set by every queryset update(); a payment's change is a change
+    # of its borrowing's listing.
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "id"], name="payment_user_id_idx"),
+            # Latest change of a borrowing's payments.
+            models.Index(
+                fields=["borrowing", "updated_at"],
+                name="payment_borrowing_updated_idx",
+            ),
+            # Reporting exports, in export order.
+            models.Index(
+                fields=["created_at", "id"], name="payment_created_id_idx"
+            ),
+            # Stale pending payments, for the Stripe reconciliation.
+            models.Index(
+                fields=["created_at"],
+                condition=Q(status="PENDING"),
+                name="payment_pending_created_idx",
+            ),
+        ]
 
     def __str__(self):
         return (
             f"{self.get_type_display()} - {self.borrowing_id} - {self.status}"
         )
+
+
+class BorrowingSummary(models.Model):
+    """Per-user counters behind the account screen.
+
+    Recomputed by ``borrowings.summaries`` whenever the user's borrowings
+    or payments change, so reading it is a single primary-key lookup.
+    """
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="borrowing_summary",
+    )
+    active_count = models.PositiveIntegerField(default=0)
+    overdue_count = models.PositiveIntegerField(default=0)
+    outstanding_total = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0
+    )
+    last_borrowing_date = models.DateField(null=True, blank=True)
+    # Earliest due date of an active borrowing that was not overdue yet
+    # when the row was computed; once it passes, overdue_count is stale.
+    next_due_date = models.DateField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = "borrowing summaries"
+        indexes = [
+            models.Index(
+                fields=["next_due_date"], name="summary_next_due_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"Summary for {self.user}"
+
+    def is_stale(self, today):
+        return self.next_due_date is not None and self.next_due_date < today
+
+
+class Notification(models.Model):
+    """Outbox row for a Telegram notification.
+
+    Rows are written in the same transaction as the change they describe,
+    so they only become visible once it commits, and are delivered later by
+    the ``send_pending_notifications`` Celery task.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = "PENDING", "Pending"
+        SENT = "SENT", "Sent"
+        FAILED = "FAILED", "Failed"
+
+    class Event(models.TextChoices):
+        BORROWING_CREATED = "BORROWING_CREATED", "Borrowing created"
+        BORROWINGS_CHECKED_OUT = (
+            "BORROWINGS_CHECKED_OUT",
+            "Borrowings checked out",
+        )
+        PAYMENT_SUCCEEDED = "PAYMENT_SUCCEEDED", "Payment succeeded"
+
+    event = models.CharField(max_length=30, choices=Event.choices)
+    dedup_key = models.CharField(max_length=255, unique=True)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["available_at"],
+                condition=Q(status="PENDING"),
+                name="notification_pending_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_event_display()} - {self.status}"
+
+    @classmethod
+    def enqueue(cls, event, dedup_key, **payload):
+        """Insert a pending notification unless ``dedup_key`` exists."""
+        cls.objects.bulk_create(
+            [cls(event=event, dedup_key=dedup_key, payload=payload)],
+            ignore_conflicts=True,
+        )
+
+
+class StripeEvent(models.Model):
+    """A Stripe webhook event that has been processed.
+
+    Stripe delivers events at least once; the unique ``event_id`` turns a
+    redelivery into a no-op.
+    """
+
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.type} - {self.event_id}"
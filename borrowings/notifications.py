@@ -0,0 +1,108 @@
+from .models import Borrowing, Notification, Payment
+
+
+def _borrowing_created_messages(notifications):
+    borrowing_ids = [n.payload["borrowing_id"] for n in notifications]
+    rows = {
+        pk: rest
+        for pk, *rest in Borrowing.objects.filter(
+            pk__in=borrowing_ids
+        ).values_list(
+            "pk",
+            "book__title",
+            "user__email",
+            "borrowing_date",
+            "expected_returning_date",
+        )
+    }
+    messages = {}
+    for notification in notifications:
+        row = rows.get(notification.payload["borrowing_id"])
+        if row is None:
+            # The borrowing was deleted before the notification went out.
+            continue
+        book_title, user_email, borrowing_date, expected_returning_date = row
+        messages[notification.pk] = (
+            f"New borrowing created:\n"
+            f"Book: {book_title}\n"
+            f"User: {user_email}\n"
+            f"Borrowing Date: {borrowing_date}\n"
+            f"Expected Returning Date: {expected_returning_date}"
+        )
+    return messages
+
+
+def _borrowings_checked_out_messages(notifications):
+    borrowing_ids = [
+        pk for n in notifications for pk in n.payload["borrowing_ids"]
+    ]
+    rows = {
+        pk: rest
+        for pk, *rest in Borrowing.objects.filter(
+            pk__in=borrowing_ids
+        ).values_list(
+            "pk",
+            "book__title",
+            "user__email",
+            "expected_returning_date",
+        )
+    }
+    messages = {}
+    for notification in notifications:
+        basket = [
+            rows[pk]
+            for pk in notification.payload["borrowing_ids"]
+            if pk in rows
+        ]
+        if not basket:
+            continue
+        _, user_email, expected_returning_date = basket[0]
+        books = "\n".join(f"- {book_title}" for book_title, _, _ in basket)
+        messages[notification.pk] = (
+            f"New borrowings created:\n"
+            f"User: {user_email}\n"
+            f"Expected Returning Date: {expected_returning_date}\n"
+            f"Books:\n{books}"
+        )
+    return messages
+
+
+def _payment_succeeded_messages(notifications):
+    session_ids = [n.payload["session_id"] for n in notifications]
+    titles = {}
+    for session_id, book_title in (
+        Payment.objects.filter(session_id__in=session_ids)
+        .order_by("pk")
+        .values_list("session_id", "borrowing__book__title")
+    ):
+        titles.setdefault(session_id, []).append(book_title)
+    messages = {}
+    for notification in notifications:
+        books = titles.get(notification.payload["session_id"])
+        if not books:
+            continue
+        messages[notification.pk] = (
+            f"Payment successful for borrowing of book {', '.join(books)}"
+        )
+    return messages
+
+
+RENDERERS = {
+    Notification.Event.BORROWING_CREATED: _borrowing_created_messages,
+    Notification.Event.BORROWINGS_CHECKED_OUT: (
+        _borrowings_checked_out_messages
+    ),
+    Notification.Event.PAYMENT_SUCCEEDED: _payment_succeeded_messages,
+}
+
+
+def render_notifications(notifications):
+    """Map notification id to message text, one query per event type."""
+    by_event = {}
+    for notification in notifications:
+        by_event.setdefault(notification.event, []).append(notification)
+
+    messages = {}
+    for event, group in by_event.items():
+        messages.update(RENDERERS[event](group))
+    return messages
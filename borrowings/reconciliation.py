@@ -0,0 +1,79 @@
+"""Reconciliation of pending payments with Stripe.
+
+A payment stays PENDING if its webhook never arrives and the user closed
+the browser before the success redirect. The periodic
+``reconcile_pending_payments`` task asks Stripe about the checkout
+sessions of payments pending for longer than ``STRIPE_RECONCILE_AFTER``,
+a chunk at a time, and settles them in one UPDATE per outcome. Sessions
+still open after ``CHECKOUT_SESSION_TTL`` are expired, as promised when a
+payment is cancelled.
+"""
+
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from helpers.stripe_helper import sync_checkout_sessions
+
+from .models import Payment
+from .webhooks import PAID_SESSION_STATES, settle_sessions
+
+RECONCILE_CHUNK_SIZE = 100
+CHECKOUT_SESSION_TTL = timedelta(hours=24)
+
+
+def stale_session_chunks(cutoff, chunk_size=RECONCILE_CHUNK_SIZE):
+    """Yield the session ids of payments pending since before ``cutoff``,
+    ``chunk_size`` payments at a time."""
+    last_pk = 0
+    while True:
+        rows = list(
+            Payment.objects.filter(
+                status=Payment.Status.PENDING,
+                created_at__lt=cutoff,
+                session_id__isnull=False,
+                pk__gt=last_pk,
+            )
+            .order_by("pk")
+            .values_list("pk", "session_id")[:chunk_size]
+        )
+        if not rows:
+            return
+        last_pk = rows[-1][0]
+        yield list(dict.fromkeys(session_id for _, session_id in rows))
+
+
+def session_outcome(session):
+    """The status a session's payments should move to, if any."""
+    if session is None:
+        return Payment.Status.FAILED
+    if session.status == "expired":
+        return Payment.Status.EXPIRED
+    if (
+        session.status == "complete"
+        and session.payment_status in PAID_SESSION_STATES
+    ):
+        return Payment.Status.PAID
+    return None
+
+
+def reconcile_payments(now=None, chunk_size=RECONCILE_CHUNK_SIZE):
+    """Settle stale pending payments from Stripe; return the number of
+    payments moved to each status."""
+    now = now or timezone.now()
+    expire_before = (now - CHECKOUT_SESSION_TTL).timestamp()
+    settled = Counter()
+    for session_ids in stale_session_chunks(
+        now - settings.STRIPE_RECONCILE_AFTER, chunk_size
+    ):
+        outcomes = defaultdict(list)
+        sessions = sync_checkout_sessions(session_ids, expire_before)
+        for session_id, session in sessions.items():
+            new_status = session_outcome(session)
+            if new_status is not None:
+                outcomes[new_status].append(session_id)
+        for new_status, ids in outcomes.items():
+            settled[new_status] += settle_sessions(ids, new_status)
+    return dict(settled)
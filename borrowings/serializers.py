@@ -1,15 +1,126 @@
+from collections import Counter
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Borrowing, Payment
+from .models import Borrowing, Notification, Payment
+from .summaries import refresh_on_commit
+from books.models import Book
 from books.serializers import BookSerializer
 
 
-class PaymentSerializer(serializers.ModelSerializer):
+# Most books a patron can take in one checkout.
+CHECKOUT_MAX_BOOKS = 20
+# Most borrowings staff can close in one bulk return.
+BULK_RETURN_MAX_BORROWINGS = 500
+
+
+class EagerLoadingMixin:
+    """Build the joins and prefetches for the nested fields a serializer
+    will render, so listing N objects costs a constant number of queries.
+    """
+
+    def setup_eager_loading(self, queryset):
+        select_related = []
+        prefetch_related = []
+        for field in self.fields.values():
+            if field.write_only:
+                continue
+            if isinstance(
+                field,
+                (serializers.ListSerializer, serializers.ManyRelatedField),
+            ):
+                prefetch_related.append(field.source)
+            elif isinstance(field, serializers.BaseSerializer):
+                select_related.append(field.source)
+
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
+
+def sparse_param(request, name):
+    """The sorted, distinct names listed in the ``name`` query parameter,
+    or None when it is absent."""
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    return tuple(sorted({part.strip() for part in value.split(",")} - {""}))
+
+
+class SparseFieldsMixin:
+    """Render only the fields a client asks for.
+
+    ``fields`` keeps just the named fields; ``expand`` names the nested
+    objects to render in full, and the others are rendered as primary
+    keys (a list of them for nested lists). Without ``expand`` every
+    nested object is rendered in full. Both are read from the ``fields``
+    and ``expand`` query parameters of the request in the context unless
+    given as arguments.
+    """
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get("request")
+        if request is not None and fields is None and expand is None:
+            options = self.sparse_options(request)
+            fields, expand = options["fields"], options["expand"]
+        if expand is not None:
+            self.expand_fields(expand)
+        if fields is not None:
+            self.keep_fields(fields)
+
+    @classmethod
+    def sparse_options(cls, request):
+        """The arguments that render what ``request`` asks for."""
+        return {
+            "fields": sparse_param(request, "fields") or None,
+            "expand": sparse_param(request, "expand"),
+        }
+
+    def expand_fields(self, names):
+        nested = {
+            name: field
+            for name, field in self.fields.items()
+            if isinstance(field, serializers.BaseSerializer)
+        }
+        unknown = sorted(set(names) - set(nested))
+        if unknown:
+            raise serializers.ValidationError(
+                {"expand": f"Cannot expand: {', '.join(unknown)}."}
+            )
+        for name, field in nested.items():
+            if name in names:
+                continue
+            kwargs = {"read_only": True}
+            if field.source != name:
+                kwargs["source"] = field.source
+            if isinstance(field, serializers.ListSerializer):
+                kwargs["many"] = True
+            self.fields[name] = serializers.PrimaryKeyRelatedField(**kwargs)
+
+    def keep_fields(self, names):
+        unknown = sorted(set(names) - set(self.fields))
+        if unknown:
+            raise serializers.ValidationError(
+                {"fields": f"Unknown fields: {', '.join(unknown)}."}
+            )
+        for name in set(self.fields) - set(names):
+            self.fields.pop(name)
+
+
+class PaymentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Payment
         fields = "__all__"
 
 
-class BorrowingReadSerializer(serializers.ModelSerializer):
+class BorrowingReadSerializer(
+    EagerLoadingMixin, SparseFieldsMixin, serializers.ModelSerializer
+):
     book = BookSerializer(read_only=True)
     payments = PaymentSerializer(
         many=True, read_only=True, source="payment_set"
@@ -24,6 +135,7 @@ class BorrowingReadSerializer(serializers.ModelSerializer):
             "borrowing_date",
             "expected_returning_date",
             "actual_returning_date",
+            "updated_at",
             "payments",
         ]
 
@@ -40,12 +152,160 @@ class BorrowingCreateSerializer(serializers.ModelSerializer):
         return data
 
     def create(self, validated_data):
-        book = validated_data["book"]
-        book.inventory -= 1
-        book.save()
+        validated_data.setdefault("user", self.context["request"].user)
+        with transaction.atomic():
+            if not Book.objects.reserve(validated_data["book"].pk):
+                raise serializers.ValidationError("This book is out of stock.")
+            return Borrowing.objects.create(**validated_data)
+
+
+class BorrowingCheckoutSerializer(serializers.Serializer):
+    books = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=CHECKOUT_MAX_BOOKS,
+    )
+    expected_returning_date = serializers.DateField()
+
+    def validate_books(self, book_ids):
+        books = Book.objects.in_bulk(book_ids)
+        missing = sorted(set(book_ids) - set(books))
+        if missing:
+            raise serializers.ValidationError(
+                f"Books not found: {', '.join(map(str, missing))}."
+            )
+        counts = Counter(book_ids)
+        out_of_stock = [
+            book.title
+            for pk, book in books.items()
+            if book.inventory < counts[pk]
+        ]
+        if out_of_stock:
+            raise serializers.ValidationError(
+                f"Out of stock: {', '.join(out_of_stock)}."
+            )
+        return [books[pk] for pk in book_ids]
+
+    def validate_expected_returning_date(self, value):
+        if value < timezone.now().date():
+            raise serializers.ValidationError(
+                "Expected returning date cannot be in the past."
+            )
+        return value
+
+    def create(self, validated_data):
+        """Reserve every book and create the borrowings, all or nothing."""
+        user = self.context["request"].user
+        books = validated_data["books"]
+        with transaction.atomic():
+            if not Book.objects.reserve_many(
+                Counter(book.pk for book in books)
+            ):
+                raise serializers.ValidationError(
+                    "Some of these books are out of stock."
+                )
+            borrowings = Borrowing.objects.bulk_create(
+                [
+                    Borrowing(
+                        book=book,
+                        user=user,
+                        expected_returning_date=validated_data[
+                            "expected_returning_date"
+                        ],
+                    )
+                    for book in books
+                ]
+            )
+            borrowing_ids = [borrowing.pk for borrowing in borrowings]
+            Notification.enqueue(
+                Notification.Event.BORROWINGS_CHECKED_OUT,
+                f"borrowings-checked-out:{borrowing_ids[0]}",
+                borrowing_ids=borrowing_ids,
+            )
+            refresh_on_commit([user.pk])
+        return borrowings
+
+
+class BorrowingBulkReturnSerializer(serializers.Serializer):
+    borrowings = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BULK_RETURN_MAX_BORROWINGS,
+    )
+
+
+class ExportSerializer(serializers.Serializer):
+    """Query parameters of a reporting export.
+
+    ``date_from`` and ``date_to`` are inclusive and apply to
+    ``date_field``.
+    """
+
+    date_field = None
+
+    output = serializers.ChoiceField(choices=("csv", "ndjson"), default="csv")
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+
+    def validate(self, data):
+        if data.get("date_from") and data.get("date_to"):
+            if data["date_from"] > data["date_to"]:
+                raise serializers.ValidationError(
+                    "date_from must not be after date_to."
+                )
+        return data
+
+    def date_bound(self, day):
+        return day
+
+    def get_filters(self):
+        data = self.validated_data
+        filters = {}
+        if "date_from" in data:
+            filters[f"{self.date_field}__gte"] = self.date_bound(
+                data["date_from"]
+            )
+        if "date_to" in data:
+            filters[f"{self.date_field}__lt"] = self.date_bound(
+                data["date_to"] + timedelta(days=1)
+            )
+        return filters
+
+
+class BorrowingExportSerializer(ExportSerializer):
+    date_field = "borrowing_date"
+
+    is_active = serializers.BooleanField(required=False)
+    user_id = serializers.IntegerField(required=False)
+
+    def get_filters(self):
+        filters = super().get_filters()
+        data = self.validated_data
+        if "is_active" in data:
+            filters["actual_returning_date__isnull"] = data["is_active"]
+        if "user_id" in data:
+            filters["user_id"] = data["user_id"]
+        return filters
+
+
+class PaymentExportSerializer(ExportSerializer):
+    date_field = "created_at"
+
+    status = serializers.ChoiceField(
+        choices=Payment.Status.choices, required=False
+    )
+    type = serializers.ChoiceField(
+        choices=Payment.Type.choices, required=False
+    )
 
-        borrowing = Borrowing.objects.create(**validated_data)
-        borrowing.user = self.context["request"].user
-        borrowing.save()
+    def date_bound(self, day):
+        # Midnight in the server's time zone, so the range can use the
+        # created_at index instead of casting every row to a date.
+        return timezone.make_aware(datetime.combine(day, time.min))
 
-        return borrowing
+    def get_filters(self):
+        filters = super().get_filters()
+        for name in ("status", "type"):
+            if name in self.validated_data:
+                filters[name] = self.validated_data[name]
+        return filters
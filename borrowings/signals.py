@@ -1,20 +1,24 @@
 from django.dispatch import receiver
-from django.db.models.signals import post_save
-from .models import Borrowing
-from helpers.telegram_helper import send_message
+from django.db.models.signals import post_delete, post_save
+from .models import Borrowing, Notification, Payment
+from .summaries import refresh_on_commit
 
 
 @receiver(post_save, sender=Borrowing)
-def send_notification_on_borrowing_creation(
+def enqueue_notification_on_borrowing_creation(
     sender, instance, created, **kwargs
 ):
     if created:
-        message = (
-            f"New borrowing created:\n"
-            f"Book: {instance.book.title}\n"
-            f"User: {instance.user}\n"
-            f"Borrowing Date: {instance.borrowing_date}\n"
-            f"Expected Returning Date: {instance.expected_returning_date}"
+        Notification.enqueue(
+            Notification.Event.BORROWING_CREATED,
+            f"borrowing-created:{instance.pk}",
+            borrowing_id=instance.pk,
         )
 
-        send_message(message)
+
+@receiver(post_save, sender=Borrowing)
+@receiver(post_delete, sender=Borrowing)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def refresh_summary_on_change(sender, instance, **kwargs):
+    refresh_on_commit([instance.user_id])
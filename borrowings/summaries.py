@@ -0,0 +1,124 @@
+"""Maintenance of ``BorrowingSummary`` rows.
+
+Every code path that changes a user's borrowings or payments, whether a
+model save or a bulk insert or update, calls ``refresh_on_commit()`` for
+the users it touched. Their rows are then recomputed from a couple of
+aggregate queries grouped by user. Recomputing per user, instead of
+applying +1/-1 deltas, means a missed or repeated event cannot leave a
+counter permanently wrong.
+
+Overdue counts also change with the calendar alone. Each row records
+the next due date that will make it stale; ``get_summary()`` refreshes
+such a row on read, and the nightly ``refresh_stale_summaries`` task
+catches up on the rest.
+"""
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+from django.utils import timezone
+
+from users.models import User
+
+from .models import Borrowing, BorrowingSummary, Payment
+
+SUMMARY_FIELDS = (
+    "active_count",
+    "overdue_count",
+    "outstanding_total",
+    "last_borrowing_date",
+    "next_due_date",
+)
+
+
+def compute_summaries(user_ids, today):
+    active = Q(actual_returning_date__isnull=True)
+    borrowing_stats = {
+        row.pop("user_id"): row
+        for row in Borrowing.objects.filter(user_id__in=user_ids)
+        .values("user_id")
+        .annotate(
+            active_count=Count("id", filter=active),
+            overdue_count=Count(
+                "id", filter=active & Q(expected_returning_date__lt=today)
+            ),
+            next_due_date=Min(
+                "expected_returning_date",
+                filter=active & Q(expected_returning_date__gte=today),
+            ),
+            last_borrowing_date=Max("borrowing_date"),
+        )
+        .order_by()
+    }
+    outstanding = dict(
+        Payment.objects.filter(
+            user_id__in=user_ids, status__in=Payment.OUTSTANDING_STATUSES
+        )
+        .values("user_id")
+        .annotate(total=Sum("money_to_pay"))
+        .values_list("user_id", "total")
+        .order_by()
+    )
+    return [
+        BorrowingSummary(
+            user_id=user_id,
+            outstanding_total=outstanding.get(user_id) or 0,
+            **borrowing_stats.get(user_id, {}),
+        )
+        for user_id in user_ids
+    ]
+
+
+def refresh_user_summaries(user_ids):
+    """Recompute the summaries of ``user_ids`` in a fixed number of
+    queries, however many users there are."""
+    today = timezone.now().date()
+    with transaction.atomic():
+        # Skip users deleted since the refresh was scheduled.
+        user_ids = list(
+            User.objects.filter(pk__in=set(user_ids))
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        if not user_ids:
+            return
+        # Serialize concurrent refreshes of the same user, so the last
+        # one to write has also read the latest committed rows.
+        list(
+            BorrowingSummary.objects.select_for_update()
+            .filter(pk__in=user_ids)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        BorrowingSummary.objects.bulk_create(
+            compute_summaries(user_ids, today),
+            update_conflicts=True,
+            unique_fields=["user"],
+            update_fields=SUMMARY_FIELDS,
+        )
+
+
+def refresh_on_commit(user_ids):
+    """Refresh the summaries once the current transaction commits."""
+    user_ids = set(user_ids)
+    transaction.on_commit(lambda: refresh_user_summaries(user_ids))
+
+
+def get_summary(user_id):
+    """The user's summary, recomputed first if missing or stale."""
+    summary = BorrowingSummary.objects.filter(pk=user_id).first()
+    if summary is None or summary.is_stale(timezone.now().date()):
+        refresh_user_summaries([user_id])
+        summary = BorrowingSummary.objects.get(pk=user_id)
+    return summary
+
+
+def refresh_stale_summaries(today, chunk_size=1000):
+    """Recompute every summary whose overdue count went out of date."""
+    stale = BorrowingSummary.objects.filter(next_due_date__lt=today)
+    refreshed = 0
+    while True:
+        user_ids = list(stale.values_list("pk", flat=True)[:chunk_size])
+        if not user_ids:
+            return refreshed
+        refresh_user_summaries(user_ids)
+        refreshed += len(user_ids)
@@ -1,33 +1,232 @@
+import stripe
 from celery import shared_task
 from datetime import timedelta
+from django.db import transaction
+from django.db.models import F
 from django.utils.timezone import now
-from .models import Borrowing
-from helpers.telegram_helper import send_message
+from .models import Borrowing, Notification, Payment
+from .notifications import render_notifications
+from .reconciliation import reconcile_payments
+from .summaries import refresh_on_commit, refresh_stale_summaries
+from helpers.stripe_helper import (
+    STRIPE_TRANSIENT_ERRORS,
+    start_checkout_session,
+)
+from helpers.telegram_helper import (
+    flush_messages,
+    get_dispatcher,
+    send_message,
+)
+
+OVERDUE_SCAN_CHUNK_SIZE = 2000
+NOTIFICATION_BATCH_SIZE = 100
+NOTIFICATION_MAX_ATTEMPTS = 5
+NOTIFICATION_RETRY_DELAY = timedelta(seconds=30)
+# How long a claimed batch is reserved for its worker, and how long the
+# worker waits for Telegram, well within it.
+NOTIFICATION_CLAIM_TIMEOUT = timedelta(minutes=5)
+NOTIFICATION_SEND_TIMEOUT = 60
+CHECKOUT_SESSION_MAX_RETRIES = 5
+CHECKOUT_SESSION_RETRY_DELAY = 5
+
+
+def overdue_borrowings(due_date):
+    """Unreturned borrowings due on or before ``due_date``, as tuples.
+
+    Filtering happens in SQL and book and user are joined in, fetching only
+    the columns needed for the alert.
+    """
+    return (
+        Borrowing.objects.filter(
+            expected_returning_date__lte=due_date,
+            actual_returning_date__isnull=True,
+        )
+        .order_by()
+        .values_list(
+            "book__title",
+            "user__email",
+            "borrowing_date",
+            "expected_returning_date",
+        )
+    )
+
+
+def iter_overdue_borrowings(due_date, chunk_size=OVERDUE_SCAN_CHUNK_SIZE):
+    """Stream ``overdue_borrowings`` ``chunk_size`` rows at a time."""
+    return overdue_borrowings(due_date).iterator(chunk_size=chunk_size)
 
 
 @shared_task
 def check_borrowings_overdue():
-    borrowings = Borrowing.objects.all()
-    today = now().date()
-    tomorrow = today + timedelta(days=1)
-    overdue_borrowings = [
-        borrowing
-        for borrowing in borrowings
-        if borrowing.expected_returning_date <= tomorrow
-        and not borrowing.actual_returning_date
-    ]
-
-    if overdue_borrowings:
-        for borrowing in overdue_borrowings:
-            message = (
-                f"Overdue Borrowing Alert:\n"
-                f"Book: {borrowing.book.title}\n"
-                f"User: {borrowing.user}\n"
-                f"Borrowing Date: {borrowing.borrowing_date}\n"
-                f"Expected Returning \
-                    Date: {borrowing.expected_returning_date}\n"
-                f"Status: Overdue"
-            )
-            send_message(message)
-    else:
+    tomorrow = now().date() + timedelta(days=1)
+    has_overdue = False
+
+    for (
+        book_title,
+        user_email,
+        borrowing_date,
+        expected_returning_date,
+    ) in iter_overdue_borrowings(tomorrow):
+        has_overdue = True
+        message = (
+            f"Overdue Borrowing Alert:\n"
+            f"Book: {book_title}\n"
+            f"User: {user_email}\n"
+            f"Borrowing Date: {borrowing_date}\n"
+            f"Expected Returning Date: {expected_returning_date}\n"
+            f"Status: Overdue"
+        )
+        send_message(message)
+
+    if not has_overdue:
         send_message("No borrowings overdue today!")
+
+    flush_messages()
+
+
+def _claim_notifications(batch_size):
+    """Lease up to ``batch_size`` due notifications to this worker.
+
+    The rows are locked only while their ``available_at`` is pushed past
+    the lease, so other workers skip them and no transaction stays open
+    while Telegram is called. A worker that dies mid-send leaves them to
+    be picked up again once the lease expires.
+    """
+    with transaction.atomic():
+        batch = list(
+            Notification.objects.select_for_update(skip_locked=True)
+            .filter(
+                status=Notification.Status.PENDING, available_at__lte=now()
+            )
+            .order_by("available_at", "id")[:batch_size]
+        )
+        Notification.objects.filter(
+            pk__in=[notification.pk for notification in batch]
+        ).update(available_at=now() + NOTIFICATION_CLAIM_TIMEOUT)
+    return batch
+
+
+def _send_notification_batch(batch_size):
+    batch = _claim_notifications(batch_size)
+    if not batch:
+        return 0
+
+    messages = render_notifications(batch)
+    try:
+        failed = get_dispatcher().deliver(
+            messages, timeout=NOTIFICATION_SEND_TIMEOUT
+        )
+    except Exception as e:
+        # Including a timeout, after which deliver() has cancelled the
+        # digests still waiting, so the retry is their only send.
+        failed = dict.fromkeys(messages, e)
+
+    retried = [n for n in batch if n.pk in failed]
+    for notification in retried:
+        notification.attempts += 1
+        notification.last_error = str(failed[notification.pk])
+        if notification.attempts >= NOTIFICATION_MAX_ATTEMPTS:
+            notification.status = Notification.Status.FAILED
+        else:
+            notification.available_at = now() + (
+                NOTIFICATION_RETRY_DELAY * 2 ** (notification.attempts - 1)
+            )
+    Notification.objects.bulk_update(
+        retried, ["attempts", "last_error", "status", "available_at"]
+    )
+    # Including those with nothing left to say, e.g. a deleted borrowing.
+    Notification.objects.filter(
+        pk__in=[n.pk for n in batch if n.pk not in failed]
+    ).update(
+        status=Notification.Status.SENT,
+        sent_at=now(),
+        attempts=F("attempts") + 1,
+    )
+    return len(batch)
+
+
+@shared_task
+def send_pending_notifications(batch_size=NOTIFICATION_BATCH_SIZE):
+    """Drain the notification outbox in batches.
+
+    Rows are claimed with ``SKIP LOCKED`` and a lease so concurrent
+    workers never pick the same notification, and a row is only marked
+    sent after Telegram accepted it. Notifications whose digest failed
+    are retried with exponential backoff until
+    ``NOTIFICATION_MAX_ATTEMPTS`` is reached; the others are not sent
+    again.
+    """
+    sent = 0
+    while True:
+        count = _send_notification_batch(batch_size)
+        sent += count
+        if count < batch_size:
+            return sent
+
+
+@shared_task(bind=True, max_retries=CHECKOUT_SESSION_MAX_RETRIES)
+def create_checkout_session(self, payment_ids, success_url, cancel_url):
+    """Create the Stripe session for payments in the CREATING state.
+
+    All ``payment_ids`` share one session. The idempotency key is derived
+    from the payment ids, so a retried or duplicated task gets the session
+    Stripe already created instead of a second one, and payments that have
+    left CREATING are skipped.
+    """
+    payments = list(
+        Payment.objects.filter(
+            pk__in=payment_ids, status=Payment.Status.CREATING
+        )
+        .select_related("borrowing__book")
+        .order_by("pk")
+    )
+    if not payments:
+        return
+
+    pending = Payment.objects.filter(
+        pk__in=[payment.pk for payment in payments],
+        status=Payment.Status.CREATING,
+    )
+    try:
+        session = start_checkout_session(
+            [
+                (payment.borrowing.book.title, payment.money_to_pay)
+                for payment in payments
+            ],
+            success_url,
+            cancel_url,
+            idempotency_key="checkout-"
+            + "-".join(str(payment.pk) for payment in payments),
+        )
+    except STRIPE_TRANSIENT_ERRORS as e:
+        if self.request.retries >= self.max_retries:
+            pending.update(status=Payment.Status.FAILED, updated_at=now())
+            refresh_on_commit(payment.user_id for payment in payments)
+            raise
+        raise self.retry(
+            exc=e,
+            countdown=CHECKOUT_SESSION_RETRY_DELAY * 2**self.request.retries,
+        )
+    except stripe.error.StripeError:
+        pending.update(status=Payment.Status.FAILED, updated_at=now())
+        refresh_on_commit(payment.user_id for payment in payments)
+        raise
+
+    pending.update(
+        status=Payment.Status.PENDING,
+        session_url=session.url,
+        session_id=session.id,
+        updated_at=now(),
+    )
+
+
+@shared_task
+def refresh_borrowing_summaries():
+    """Catch up on summaries whose borrowings became overdue overnight."""
+    return refresh_stale_summaries(now().date())
+
+
+@shared_task
+def reconcile_pending_payments():
+    """Settle payments whose webhook or redirect never arrived."""
+    return reconcile_payments()
@@ -1,20 +1,65 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import json
+import time
+
+import stripe
+from asgiref.sync import sync_to_async
+from celery.exceptions import Retry
+from django.test import RequestFactory, TestCase, override_settings
 from django.db.utils import IntegrityError
 from books.models import Book
 from django.contrib.auth import get_user_model
-from borrowings.models import Borrowing, Payment
+from borrowings.models import (
+    Borrowing,
+    BorrowingSummary,
+    Notification,
+    Payment,
+    StripeEvent,
+)
 from rest_framework.test import APIClient
 from rest_framework import status
+from rest_framework_simplejwt.tokens import AccessToken
 
 from unittest.mock import patch, MagicMock
 from decimal import Decimal
 
 from datetime import date, timedelta
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
-from helpers.stripe_helper import create_payment_session
+from helpers.stripe_helper import (
+    acreate_payment_session,
+    create_payment_session,
+    get_async_stripe_client,
+)
+from borrowings.notifications import render_notifications
+from borrowings.reconciliation import reconcile_payments
+from borrowings.tasks import (
+    _claim_notifications,
+    check_borrowings_overdue,
+    create_checkout_session,
+    reconcile_pending_payments,
+    refresh_borrowing_summaries,
+    send_pending_notifications,
+)
+from helpers.fakes import (
+    FakeStripeServer,
+    FakeTelegramServer,
+    stripe_signature,
+)
+from helpers.telegram_helper import (
+    MAX_MESSAGE_LENGTH,
+    TelegramDispatcher,
+    asend_message,
+    build_digests,
+)
 
 BORROWINGS_URL = "/api/borrowings/"
+ASYNC_BORROWINGS_URL = "/api/async/borrowings/"
 PAYMENTS_URL = "/api/payments/"
 
 
@@ -165,7 +210,7 @@ class PaymentViewSetTest(TestCase):
         self.client.force_authenticate(user=self.regular_user)
         response = self.client.get(PAYMENTS_URL)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data["results"]), 1)
 
     def test_payment_success(self):
         response = self.client.get(
@@ -259,3 +304,1789 @@ class PaymentSessionTest(TestCase):
                 "cancel?session_id={CHECKOUT_SESSION_ID}"
             ),
         )
+
+
+class AsyncPaymentSessionTest(TestCase):
+    def setUp(self):
+        self.server = FakeStripeServer().start()
+        self.addCleanup(self.server.stop)
+        for name, value in (("api_base", self.server.url), ("api_key", "x")):
+            patcher = patch.object(stripe, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.user = get_user_model().objects.create_user(
+            password="userpass", email="user@example.com"
+        )
+        self.book = Book.objects.create(
+            title="Test Book",
+            author="Author Name",
+            cover=Book.HARD,
+            inventory=10,
+            daily_fee="2.00",
+        )
+        self.borrowing = Borrowing.objects.create(
+            book=self.book,
+            user=self.user,
+            borrowing_date=date.today(),
+            expected_returning_date=date.today() + timedelta(days=2),
+        )
+        self.request = RequestFactory().get("/api/borrowings/")
+
+    async def test_creates_session_and_payment(self):
+        # Fetched without its book, which must be loaded asynchronously.
+        borrowing = await Borrowing.objects.aget(pk=self.borrowing.pk)
+
+        payment = await acreate_payment_session(borrowing, self.request)
+
+        self.assertIsNotNone(payment)
+        self.assertIn(payment.session_id, self.server.sessions)
+        self.assertEqual(payment.status, Payment.Status.PENDING)
+        self.assertEqual(payment.money_to_pay, Decimal("6.00"))
+        self.assertEqual(await Payment.objects.acount(), 1)
+        self.assertEqual(
+            self.server.requests, [("POST", "/v1/checkout/sessions")]
+        )
+
+    async def test_reuses_the_http_client(self):
+        first = get_async_stripe_client()
+        await acreate_payment_session(self.borrowing, self.request)
+
+        self.assertIs(get_async_stripe_client(), first)
+
+    async def test_stripe_error_creates_no_payment(self):
+        self.server.rate_limited = 10
+
+        payment = await acreate_payment_session(self.borrowing, self.request)
+
+        self.assertIsNone(payment)
+        self.assertEqual(await Payment.objects.acount(), 0)
+
+
+class CheckBorrowingsOverdueTaskTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            password="userpass", email="user@example.com"
+        )
+        self.book = Book.objects.create(
+            title="Test Book",
+            author="Author Name",
+            cover=Book.HARD,
+            inventory=10,
+            daily_fee="2.50",
+        )
+
+    def create_borrowing(self, days_left, returned=False):
+        borrowing = Borrowing.objects.create(
+            book=self.book,
+            user=self.user,
+            expected_returning_date=date.today() + timedelta(days=days_left),
+        )
+        if returned:
+            borrowing.actual_returning_date = date.today()
+            borrowing.save()
+        return borrowing
+
+    @patch("borrowings.tasks.flush_messages", MagicMock())
+    @patch("borrowings.tasks.send_message")
+    def test_only_unreturned_borrowings_due_by_tomorrow_alert(self, mock_send):
+        self.create_borrowing(days_left=0)
+        self.create_borrowing(days_left=1)
+        self.create_borrowing(days_left=5)
+        self.create_borrowing(days_left=0, returned=True)
+
+        check_borrowings_overdue()
+
+        self.assertEqual(mock_send.call_count, 2)
+        message = mock_send.call_args_list[0].args[0]
+        self.assertIn("Book: Test Book", message)
+        self.assertIn("User: user@example.com", message)
+
+    @patch("borrowings.tasks.flush_messages", MagicMock())
+    @patch("borrowings.tasks.send_message")
+    def test_no_overdue_borrowings(self, mock_send):
+        self.create_borrowing(days_left=5)
+
+        check_borrowings_overdue()
+
+        mock_send.assert_called_once_with("No borrowings overdue today!")
+
+    @patch("borrowings.tasks.flush_messages", MagicMock())
+    @patch("borrowings.tasks.send_message")
+    def test_scan_query_count_does_not_grow_with_rows(self, mock_send):
+        for _ in range(5):
+            self.create_borrowing(days_left=0)
+
+        with self.assertNumQueries(1):
+            check_borrowings_overdue()
+        self.assertEqual(mock_send.call_count, 5)
+
+
+class TelegramDispatcherTest(TestCase):
+    def setUp(self):
+        self.server = FakeTelegramServer().start()
+        self.addCleanup(self.server.stop)
+
+    def make_dispatcher(self, **kwargs):
+        dispatcher = TelegramDispatcher(
+            "123:TEST", "42", base_url=self.server.base_url, **kwargs
+        )
+        self.addCleanup(dispatcher.close, 5)
+        return dispatcher
+
+    def test_build_digests_packs_messages_under_the_limit(self):
+        messages = [f"Message {i}\n" + "x" * 50 for i in range(100)]
+
+        digests = build_digests(messages, max_length=500)
+
+        self.assertLess(len(digests), len(messages))
+        self.assertTrue(all(len(digest) <= 500 for digest in digests))
+        self.assertEqual("\n\n".join(digests), "\n\n".join(messages))
+
+    def test_build_digests_splits_oversized_message(self):
+        digests = build_digests(["line\n" * 300], max_length=100)
+
+        self.assertTrue(all(len(digest) <= 100 for digest in digests))
+        self.assertEqual(sum(d.count("line") for d in digests), 300)
+
+    def test_queued_messages_are_coalesced_into_digests(self):
+        dispatcher = self.make_dispatcher(rate_limit=None)
+
+        for i in range(50):
+            dispatcher.send(f"Overdue borrowing {i}")
+        dispatcher.flush(timeout=5)
+
+        self.assertLess(len(self.server.messages), 50)
+        delivered = "\n\n".join(self.server.messages)
+        for i in range(50):
+            self.assertIn(f"Overdue borrowing {i}", delivered)
+        self.assertTrue(
+            all(len(m) <= MAX_MESSAGE_LENGTH for m in self.server.messages)
+        )
+
+    async def test_asend_queues_without_blocking(self):
+        dispatcher = self.make_dispatcher(rate_limit=None)
+
+        await asyncio.gather(
+            *(dispatcher.asend(f"Overdue borrowing {i}") for i in range(5))
+        )
+        await sync_to_async(dispatcher.flush)(timeout=5)
+
+        delivered = "\n\n".join(self.server.messages)
+        for i in range(5):
+            self.assertIn(f"Overdue borrowing {i}", delivered)
+
+    async def test_asend_message_uses_the_process_dispatcher(self):
+        dispatcher = self.make_dispatcher(rate_limit=None)
+
+        with patch(
+            "helpers.telegram_helper.get_dispatcher", return_value=dispatcher
+        ):
+            await asend_message("Overdue borrowing")
+        await sync_to_async(dispatcher.flush)(timeout=5)
+
+        self.assertEqual(self.server.messages, ["Overdue borrowing"])
+
+    def test_deliver_reports_messages_of_failed_digests(self):
+        dispatcher = self.make_dispatcher(rate_limit=None, max_length=12)
+        self.server.reject = "spam"
+
+        failed = dispatcher.deliver(
+            {1: "Hello", 2: "spam spam", 3: "Goodbye"}, timeout=5
+        )
+
+        self.assertEqual(list(failed), [2])
+        self.assertCountEqual(self.server.messages, ["Hello", "Goodbye"])
+
+    def test_rate_limit_is_respected(self):
+        dispatcher = self.make_dispatcher(
+            rate_limit=20, concurrency=4, max_length=20
+        )
+
+        dispatcher.deliver([f"Message number {i}" for i in range(6)])
+
+        self.assertEqual(len(self.server.messages), 6)
+        self.assertLessEqual(self.server.throughput, 21)
+
+
+class NotificationOutboxTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            password="userpass", email="user@example.com"
+        )
+        self.book = Book.objects.create(
+            title="Test Book",
+            author="Author Name",
+            cover=Book.HARD,
+            inventory=10,
+            daily_fee="2.50",
+        )
+
+    def create_borrowing(self):
+        return Borrowing.objects.create(
+            book=self.book,
+            user=self.user,
+            expected_returning_date=date.today() + timedelta(days=7),
+        )
+
+    @patch("borrowings.tasks.get_dispatcher")
+    def test_borrowing_creation_only_inserts_outbox_row(self, mock_dispatcher):
+        with self.assertNumQueries(2):
+            borrowing = self.create_borrowing()
+
+        mock_dispatcher.assert_not_called()
+        notification = Notification.objects.get()
+        self.assertEqual(notification.status, Notification.Status.PENDING)
+        self.assertEqual(notification.payload, {"borrowing_id": borrowing.pk})
+
+    def test_enqueue_deduplicates_on_key(self):
+        for _ in range(2):
+            Notification.enqueue(
+                Notification.Event.BORROWING_CREATED,
+                "borrowing-created:1",
+                borrowing_id=1,
+            )
+        self.assertEqual(Notification.objects.count(), 1)
+
+    @patch("borrowings.tasks.get_dispatcher")
+    def test_drain_delivers_batches_and_marks_sent(self, mock_dispatcher):
+        for _ in range(5):
+            self.create_borrowing()
+
+        deliver = mock_dispatcher.return_value.deliver
+        deliver.return_value = {}
+
+        sent = send_pending_notifications(batch_size=2)
+
+        self.assertEqual(sent, 5)
+        self.assertEqual(deliver.call_count, 3)
+        messages = [
+            m for call in deliver.call_args_list for m in call.args[0].values()
+        ]
+        self.assertEqual(len(messages), 5)
+        self.assertIn("Book: Test Book", messages[0])
+        self.assertIn("User: user@example.com", messages[0])
+        self.assertFalse(
+            Notification.objects.exclude(
+                status=Notification.Status.SENT
+            ).exists()
+        )
+
+        deliver.reset_mock()
+        self.assertEqual(send_pending_notifications(), 0)
+        deliver.assert_not_called()
+
+    @patch("borrowings.tasks.get_dispatcher")
+    def test_failed_delivery_is_retried_with_backoff(self, mock_dispatcher):
+        self.create_borrowing()
+        mock_dispatcher.return_value.deliver.side_effect = RuntimeError(
+            "Telegram is down"
+        )
+
+        send_pending_notifications()
+
+        notification = Notification.objects.get()
+        self.assertEqual(notification.status, Notification.Status.PENDING)
+        self.assertEqual(notification.attempts, 1)
+        self.assertEqual(notification.last_error, "Telegram is down")
+        self.assertGreater(notification.available_at, timezone.now())
+
+        # Not due yet, so the next run leaves it alone.
+        mock_dispatcher.return_value.deliver.reset_mock()
+        send_pending_notifications()
+        mock_dispatcher.return_value.deliver.assert_not_called()
+
+    @patch("borrowings.tasks.get_dispatcher")
+    def test_only_failed_notifications_are_retried(self, mock_dispatcher):
+        delivered, failed = [self.create_borrowing() for _ in range(2)]
+        deliver = mock_dispatcher.return_value.deliver
+
+        def fail_second(messages, timeout=None):
+            return {
+                key: RuntimeError("Bad Request") for key in list(messages)[1:]
+            }
+
+        deliver.side_effect = fail_second
+
+        send_pending_notifications()
+
+        statuses = dict(
+            Notification.objects.values_list("payload__borrowing_id", "status")
+        )
+        self.assertEqual(
+            statuses,
+            {
+                delivered.pk: Notification.Status.SENT,
+                failed.pk: Notification.Status.PENDING,
+            },
+        )
+
+        Notification.objects.update(available_at=timezone.now())
+        deliver.side_effect = None
+        deliver.return_value = {}
+        send_pending_notifications()
+
+        (messages,), _ = deliver.call_args
+        self.assertEqual(len(messages), 1)
+        self.assertIn(f"Book: {self.book.title}", *messages.values())
+
+    def test_timed_out_batch_is_cancelled_not_sent_twice(self):
+        books = [
+            Book.objects.create(
+                title=f"Slow Book {i}",
+                author="Author Name",
+                cover=Book.HARD,
+                inventory=10,
+                daily_fee="2.50",
+            )
+            for i in range(3)
+        ]
+        for book in books:
+            Borrowing.objects.create(
+                book=book,
+                user=self.user,
+                expected_returning_date=date.today() + timedelta(days=7),
+            )
+        server = FakeTelegramServer(latency=0.3).start()
+        self.addCleanup(server.stop)
+        # One message per digest, sent one at a time.
+        dispatcher = TelegramDispatcher(
+            "123:TEST",
+            "42",
+            base_url=server.base_url,
+            rate_limit=None,
+            concurrency=1,
+            max_length=200,
+        )
+        self.addCleanup(dispatcher.close, 5)
+
+        with patch(
+            "borrowings.tasks.get_dispatcher", return_value=dispatcher
+        ), patch("borrowings.tasks.NOTIFICATION_SEND_TIMEOUT", 0.1):
+            send_pending_notifications()
+            self.assertFalse(
+                Notification.objects.filter(
+                    status=Notification.Status.SENT
+                ).exists()
+            )
+            # Long enough for an abandoned send to get through all three.
+            time.sleep(1.2)
+            # Only the digest already in flight reached Telegram.
+            self.assertEqual(len(server.messages), 1)
+
+            server.latency = 0
+            Notification.objects.update(available_at=timezone.now())
+            send_pending_notifications()
+
+        self.assertFalse(
+            Notification.objects.exclude(
+                status=Notification.Status.SENT
+            ).exists()
+        )
+        delivered = [
+            sum(f"Book: {book.title}\n" in m for m in server.messages)
+            for book in books
+        ]
+        # The digest in flight at the timeout may or may not have arrived,
+        # so it is sent again; the cancelled ones only by the retry.
+        self.assertEqual(sorted(delivered), [1, 1, 2])
+
+    def test_claimed_notifications_are_skipped_until_the_lease_expires(self):
+        self.create_borrowing()
+        claimed = _claim_notifications(10)
+
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(_claim_notifications(10), [])
+        self.assertGreater(
+            Notification.objects.get().available_at, timezone.now()
+        )
+
+
+class BorrowingQueryCountTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin_user = get_user_model().objects.create_superuser(
+            password="adminpass", email="admin@example.com"
+        )
+        self.user = get_user_model().objects.create_user(
+            password="userpass", email="user@example.com"
+        )
+        self.client.force_authenticate(user=self.admin_user)
+
+    def create_borrowings(self, count):
+        for _ in range(count):
+            book = Book.objects.create(
+                title=f"Book {Book.objects.count()}",
+                author="Author Name",
+                cover=Book.HARD,
+                inventory=10,
+                daily_fee="2.50",
+            )
+            borrowing = Borrowing.objects.create(
+                book=book,
+                user=self.user,
+                expected_returning_date=date.today() + timedelta(days=7),
+            )
+            for payment_type in Payment.Type.values:
+                Payment.objects.create(
+                    borrowing=borrowing,
+                    session_url="http://example.com/session",
+                    session_id=f"session_{borrowing.pk}_{payment_type}",
+                    money_to_pay="10.00",
+                    user=self.user,
+                    type=payment_type,
+                )
+
+    def test_list_query_count_is_constant(self):
+        self.create_borrowings(1)
+        with self.assertNumQueries(2):
+            response = self.client.get(BORROWINGS_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.create_borrowings(5)
+        with self.assertNumQueries(2):
+            response = self.client.get(BORROWINGS_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data["results"]
+        self.assertEqual(len(results), 6)
+        self.assertEqual(len(results[0]["payments"]), 2)
+        self.assertEqual(results[0]["book"]["title"], "Book 0")
+
+    def test_retrieve_query_count(self):
+        self.create_borrowings(1)
+        borrowing = Borrowing.objects.get()
+
+        with self.assertNumQueries(2):
+            response = self.client.get(f"{BORROWINGS_URL}{borrowing.pk}/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["payments"]), 2)
+
+
+class BorrowingPaginationTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            password="userpass", email="user@example.com"
+        )
+        self.book = Book.objects.create(
+            title="Test Book",
+            author="Author Name",
+            cover=Book.HARD,
+            inventory=10,
+            daily_fee="2.50",
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def test_pages_through_borrowings_sharing_a_date(self):
+        borrowings = [
+            Borrowing.objects.create(
+                book=self.book,
+                user=self.user,
+                expected_returning_date=date.today() + timedelta(days=7),
+            )
+            for _ in range(7)
+        ]
+
+        seen = []
+        url = f"{BORROWINGS_URL}?page_size=3"
+        while url:
+            with self.assertNumQueries(3):
+                response = self.client.get(url)
+            seen.extend(item["id"] for item in response.data["results"])
+            url = response.data["next"]
+
+        self.assertEqual(seen, [borrowing.id for borrowing in borrowings])
+
+
+class SparseFieldsTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            password="userpass", email="user@example.com"
+        )
+        book = Book.objects.create(
+            title="Test Book",
+            author="Author Name",
+            cover=Book.HARD,
+            inventory=10,
+            daily_fee="2.50",
+        )
+        self.borrowing = Borrowing.objects.create(
+            book=book,
+            user=self.user,
+            expected_returning_date=date.today() + timedelta(days=7),
+        )
+        self.payments = [
+            Payment.objects.create(
+                borrowing=self.borrowing,
+                session_id=f"session_{payment_type}",
+                money_to_pay="10.00",
+                user=self.user,
+                type=payment_type,
+            )
+            for payment_type in Payment.Type.values
+        ]
+        self.client.force_authenticate(user=self.user)
+
+    def test_selected_fields_only(self):
+        # The listing's ETag and the borrowings.
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                BORROWINGS_URL,
+                {"fields": "id,expected_returning_date", "expand": ""},
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.json()["results"],
+            [
+                {
+                    "id": self.borrowing.id,
+                    "expected_returning_date": str(
+                        self.borrowing.expected_returning_date
+                    ),
+                }
+            ],
+        )
+
+    def test_unexpanded_relations_are_primary_keys(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(BORROWINGS_URL, {"expand": ""})
+
+        item = response.json()["results"][0]
+        self.assertEqual(item["book"], self.borrowing.book_id)
+        self.assertEqual(
+            item["payments"], [payment.id for payment in self.payments]
+        )
+
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                f"{BORROWINGS_URL}{self.borrowing.pk}/",
+                {"fields": "id,book,payments", "expand": "book"},
+            )
+
+        self.assertEqual(response.data["book"]["title"], "Test Book")
+        self.assertEqual(
+            response.data["payments"],
+            [payment.id for payment in self.payments],
+        )
+
+    def test_default_expands_everything(self):
+        response = self.client.get(BORROWINGS_URL, {"fields": "payments"})
+
+        self.assertEqual(
+            [
+                payment["id"]
+                for payment in response.data["results"][0]["payments"]
+            ],
+            [payment.id for payment in self.payments],
+        )
+
+    def test_payment_fields(self):
+        response = self.client.get(PAYMENTS_URL, {"fields": "id,status"})
+
+        self.assertEqual(
+            response.json()["results"][0],
+            {"id": self.payments[0].id, "status": Payment.Status.PENDING},
+        )
+
+    def test_unknown_names_are_rejected(self):
+        response = self.client.get(BORROWINGS_URL, {"fields": "id,secret"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("secret", str(response.data["fields"]))
+
+        response = self.client.get(BORROWINGS_URL, {"expand": "user"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(PAYMENTS_URL, {"expand": "borrowing"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ConditionalBorrowingListTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            password="userpass", email="user@example.com"
+        )
+        self.book = Book.objects.create(
+            title="Test Book",
+            author="Author Name",
+            cover=Book.HARD,
+            inventory=10,
+            daily_fee="2.50",
+        )
+        self.old, self.recent = [
+            Borrowing.objects.create(
+                book=self.book,
+                user=self.user,
+                expected_returning_date=date.today() + timedelta(days=7),
+            )
+            for _ in range(2)
+        ]
+        self.payment = Payment.objects.create(
+            borrowing=self.old,
+            session_id="session_12345",
+            money_to_pay="10.00",
+            user=self.user,
+            type=Payment.Type.PAYMENT,
+        )
+        self.since = timezone.now() - timedelta(hours=1)
+        past = self.since - timedelta(hours=1)
+        Borrowing.objects.filter(pk=self.old.pk).update(updated_at=past)
+        Payment.objects.update(updated_at=past)
+        self.client.force_authenticate(user=self.user)
+
+    def poll(self, etag, **params):
+        return self.client.get(
+            BORROWINGS_URL,
+            {"is_active": "true", **params},
+            HTTP_IF_NONE_MATCH=etag,
+        )
+
+    def test_unchanged_listing_is_not_modified(self):
+        etag = self.poll("")["ETag"]
+
+        with self.assertNumQueries(1):
+            response = self.poll(etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.content, b"")
+
+    def test_changes_to_borrowings_and_payments_change_the_etag(self):
+        etag = self.poll("")["ETag"]
+
+        self.payment.status = Payment.Status.PAID
+        self.payment.save()
+        response = self.poll(etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response["ETag"]
+
+        self.client.post(f"{BORROWINGS_URL}{self.recent.pk}/return/")
+        response = self.poll(etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertNotEqual(self.poll(etag, page_size=1)["ETag"], etag)
+
+    def test_changes_to_the_book_change_the_etag(self):
+        etag = self.poll("")["ETag"]
+
+        Book.objects.reserve(self.book.pk)
+
+        response = self.poll(etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["results"][0]["book"]["inventory"], 9)
+        # Unexpanded, the book's changes are not part of the listing.
+        etag = self.poll("", expand="")["ETag"]
+        Book.objects.reserve(self.book.pk)
+        response = self.poll(etag, expand="")
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_unscoped_staff_listing_is_not_aggregated(self):
+        staff = get_user_model().objects.create_user(
+            password="staffpass", email="staff@example.com", is_staff=True
+        )
+        self.client.force_authenticate(user=staff)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(BORROWINGS_URL)
+        self.assertFalse(response.has_header("ETag"))
+
+        response = self.client.get(BORROWINGS_URL, {"user_id": self.user.pk})
+        etag = response["ETag"]
+        response = self.client.get(
+            BORROWINGS_URL, {"user_id": self.user.pk}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_since_returns_only_changed_borrowings(self):
+        response = self.poll("", since=self.since.isoformat())
+        self.assertEqual(
+            [item["id"] for item in response.data["results"]],
+            [self.recent.id],
+        )
+
+        # A change to a payment is a change to its borrowing, and a
+        # returned borrowing is listed so the client can drop it.
+        Payment.objects.update(
+            status=Payment.Status.PAID, updated_at=timezone.now()
+        )
+        Borrowing.objects.filter(pk=self.recent.pk).update(
+            actual_returning_date=date.today(), updated_at=timezone.now()
+        )
+        response = self.poll("", since=self.since.isoformat())
+        self.assertEqual(
+            [item["id"] for item in response.data["results"]],
+            [self.old.id, self.recent.id],
+        )
+        self.assertEqual(
+            response.data["results"][1]["actual_returning_date"],
+            str(date.today()),
+        )
+
+    def test_invalid_since_is_rejected(self):
+        response = self.poll("", since="yesterday")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_async_listing_is_not_modified(self):
+        headers = {
+            "Authorization": f"Bearer {AccessToken.for_user(self.user)}"
+        }
+        response = await self.async_client.get(
+            ASYNC_BORROWINGS_URL, headers=headers
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = await self.async_client.get(
+            ASYNC_BORROWINGS_URL,
+            headers={**headers, "If-None-Match": response["ETag"]},
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class AsyncBorrowingListTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            password="userpass", email="user@example.com"
+        )
+        other = get_user_model().objects.create_user(
+            password="userpass", email="other@example.com"
+        )
+        self.book = Book.objects.create(
+            title="Test Book",
+            author="Author Name",
+            cover=Book.HARD,
+            inventory=10,
+            daily_fee="2.50",
+        )
+        for user in (self.user, self.user, other):
+            Borrowing.objects.create(
+                book=self.book,
+                user=user,
+                expected_returning_date=date.today() + timedelta(days=7),
+            )
+        self.headers = {
+            "Authorization": f"Bearer {AccessToken.for_user(self.user)}"
+        }
+
+    async def test_requires_authentication(self):
+        response = await self.async_client.get(ASYNC_BORROWINGS_URL)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        response = await self.async_client.get(
+            ASYNC_BORROWINGS_URL, headers={"Authorization": "Bearer nope"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_lists_own_borrowings_like_sync_endpoint(self):
+        self.client.force_authenticate(user=self.user)
+
+        response = await self.async_client.get(
+            f"{ASYNC_BORROWINGS_URL}?page_size=1", headers=self.headers
+        )
+        expected = await sync_to_async(self.client.get)(
+            f"{BORROWINGS_URL}?page_size=1"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(data["results"], expected.json()["results"])
+        self.assertIn(ASYNC_BORROWINGS_URL, data["next"])
+
+        response = await self.async_client.get(
+            data["next"], headers=self.headers
+        )
+        self.assertEqual(len(response.json()["results"]), 1)
+        self.assertIsNone(response.json()["next"])
+
+
+class BorrowingInventoryTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin_user = get_user_model().objects.create_superuser(
+            password="adminpass", email="admin@example.com"
+        )
+        self.user = get_user_model().objects.create_user(
+            password="userpass", email="user@example.com"
+        )
+        self.book = Book.objects.create(
+            title="Test Book",
+            author="Author Name",
+            cover=Book.HARD,
+            inventory=1,
+            daily_fee="2.50",
+        )
+        self.data = {
+            "book": self.book.id,
+            "expected_returning_date": date.today() + timedelta(days=7),
+        }
+
+    @patch("borrowings.views.create_payment_session")
+    def test_checkout_reserves_last_copy_only_once(self, mock_session):
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.post(BORROWINGS_URL, self.data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = self.client.post(BORROWINGS_URL, self.data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 0)
+        self.assertEqual(Borrowing.objects.count(), 1)
+
+    @patch("borrowings.serializers.Book.objects.reserve", return_value=False)
+    def test_checkout_fails_when_reservation_loses_race(self, mock_reserve):
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.post(BORROWINGS_URL, self.data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Borrowing.objects.exists())
+
+    def test_return_restores_inventory_once(self):
+        borrowing = Borrowing.objects.create(
+            book=self.book,
+            user=self.user,
+            expected_returning_date=date.today() + timedelta(days=7),
+        )
+        self.client.force_authenticate(user=self.admin_user)
+        url = f"{BORROWINGS_URL}{borrowing.id}/return/"
+
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["book"]["inventory"], 2)
+
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 2)
+
+
+@patch("stripe.checkout.Session.create")
+class BorrowingCheckoutTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            password="userpass", email="user@example.com"
+        )
+        self.client.force_authenticate(user=self.user)
+        self.books = [
+            Book.objects.create(
+                title=f"Book {i}",
+                author="Author Name",
+                cover=Book.HARD,
+                inventory=2,
+                daily_fee="1.00",
+            )
+            for i in range(5)
+        ]
+        self.due = date.today() + timedelta(days=4)
+
+    def checkout(self, book_ids):
+        return self.client.post(
+            f"{BORROWINGS_URL}checkout/",
+            {"books": book_ids, "expected_returning_date": self.due},
+            format="json",
+        )
+
+    def mock_session(self, mock_create_session):
+        mock_create_session.return_value = MagicMock(
+            url="https://checkout.stripe.com/pay/cs_test_basket",
+            id="cs_test_basket",
+        )
+
+    def test_basket_shares_one_session(self, mock_create_session):
+        self.mock_session(mock_create_session)
+        book_ids = [self.books[0].id, self.books[1].id, self.books[1].id]
+
+        response = self.checkout(book_ids)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [item["book"]["id"] for item in response.data], book_ids
+        )
+        mock_create_session.assert_called_once()
+        self.assertEqual(
+            len(mock_create_session.call_args.kwargs["line_items"]), 3
+        )
+        payments = Payment.objects.filter(session_id="cs_test_basket")
+        self.assertEqual(payments.count(), 3)
+        self.assertEqual(
+            [item["payments"][0]["money_to_pay"] for item in response.data],
+            ["5.00"] * 3,
+        )
+        self.books[1].refresh_from_db()
+        self.assertEqual(self.books[1].inventory, 0)
+
+        notification = Notification.objects.get()
+        self.assertEqual(
+            notification.event, Notification.Event.BORROWINGS_CHECKED_OUT
+        )
+        message = render_notifications([notification])[notification.pk]
+        self.assertIn("- Book 0\n- Book 1\n- Book 1", message)
+
+    def test_query_count_does_not_grow_with_basket(self, mock_create_session):
+        self.mock_session(mock_create_session)
+        counts = []
+        for books in (self.books[:1], self.books[1:]):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.checkout([book.id for book in books])
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_out_of_stock_book_rejects_whole_basket(self, mock_create_session):
+        response = self.checkout([self.books[0].id] * 3)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Book 0", str(response.data["books"]))
+        mock_create_session.assert_not_called()
+
+    @patch(
+        "borrowings.serializers.Book.objects.reserve_many",
+        return_value=False,
+    )
+    def test_lost_reservation_race_creates_nothing(
+        self, mock_reserve, mock_create_session
+    ):
+        response = self.checkout([self.books[0].id, self.books[1].id])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Borrowing.objects.exists())
+        self.assertFalse(Notification.objects.exists())
+
+    def test_unknown_book_and_past_date_are_rejected(
+        self, mock_create_session
+    ):
+        self.due = date.today() - timedelta(days=1)
+        response = self.checkout([self.books[0].id, 999999])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("999999", str(response.data["books"]))
+        self.assertIn("expected_returning_date", response.data)
+
+    def test_success_marks_whole_basket_paid(self, mock_create_session):
+        self.mock_session(mock_create_session)
+        self.checkout([book.id for book in self.books[:2]])
+
+        response = self.client.get(
+            f"{PAYMENTS_URL}success/", {"session_id": "cs_test_basket"}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            Payment.objects.filter(status=Payment.Status.PAID).count(), 2
+        )
+        notification = Notification.objects.get(
+            event=Notification.Event.PAYMENT_SUCCEEDED
+        )
+        self.assertEqual(
+            render_notifications([notification])[notification.pk],
+            "Payment successful for borrowing of book Book 0, Book 1",
+        )
+
+
+@patch("stripe.checkout.Session.create")
+class BorrowingBulkReturnTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin_user = get_user_model().objects.create_superuser(
+            password="adminpass", email="admin@example.com"
+        )
+        self.users = [
+            get_user_model().objects.create_user(
+                password="userpass", email=f"user{i}@example.com"
+            )
+            for i in range(2)
+        ]
+        self.book = Book.objects.create(
+            title="Test Book",
+            author="Author Name",
+            cover=Book.HARD,
+            inventory=0,
+            daily_fee="2.50",
+        )
+        self.client.force_authenticate(user=self.admin_user)
+
+    def create_borrowing(self, user, days_overdue):
+        borrowing = Borrowing.objects.create(
+            book=self.book,
+            user=user,
+            expected_returning_date=date.today(),
+        )
+        Borrowing.objects.filter(pk=borrowing.pk).update(
+            borrowing_date=date.today() - timedelta(days=days_overdue + 7),
+            expected_returning_date=date.today()
+            - timedelta(days=days_overdue),
+        )
+        return borrowing
+
+    def bulk_return(self, borrowing_ids):
+        return self.client.post(
+            f"{BORROWINGS_URL}bulk-return/",
+            {"borrowings": borrowing_ids},
+            format="json",
+        )
+
+    def test_fines_are_computed_in_sql_and_billed_per_user(
+        self, mock_create_session
+    ):
+        mock_create_session.side_effect = [
+            MagicMock(url="https://checkout.stripe.com/pay/a", id="cs_a"),
+            MagicMock(url="https://checkout.stripe.com/pay/b", id="cs_b"),
+        ]
+        late = [
+            self.create_borrowing(self.users[0], days_overdue=3),
+            self.create_borrowing(self.users[0], days_overdue=1),
+            self.create_borrowing(self.users[1], days_overdue=2),
+        ]
+        on_time = self.create_borrowing(self.users[1], days_overdue=0)
+
+        response = self.bulk_return([b.id for b in late] + [on_time.id])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(mock_create_session.call_count, 2)
+        fines = {
+            payment["borrowing"]: payment["money_to_pay"]
+            for payment in response.data["payments"]
+        }
+        self.assertEqual(
+            fines,
+            {late[0].id: "15.00", late[1].id: "5.00", late[2].id: "10.00"},
+        )
+        self.assertEqual(
+            Payment.objects.filter(
+                type=Payment.Type.FINE, session_id="cs_a"
+            ).count(),
+            2,
+        )
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 4)
+        self.assertFalse(
+            Borrowing.objects.filter(
+                actual_returning_date__isnull=True
+            ).exists()
+        )
+
+    def test_returned_and_unknown_borrowings_are_skipped(
+        self, mock_create_session
+    ):
+        borrowing = self.create_borrowing(self.users[0], days_overdue=0)
+        self.bulk_return([borrowing.id])
+
+        response = self.bulk_return([borrowing.id, 999999])
+
+        self.assertEqual(response.data["returned"], [])
+        self.assertEqual(response.data["skipped"], [borrowing.id, 999999])
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 1)
+        mock_create_session.assert_not_called()
+
+    def test_query_count_does_not_grow_with_batch(self, mock_create_session):
+        counts = []
+        for size in (1, 5):
+            borrowings = [
+                self.create_borrowing(self.users[0], days_overdue=0)
+                for _ in range(size)
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                self.bulk_return([b.id for b in borrowings])
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_regular_user_is_forbidden(self, mock_create_session):
+        borrowing = self.create_borrowing(self.users[0], days_overdue=3)
+        self.client.force_authenticate(user=self.users[0])
+
+        response = self.bulk_return([borrowing.id])
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin_user = get_user_model().objects.create_superuser(
+            password="adminpass", email="admin@example.com"
+        )
+        self.user = get_user_model().objects.create_user(
+            password="userpass", email="user@example.com"
+        )
+        self.book = Book.objects.create(
+            title="Test Book, 2nd edition",
+            author="Author Name",
+            cover=Book.HARD,
+            inventory=10,
+            daily_fee="2.50",
+        )
+        self.borrowings = []
+        for days_ago in (10, 5, 0):
+            borrowing = Borrowing.objects.create(
+                book=self.book,
+                user=self.user,
+                expected_returning_date=date.today() + timedelta(days=7),
+            )
+            Borrowing.objects.filter(pk=borrowing.pk).update(
+                borrowing_date=date.today() - timedelta(days=days_ago)
+            )
+            self.borrowings.append(borrowing)
+        Borrowing.objects.filter(pk=self.borrowings[0].pk).update(
+            actual_returning_date=date.today()
+        )
+        for borrowing, payment_status in zip(
+            self.borrowings, (Payment.Status.PAID, Payment.Status.PENDING)
+        ):
+            Payment.objects.create(
+                status=payment_status,
+                type=Payment.Type.PAYMENT,
+                borrowing=borrowing,
+                money_to_pay="17.50",
+                user=self.user,
+            )
+        self.client.force_authenticate(user=self.admin_user)
+
+    def export(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content)
+
+    def test_borrowings_csv_with_date_range(self):
+        content = self.export(
+            f"{BORROWINGS_URL}export/",
+            date_from=date.today() - timedelta(days=5),
+        )
+
+        rows = list(csv.reader(content.decode().splitlines()))
+        self.assertEqual(rows[0][:3], ["id", "book_id", "book_title"])
+        self.assertEqual(
+            [int(row[0]) for row in rows[1:]],
+            [self.borrowings[1].id, self.borrowings[2].id],
+        )
+        self.assertEqual(rows[1][2], "Test Book, 2nd edition")
+
+    def test_borrowings_ndjson_filtered_by_activity(self):
+        content = self.export(
+            f"{BORROWINGS_URL}export/", output="ndjson", is_active="false"
+        )
+
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([row["id"] for row in rows], [self.borrowings[0].id])
+        self.assertEqual(rows[0]["user_email"], "user@example.com")
+        self.assertEqual(rows[0]["actual_returning_date"], str(date.today()))
+
+    def test_payments_gzip_filtered_by_status(self):
+        response = self.client.get(
+            f"{PAYMENTS_URL}export/",
+            {"status": Payment.Status.PAID},
+            HTTP_ACCEPT_ENCODING="gzip, deflate",
+        )
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        content = gzip.decompress(b"".join(response.streaming_content))
+        rows = list(csv.DictReader(content.decode().splitlines()))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["borrowing_id"], str(self.borrowings[0].id))
+        self.assertEqual(rows[0]["money_to_pay"], "17.50")
+
+    def test_gzip_refused_with_zero_quality_is_not_used(self):
+        for accept_encoding in (
+            "gzip;q=0",
+            "identity, gzip;q=0",
+            "*;q=0",
+            "deflate",
+        ):
+            response = self.client.get(
+                f"{PAYMENTS_URL}export/",
+                HTTP_ACCEPT_ENCODING=accept_encoding,
+            )
+            self.assertNotIn("Content-Encoding", response, accept_encoding)
+            self.assertIn("Accept-Encoding", response["Vary"])
+
+        response = self.client.get(
+            f"{PAYMENTS_URL}export/", HTTP_ACCEPT_ENCODING="*;q=0.5"
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+
+    def test_invalid_parameters_are_rejected(self):
+        for params in (
+            {"output": "xml"},
+            {"date_from": "2024-02-01", "date_to": "2024-01-01"},
+        ):
+            response = self.client.get(f"{PAYMENTS_URL}export/", params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_regular_user_is_forbidden(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(f"{BORROWINGS_URL}export/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(STRIPE_ASYNC_CHECKOUT=True)
+class AsyncCheckoutSessionTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            password="userpass", email="user@example.com"
+        )
+        self.book = Book.objects.create(
+            title="Test Book",
+            author="Author Name",
+            cover=Book.HARD,
+            inventory=10,
+            daily_fee="2.00",
+        )
+        self.borrowing = Borrowing.objects.create(
+            book=self.book,
+            user=self.user,
+            expected_returning_date=date.today() + timedelta(days=6),
+        )
+        self.request = MagicMock()
+        self.request.build_absolute_uri.side_effect = (
+            lambda path: f"https://localhost{path}"
+        )
+
+    def create_placeholder(self):
+        with patch(
+            "borrowings.tasks.create_checkout_session.delay"
+        ) as mock_delay, self.captureOnCommitCallbacks(execute=True):
+            payment = create_payment_session(self.borrowing, self.request)
+        return payment, mock_delay
+
+    @patch("stripe.checkout.Session.create")
+    def test_placeholder_is_created_without_calling_stripe(
+        self, mock_create_session
+    ):
+        payment, mock_delay = self.create_placeholder()
+
+        mock_create_session.assert_not_called()
+        self.assertEqual(payment.status, Payment.Status.CREATING)
+        self.assertEqual(payment.money_to_pay, Decimal("14.00"))
+        self.assertIsNone(payment.session_id)
+        mock_delay.assert_called_once()
+        self.assertEqual(mock_delay.call_args.args[0], [payment.pk])
+
+    @patch("stripe.checkout.Session.create")
+    def test_task_fills_in_session_once(self, mock_create_session):
+        mock_create_session.return_value = MagicMock(
+            url="https://checkout.stripe.com/pay/cs_test_123",
+            id="cs_test_123",
+        )
+        payment, mock_delay = self.create_placeholder()
+
+        for _ in range(2):
+            create_checkout_session(*mock_delay.call_args.args)
+
+        mock_create_session.assert_called_once()
+        self.assertEqual(
+            mock_create_session.call_args.kwargs["idempotency_key"],
+            f"checkout-{payment.pk}",
+        )
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.Status.PENDING)
+        self.assertEqual(payment.session_id, "cs_test_123")
+
+    @patch("stripe.checkout.Session.create")
+    def test_transient_stripe_error_is_retried(self, mock_create_session):
+        mock_create_session.side_effect = stripe.error.APIConnectionError(
+            "timeout"
+        )
+        payment, mock_delay = self.create_placeholder()
+
+        with patch.object(
+            create_checkout_session, "retry", side_effect=Retry()
+        ) as mock_retry:
+            with self.assertRaises(Retry):
+                create_checkout_session(*mock_delay.call_args.args)
+
+        mock_retry.assert_called_once()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.Status.CREATING)
+
+    @patch("stripe.checkout.Session.create")
+    def test_permanent_stripe_error_fails_payment(self, mock_create_session):
+        mock_create_session.side_effect = stripe.error.InvalidRequestError(
+            "bad amount", param="line_items"
+        )
+        payment, mock_delay = self.create_placeholder()
+
+        with self.assertRaises(stripe.error.InvalidRequestError):
+            create_checkout_session(*mock_delay.call_args.args)
+
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.Status.FAILED)
+
+    def test_poll_session_until_ready(self):
+        payment, _ = self.create_placeholder()
+        self.client.force_authenticate(user=self.user)
+        url = f"{PAYMENTS_URL}{payment.pk}/session/"
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertIn("Retry-After", response)
+
+        Payment.objects.filter(pk=payment.pk).update(
+            status=Payment.Status.PENDING,
+            session_id="cs_test_123",
+            session_url="https://checkout.stripe.com/pay/cs_test_123",
+        )
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data["session_url"],
+            "https://checkout.stripe.com/pay/cs_test_123",
+        )
+
+
+@patch("stripe.checkout.Session.create")
+class BorrowingSummaryTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            password="userpass", email="user@example.com"
+        )
+        self.client.force_authenticate(user=self.user)
+        self.books = [
+            Book.objects.create(
+                title=f"Book {i}",
+                author="Author Name",
+                cover=Book.HARD,
+                inventory=2,
+                daily_fee="1.00",
+            )
+            for i in range(3)
+        ]
+        self.summary_url = reverse("users:summary")
+
+    def backdate(self, borrowing, days):
+        """Make ``borrowing`` overdue by ``days`` without any signal."""
+        Borrowing.objects.filter(pk=borrowing.pk).update(
+            borrowing_date=date.today() - timedelta(days=days + 7),
+            expected_returning_date=date.today() - timedelta(days=days),
+        )
+
+    def mock_session(self, mock_create_session):
+        mock_create_session.return_value = MagicMock(
+            url="https://checkout.stripe.com/pay/cs_test_summary",
+            id="cs_test_summary",
+        )
+
+    def test_checkout_and_return_update_summary(self, mock_create_session):
+        self.mock_session(mock_create_session)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f"{BORROWINGS_URL}checkout/",
+                {
+                    "books": [book.id for book in self.books[:2]],
+                    "expected_returning_date": date.today()
+                    + timedelta(days=3),
+                },
+                format="json",
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        summary = BorrowingSummary.objects.get(pk=self.user.pk)
+        self.assertEqual(summary.active_count, 2)
+        self.assertEqual(summary.overdue_count, 0)
+        self.assertEqual(summary.outstanding_total, Decimal("8.00"))
+        self.assertEqual(summary.last_borrowing_date, date.today())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(
+                reverse("borrowings:payments-payment-success"),
+                {"session_id": "cs_test_summary"},
+            )
+            self.client.post(
+                f"{BORROWINGS_URL}{response.data[0]['id']}/return/"
+            )
+
+        summary.refresh_from_db()
+        self.assertEqual(summary.active_count, 1)
+        self.assertEqual(summary.outstanding_total, Decimal("0.00"))
+
+    def test_summary_read_is_one_query(self, mock_create_session):
+        with self.captureOnCommitCallbacks(execute=True):
+            Borrowing.objects.create(
+                book=self.books[0],
+                user=self.user,
+                expected_returning_date=date.today() + timedelta(days=5),
+            )
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.summary_url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data,
+            {
+                "active_count": 1,
+                "overdue_count": 0,
+                "outstanding_total": "0.00",
+                "last_borrowing_date": date.today().isoformat(),
+            },
+        )
+
+    def test_stale_summary_is_recomputed_on_read(self, mock_create_session):
+        borrowing = Borrowing.objects.create(
+            book=self.books[0],
+            user=self.user,
+            expected_returning_date=date.today() + timedelta(days=5),
+        )
+        BorrowingSummary.objects.create(
+            user=self.user,
+            active_count=1,
+            next_due_date=date.today() - timedelta(days=1),
+        )
+        self.backdate(borrowing, days=1)
+
+        response = self.client.get(self.summary_url)
+
+        self.assertEqual(response.data["overdue_count"], 1)
+        summary = BorrowingSummary.objects.get(pk=self.user.pk)
+        self.assertIsNone(summary.next_due_date)
+
+    def test_nightly_task_refreshes_stale_summaries(self, mock_create_session):
+        borrowing = Borrowing.objects.create(
+            book=self.books[0],
+            user=self.user,
+            expected_returning_date=date.today() + timedelta(days=5),
+        )
+        self.backdate(borrowing, days=2)
+        BorrowingSummary.objects.create(
+            user=self.user,
+            active_count=1,
+            next_due_date=date.today() - timedelta(days=2),
+        )
+
+        refresh_borrowing_summaries()
+
+        summary = BorrowingSummary.objects.get(pk=self.user.pk)
+        self.assertEqual(summary.overdue_count, 1)
+        self.assertIsNone(summary.next_due_date)
+
+    def test_summary_requires_authentication(self, mock_create_session):
+        self.client.force_authenticate(user=None)
+        response = self.client.get(self.summary_url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET="whsec_test")
+class StripeWebhookTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            password="userpass", email="user@example.com"
+        )
+        self.payments = []
+        for i in range(2):
+            book = Book.objects.create(
+                title=f"Book {i}",
+                author="Author Name",
+                cover=Book.HARD,
+                inventory=10,
+                daily_fee="1.00",
+            )
+            borrowing = Borrowing.objects.create(
+                book=book,
+                user=self.user,
+                expected_returning_date=date.today() + timedelta(days=2),
+            )
+            self.payments.append(
+                Payment.objects.create(
+                    status=Payment.Status.PENDING,
+                    type=Payment.Type.PAYMENT,
+                    borrowing=borrowing,
+                    session_url="https://checkout.stripe.com/pay/cs_test_1",
+                    session_id="cs_test_1",
+                    money_to_pay="3.00",
+                    user=self.user,
+                )
+            )
+        Notification.objects.all().delete()
+
+    def post_event(
+        self,
+        event_type,
+        event_id="evt_1",
+        payment_status="paid",
+        secret="whsec_test",
+    ):
+        payload = json.dumps(
+            {
+                "id": event_id,
+                "object": "event",
+                "type": event_type,
+                "data": {
+                    "object": {
+                        "id": "cs_test_1",
+                        "object": "checkout.session",
+                        "payment_status": payment_status,
+                    }
+                },
+            }
+        )
+        return self.client.post(
+            f"{PAYMENTS_URL}webhook/",
+            payload,
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE=stripe_signature(payload, secret),
+        )
+
+    def statuses(self):
+        return set(Payment.objects.values_list("status", flat=True))
+
+    def test_completed_session_marks_payments_paid(self):
+        response = self.post_event("checkout.session.completed")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.statuses(), {Payment.Status.PAID})
+        notification = Notification.objects.get()
+        self.assertEqual(
+            notification.event, Notification.Event.PAYMENT_SUCCEEDED
+        )
+        self.assertEqual(notification.payload, {"session_id": "cs_test_1"})
+        self.assertTrue(StripeEvent.objects.filter(event_id="evt_1").exists())
+
+    def test_replayed_event_does_nothing(self):
+        self.post_event("checkout.session.completed")
+        Payment.objects.update(status=Payment.Status.PENDING)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_event("checkout.session.completed")
+
+        # Only the rejected insert, besides transaction control.
+        statements = [
+            query["sql"]
+            for query in queries.captured_queries
+            if not query["sql"].startswith(("SAVEPOINT", "RELEASE", "ROLL"))
+        ]
+        self.assertEqual(len(statements), 1)
+        self.assertIn("INSERT", statements[0])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.statuses(), {Payment.Status.PENDING})
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_redelivery_with_new_event_id_is_not_counted_twice(self):
+        self.post_event("checkout.session.completed", event_id="evt_1")
+        self.post_event("checkout.session.completed", event_id="evt_2")
+
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_late_failure_does_not_undo_payment(self):
+        self.post_event("checkout.session.completed", event_id="evt_1")
+        self.post_event("checkout.session.expired", event_id="evt_2")
+
+        self.assertEqual(self.statuses(), {Payment.Status.PAID})
+
+    def test_cancel_redirect_does_not_undo_settlement(self):
+        self.post_event("checkout.session.completed")
+        Payment.objects.filter(pk=self.payments[1].pk).update(
+            status=Payment.Status.EXPIRED
+        )
+
+        response = self.client.get(
+            f"{PAYMENTS_URL}cancel/", {"session_id": "cs_test_1"}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            self.statuses(), {Payment.Status.PAID, Payment.Status.EXPIRED}
+        )
+
+    def test_delayed_payment_waits_for_async_result(self):
+        self.post_event(
+            "checkout.session.completed",
+            event_id="evt_1",
+            payment_status="unpaid",
+        )
+        self.assertEqual(self.statuses(), {Payment.Status.PENDING})
+
+        self.post_event(
+            "checkout.session.async_payment_failed", event_id="evt_2"
+        )
+        self.assertEqual(self.statuses(), {Payment.Status.FAILED})
+        self.assertFalse(Notification.objects.exists())
+
+    def test_invalid_signature_is_rejected(self):
+        response = self.post_event(
+            "checkout.session.completed", secret="whsec_other"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.statuses(), {Payment.Status.PENDING})
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_unhandled_event_is_acknowledged(self):
+        response = self.post_event("customer.created")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.statuses(), {Payment.Status.PENDING})
+
+    def test_success_redirect_does_not_mark_paid(self):
+        response = self.client.get(
+            f"{PAYMENTS_URL}success/", {"session_id": "cs_test_1"}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("being confirmed", response.data)
+        self.assertEqual(self.statuses(), {Payment.Status.PENDING})
+
+    @override_settings(STRIPE_WEBHOOK_SECRET=None)
+    def test_webhook_requires_secret(self):
+        response = self.post_event("checkout.session.completed")
+        self.assertEqual(
+            response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+
+
+@override_settings(
+    STRIPE_RECONCILE_AFTER=timedelta(minutes=30), STRIPE_RATE_LIMIT=0
+)
+@patch("helpers.stripe_helper.STRIPE_RETRY_DELAY", 0.01)
+class StripeReconciliationTest(TestCase):
+    def setUp(self):
+        self.server = FakeStripeServer().start()
+        self.addCleanup(self.server.stop)
+        for name, value in (("api_base", self.server.url), ("api_key", "x")):
+            patcher = patch.object(stripe, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.user = get_user_model().objects.create_user(
+            password="userpass", email="user@example.com"
+        )
+        self.book = Book.objects.create(
+            title="Test Book",
+            author="Author Name",
+            cover=Book.HARD,
+            inventory=10,
+            daily_fee="1.00",
+        )
+        self.borrowing = Borrowing.objects.create(
+            book=self.book,
+            user=self.user,
+            expected_returning_date=date.today() + timedelta(days=2),
+        )
+        Notification.objects.all().delete()
+
+    def add_payment(self, session_id, age=timedelta(hours=1)):
+        payment = Payment.objects.create(
+            status=Payment.Status.PENDING,
+            type=Payment.Type.PAYMENT,
+            borrowing=self.borrowing,
+            session_url=f"https://checkout.stripe.com/pay/{session_id}",
+            session_id=session_id,
+            money_to_pay="3.00",
+            user=self.user,
+        )
+        Payment.objects.filter(pk=payment.pk).update(
+            created_at=timezone.now() - age
+        )
+        return payment
+
+    def status_of(self, payment):
+        payment.refresh_from_db()
+        return payment.status
+
+    def test_settles_stale_payments_from_session_status(self):
+        paid = self.add_payment("cs_paid")
+        expired = self.add_payment("cs_expired")
+        still_open = self.add_payment("cs_open")
+        unknown = self.add_payment("cs_unknown")
+        self.server.add_session("cs_paid", status="complete")
+        self.server.add_session("cs_expired", status="expired")
+        self.server.add_session("cs_open")
+
+        settled = reconcile_pending_payments()
+
+        self.assertEqual(
+            settled,
+            {
+                Payment.Status.PAID: 1,
+                Payment.Status.EXPIRED: 1,
+                Payment.Status.FAILED: 1,
+            },
+        )
+        self.assertEqual(self.status_of(paid), Payment.Status.PAID)
+        self.assertEqual(self.status_of(expired), Payment.Status.EXPIRED)
+        self.assertEqual(self.status_of(still_open), Payment.Status.PENDING)
+        self.assertEqual(self.status_of(unknown), Payment.Status.FAILED)
+        notification = Notification.objects.get()
+        self.assertEqual(notification.payload, {"session_id": "cs_paid"})
+
+    def test_expires_sessions_open_for_a_day(self):
+        payment = self.add_payment("cs_old", age=timedelta(hours=25))
+        self.server.add_session("cs_old", created=int(time.time()) - 25 * 3600)
+
+        reconcile_pending_payments()
+
+        self.assertEqual(self.status_of(payment), Payment.Status.EXPIRED)
+        self.assertEqual(self.server.sessions["cs_old"]["status"], "expired")
+        self.assertIn(
+            ("POST", "/v1/checkout/sessions/cs_old/expire"),
+            self.server.requests,
+        )
+
+    def test_recent_payments_are_left_to_the_webhook(self):
+        payment = self.add_payment("cs_new", age=timedelta(minutes=5))
+        self.server.add_session("cs_new", status="complete")
+
+        reconcile_pending_payments()
+
+        self.assertEqual(self.status_of(payment), Payment.Status.PENDING)
+        self.assertEqual(self.server.requests, [])
+
+    def test_looks_up_each_shared_session_once_across_chunks(self):
+        for i in range(3):
+            self.add_payment(f"cs_{i}")
+        self.add_payment("cs_0")
+        for i in range(3):
+            self.server.add_session(f"cs_{i}", status="complete")
+
+        settled = reconcile_payments(chunk_size=2)
+
+        self.assertEqual(settled, {Payment.Status.PAID: 4})
+        self.assertEqual(Notification.objects.count(), 3)
+        self.assertLessEqual(len(self.server.requests), 4)
+
+    def test_rate_limited_lookups_are_retried(self):
+        payment = self.add_payment("cs_paid")
+        self.server.add_session("cs_paid", status="complete")
+        self.server.rate_limited = 2
+
+        reconcile_pending_payments()
+
+        self.assertEqual(self.status_of(payment), Payment.Status.PAID)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_persistent_errors_leave_payments_pending(self):
+        payment = self.add_payment("cs_paid")
+        self.server.add_session("cs_paid", status="complete")
+        self.server.rate_limited = 100
+
+        with self.assertLogs("helpers.stripe_helper", "WARNING") as logs:
+            self.assertEqual(reconcile_pending_payments(), {})
+
+        self.assertEqual(self.status_of(payment), Payment.Status.PENDING)
+        self.assertIn("Error syncing Stripe session cs_paid", logs.output[0])
+
+    def test_lookups_run_concurrently_up_to_the_limit(self):
+        self.server.latency = 0.05
+        payments = [self.add_payment(f"cs_{i}") for i in range(12)]
+        for i in range(12):
+            self.server.add_session(f"cs_{i}", status="complete")
+
+        with override_settings(STRIPE_CONCURRENCY=4):
+            reconcile_pending_payments()
+
+        self.assertEqual(
+            {self.status_of(payment) for payment in payments},
+            {Payment.Status.PAID},
+        )
+        self.assertGreater(self.server.max_in_flight, 1)
+        self.assertLessEqual(self.server.max_in_flight, 4)
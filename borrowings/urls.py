@@ -1,6 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
+from library_service.async_views import async_action
+
 from .views import BorrowingViewSet, PaymentViewSet
 
 router = DefaultRouter()
@@ -12,4 +14,9 @@ app_name = "borrowings"
 
 urlpatterns = [
     path("", include(router.urls)),
+    path(
+        "async/borrowings/",
+        async_action(BorrowingViewSet, "list"),
+        name="borrowings-list-async",
+    ),
 ]
@@ -1,23 +1,91 @@
+import hashlib
+import json
+from collections import Counter
+
+import stripe
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count, Exists, Max, OuterRef, Q
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import quote_etag
 from django.conf import settings
-from rest_framework import status, viewsets, mixins
+from rest_framework import mixins, serializers, status, viewsets
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import (
+    AllowAny,
+    IsAdminUser,
+    IsAuthenticated,
+)
 
 from rest_framework.decorators import action
-from helpers.stripe_helper import create_payment_session
-from helpers.telegram_helper import send_message
+from helpers.stripe_helper import (
+    create_payment_session,
+    create_payment_sessions,
+)
 
+from books.models import Book
+from library_service.records import ValuesListMixin
+from .exports import export_response
+from .fines import overdue_fine
 from .models import Borrowing, Payment
+from .summaries import refresh_on_commit
+from .webhooks import handle_event, settle_session
 
 from .serializers import (
+    EagerLoadingMixin,
     BorrowingReadSerializer,
     BorrowingCreateSerializer,
+    BorrowingCheckoutSerializer,
+    BorrowingBulkReturnSerializer,
+    BorrowingExportSerializer,
     PaymentSerializer,
+    PaymentExportSerializer,
 )
 
+# Seconds a client should wait before polling a CREATING payment again.
+CHECKOUT_POLL_INTERVAL = 2
+
+BORROWING_EXPORT_FIELDS = (
+    "id",
+    "book_id",
+    "book__title",
+    "user_id",
+    "user__email",
+    "borrowing_date",
+    "expected_returning_date",
+    "actual_returning_date",
+)
+PAYMENT_EXPORT_FIELDS = (
+    "id",
+    "created_at",
+    "status",
+    "type",
+    "borrowing_id",
+    "user_id",
+    "money_to_pay",
+    "session_id",
+)
+
+
+def stream_export(request, queryset, serializer_class, fields, filename):
+    # query_params.dict() so that absent booleans stay absent instead of
+    # reading as False, as they would for HTML form input.
+    params = serializer_class(data=request.query_params.dict())
+    params.is_valid(raise_exception=True)
+    return export_response(
+        request,
+        queryset.filter(**params.get_filters()),
+        fields,
+        params.validated_data["output"],
+        filename,
+    )
+
 
 class BorrowingViewSet(
+    ValuesListMixin,
     mixins.ListModelMixin,
     mixins.CreateModelMixin,
     mixins.RetrieveModelMixin,
@@ -26,15 +94,19 @@ class BorrowingViewSet(
     queryset = Borrowing.objects.all()
     permission_classes = [IsAuthenticated]
     serializer_class = BorrowingReadSerializer
+    ordering = ("borrowing_date", "id")
 
     def get_serializer_class(self):
         if self.action == "create":
             return BorrowingCreateSerializer
+        if self.action == "checkout":
+            return BorrowingCheckoutSerializer
+        if self.action == "bulk_return":
+            return BorrowingBulkReturnSerializer
         return BorrowingReadSerializer
 
     def perform_create(self, serializer):
         borrowing = serializer.save(user=self.request.user)
-        borrowing.book.save()
 
         create_payment_session(borrowing, self.request)
 
@@ -49,28 +121,162 @@ class BorrowingViewSet(
         if user.is_staff and user_id:
             queryset = queryset.filter(user_id=user_id)
 
+        since = self.get_since()
         is_active = self.request.query_params.get("is_active")
-        if is_active is not None:
+        if since is not None:
+            # Borrowings that stopped matching ?is_active= are changes too.
+            queryset = queryset.filter(
+                Q(updated_at__gte=since)
+                | Exists(
+                    Payment.objects.filter(
+                        borrowing=OuterRef("pk"), updated_at__gte=since
+                    )
+                )
+            )
+        elif is_active is not None:
             is_active = is_active.lower() == "true"
             queryset = queryset.filter(actual_returning_date__isnull=is_active)
 
+        serializer = self.get_serializer()
+        if isinstance(serializer, EagerLoadingMixin):
+            queryset = serializer.setup_eager_loading(queryset)
+
         return queryset
 
+    def get_since(self):
+        """The ``since`` query parameter as an aware datetime, or None."""
+        value = self.request.query_params.get("since")
+        if value is None:
+            return None
+        try:
+            since = parse_datetime(value)
+        except ValueError:
+            since = None
+        if since is None:
+            raise ValidationError(
+                {"since": "Expected an ISO 8601 date and time."}
+            )
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        return since
+
+    def listing_state(self):
+        """The aggregates a listing's ETag is derived from.
+
+        Any change to a rendered borrowing, book or payment moves a
+        maximum, and a borrowing leaving the listing changes the count.
+        """
+        fields = self.get_serializer().fields
+        state = {
+            "count": Count("id", distinct=True),
+            "borrowings_modified": Max("updated_at"),
+        }
+        if isinstance(fields.get("book"), serializers.BaseSerializer):
+            state["books_modified"] = Max("book__updated_at")
+        if "payments" in fields:
+            state["payments_modified"] = Max("payment__updated_at")
+        return state
+
+    def has_listing_etag(self):
+        """Whether the listing is narrow enough to aggregate.
+
+        A patron's own borrowings, or a delta, are bounded; an unscoped
+        staff listing would aggregate the whole table on every page, so
+        it only does when the client asks to revalidate.
+        """
+        request = self.request
+        return (
+            not request.user.is_staff
+            or bool(request.query_params.get("user_id"))
+            or "since" in request.query_params
+            or "If-None-Match" in request.headers
+        )
+
+    def listing_etag(self, state):
+        """The ETag of this listing given its ``listing_state()``."""
+        raw = json.dumps(
+            [
+                self.request.user.pk,
+                self.request.get_full_path(),
+                sorted(state.items()),
+            ],
+            cls=DjangoJSONEncoder,
+        )
+        return quote_etag(hashlib.md5(raw.encode()).hexdigest())
+
+    def list(self, request, *args, **kwargs):
+        """Answer a poll that has seen the current listing with 304 after
+        one aggregate query, and only serialize it when it changed."""
+        if not self.has_listing_etag():
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset()).order_by()
+        etag = self.listing_etag(queryset.aggregate(**self.listing_state()))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = super().list(request, *args, **kwargs)
+        response["ETag"] = etag
+        return response
+
+    async def alist(self, request, *args, **kwargs):
+        """``list`` for the async endpoint."""
+        plan = self.get_values_plan()
+        queryset = self.filter_queryset(self.get_queryset())
+        etag = response = None
+        if self.has_listing_etag():
+            etag = self.listing_etag(
+                await queryset.order_by().aaggregate(**self.listing_state())
+            )
+            response = get_conditional_response(request, etag=etag)
+        if response is None:
+            page = await self.paginator.apaginate_queryset(
+                self.values_queryset(plan, queryset), request, view=self
+            )
+            response = self.paginator.get_paginated_response(
+                await plan.arender(page)
+            )
+        if etag is not None:
+            response["ETag"] = etag
+        return response
+
+    @action(detail=False, methods=["post"], url_path="checkout")
+    def checkout(self, request):
+        """Borrow several books at once and pay for them in one session."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        borrowings = serializer.save()
+
+        create_payment_sessions(borrowings, request)
+
+        queryset = BorrowingReadSerializer().setup_eager_loading(
+            Borrowing.objects.filter(
+                pk__in=[borrowing.pk for borrowing in borrowings]
+            ).order_by("id")
+        )
+        return Response(
+            BorrowingReadSerializer(queryset, many=True).data,
+            status=status.HTTP_201_CREATED,
+        )
+
     @action(detail=True, methods=["post"], url_path="return")
     def return_borrowing(self, request, pk=None):
         borrowing = self.get_object()
 
-        if borrowing.actual_returning_date:
+        today = timezone.now().date()
+        with transaction.atomic():
+            returned = Borrowing.objects.filter(
+                pk=borrowing.pk, actual_returning_date__isnull=True
+            ).update(actual_returning_date=today, updated_at=timezone.now())
+            if returned:
+                Book.objects.release(borrowing.book_id)
+                refresh_on_commit([borrowing.user_id])
+
+        if not returned:
             return Response(
                 {"detail": "Borrowing has already been returned."},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        borrowing.actual_returning_date = timezone.now().date()
-        borrowing.save()
-
-        borrowing.book.inventory += 1
-        borrowing.book.save()
+        borrowing.actual_returning_date = today
 
         fine_amount = 0
 
@@ -93,11 +299,92 @@ class BorrowingViewSet(
                     fine_amount=fine_amount,
                 )
 
-        serializer = BorrowingReadSerializer(borrowing)
+        # Fetch again so the response includes the fine payment created
+        # above rather than the payments prefetched with the borrowing.
+        serializer = BorrowingReadSerializer(self.get_object())
         return Response(serializer.data)
 
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="bulk-return",
+        permission_classes=[IsAdminUser],
+    )
+    def bulk_return(self, request):
+        """Return a batch of borrowings and bill the fines, per user.
+
+        The open borrowings are selected and priced in one query, closed
+        in one UPDATE and their copies put back in one more. Each user
+        with fines then gets one Stripe session covering all of them.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        requested = serializer.validated_data["borrowings"]
+
+        today = timezone.now().date()
+        with transaction.atomic():
+            borrowings = list(
+                Borrowing.objects.select_for_update(of=("self",))
+                .filter(pk__in=requested, actual_returning_date__isnull=True)
+                .select_related("book")
+                .annotate(fine=overdue_fine(today))
+                .order_by("id")
+            )
+            Borrowing.objects.filter(
+                pk__in=[borrowing.pk for borrowing in borrowings]
+            ).update(actual_returning_date=today, updated_at=timezone.now())
+            Book.objects.release_many(
+                Counter(borrowing.book_id for borrowing in borrowings)
+            )
+            refresh_on_commit(borrowing.user_id for borrowing in borrowings)
+
+        fined = {}
+        for borrowing in borrowings:
+            borrowing.actual_returning_date = today
+            if borrowing.fine > 0:
+                fined.setdefault(borrowing.user_id, []).append(borrowing)
+
+        payments = []
+        for user_borrowings in fined.values():
+            payments.extend(
+                create_payment_sessions(
+                    user_borrowings,
+                    request,
+                    payment_type=Payment.Type.FINE,
+                    fine_amounts=[b.fine for b in user_borrowings],
+                )
+            )
+
+        returned = {borrowing.pk for borrowing in borrowings}
+        return Response(
+            {
+                "returned": sorted(returned),
+                "skipped": [
+                    pk for pk in dict.fromkeys(requested) if pk not in returned
+                ],
+                "payments": PaymentSerializer(payments, many=True).data,
+            }
+        )
+
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path="export",
+        permission_classes=[IsAdminUser],
+    )
+    def export(self, request):
+        """Stream borrowings as CSV or NDJSON for reporting."""
+        return stream_export(
+            request,
+            Borrowing.objects.order_by("borrowing_date", "id"),
+            BorrowingExportSerializer,
+            BORROWING_EXPORT_FIELDS,
+            "borrowings",
+        )
+
 
 class PaymentViewSet(
+    ValuesListMixin,
     mixins.ListModelMixin,
     mixins.CreateModelMixin,
     mixins.RetrieveModelMixin,
@@ -105,6 +392,7 @@ class PaymentViewSet(
 ):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
+    ordering = ("id",)
 
     def get_queryset(self):
         if self.request.user.is_staff:
@@ -112,6 +400,45 @@ class PaymentViewSet(
         else:
             return Payment.objects.filter(user=self.request.user)
 
+    @action(detail=True, methods=["GET"], url_path="session")
+    def checkout_session(self, request, pk=None):
+        payment = self.get_object()
+
+        if payment.status == Payment.Status.CREATING:
+            return Response(
+                {"status": payment.status},
+                status=status.HTTP_202_ACCEPTED,
+                headers={"Retry-After": str(CHECKOUT_POLL_INTERVAL)},
+            )
+        if payment.status == Payment.Status.FAILED:
+            return Response(
+                {"error": "Could not create a checkout session"},
+                status=status.HTTP_502_BAD_GATEWAY,
+            )
+        return Response(
+            {
+                "status": payment.status,
+                "session_id": payment.session_id,
+                "session_url": payment.session_url,
+            }
+        )
+
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path="export",
+        permission_classes=[IsAdminUser],
+    )
+    def export(self, request):
+        """Stream payments as CSV or NDJSON for reporting."""
+        return stream_export(
+            request,
+            Payment.objects.order_by("created_at", "id"),
+            PaymentExportSerializer,
+            PAYMENT_EXPORT_FIELDS,
+            "payments",
+        )
+
     @action(detail=False, methods=["GET"], url_path="success")
     def payment_success(self, request):
         session_id = request.query_params.get("session_id")
@@ -121,22 +448,34 @@ class PaymentViewSet(
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        try:
-            payment = Payment.objects.get(session_id=session_id)
-            payment.status = Payment.Status.PAID
-            payment.save()
-            message = (
-                f"Payment successful for borrowing"
-                f" of book {payment.borrowing.book.title}"
+        # A basket checkout shares one session between several payments.
+        rows = list(
+            Payment.objects.filter(session_id=session_id).values_list(
+                "borrowing__book__title", "status"
             )
-            send_message(message)
-            return Response(message, status=status.HTTP_200_OK)
-        except Payment.DoesNotExist:
+        )
+        if not rows:
             return Response(
                 {"error": "Invalid session ID"},
                 status=status.HTTP_404_NOT_FOUND,
             )
 
+        statuses = {payment_status for _, payment_status in rows}
+        outstanding = set(Payment.OUTSTANDING_STATUSES)
+        if not settings.STRIPE_WEBHOOK_SECRET and statuses & outstanding:
+            # Without webhooks, the redirect is the only confirmation.
+            settle_session(session_id, Payment.Status.PAID)
+            statuses = statuses - outstanding | {Payment.Status.PAID}
+
+        books = ", ".join(title for title, _ in rows)
+        if statuses == {Payment.Status.PAID}:
+            message = f"Payment successful for borrowing of book {books}"
+        else:
+            message = (
+                f"Payment for borrowing of book {books} is being confirmed."
+            )
+        return Response(message, status=status.HTTP_200_OK)
+
     @action(detail=False, methods=["GET"], url_path="cancel")
     def payment_cancel(self, request):
         session_id = request.query_params.get("session_id")
@@ -146,18 +485,50 @@ class PaymentViewSet(
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        try:
-            payment = Payment.objects.get(session_id=session_id)
-            payment.status = Payment.Status.PENDING
-            payment.save()
-            message = (
-                "Payment has been cancelled. "
-                "You can complete the payment within "
-                "the next 24 hours using the same session link."
-            )
-            return Response(message, status=status.HTTP_200_OK)
-        except Payment.DoesNotExist:
+        payments = Payment.objects.filter(session_id=session_id)
+        user_ids = set(payments.values_list("user_id", flat=True))
+        if not user_ids:
             return Response(
                 {"error": "Invalid session ID"},
                 status=status.HTTP_404_NOT_FOUND,
             )
+        # Like the webhook, only outstanding payments move: a settled
+        # (paid, failed or expired) payment stays settled.
+        payments.filter(status__in=Payment.OUTSTANDING_STATUSES).update(
+            status=Payment.Status.PENDING, updated_at=timezone.now()
+        )
+        refresh_on_commit(user_ids)
+        message = (
+            "Payment has been cancelled. "
+            "You can complete the payment within "
+            "the next 24 hours using the same session link."
+        )
+        return Response(message, status=status.HTTP_200_OK)
+
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="webhook",
+        permission_classes=[AllowAny],
+        authentication_classes=[],
+    )
+    def webhook(self, request):
+        """Receive Stripe events; the source of truth for payment status."""
+        if not settings.STRIPE_WEBHOOK_SECRET:
+            return Response(
+                {"error": "Stripe webhooks are not configured"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+        try:
+            event = stripe.Webhook.construct_event(
+                request.body,
+                request.headers.get("Stripe-Signature", ""),
+                settings.STRIPE_WEBHOOK_SECRET,
+            )
+        except (ValueError, stripe.error.SignatureVerificationError):
+            return Response(
+                {"error": "Invalid payload or signature"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        handle_event(event)
+        return Response(status=status.HTTP_200_OK)
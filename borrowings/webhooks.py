@@ -0,0 +1,93 @@
+"""Stripe webhook handling.
+
+Stripe delivers each event at least once, in no particular order, and
+retries whenever the endpoint is slow or fails. Handling an event is
+therefore a constant amount of work and safe to repeat:
+
+- the event id is recorded in ``StripeEvent`` in the same transaction as
+  its effects, so a redelivery hits the unique constraint and stops there;
+- payments change status with one conditional UPDATE keyed by the
+  (indexed) session id, which only moves outstanding payments, so a late
+  "failed" can never undo a "paid";
+- Telegram messages go through the notification outbox and summaries are
+  refreshed on commit, so nothing slow runs while Stripe waits.
+"""
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Notification, Payment, StripeEvent
+from .summaries import refresh_on_commit
+
+SESSION_STATUSES = {
+    "checkout.session.completed": Payment.Status.PAID,
+    "checkout.session.async_payment_succeeded": Payment.Status.PAID,
+    "checkout.session.async_payment_failed": Payment.Status.FAILED,
+    "checkout.session.expired": Payment.Status.EXPIRED,
+}
+# A completed session of a delayed payment method is not paid yet; its
+# async_payment_succeeded or async_payment_failed event follows.
+PAID_SESSION_STATES = ("paid", "no_payment_required")
+
+
+def settle_sessions(session_ids, new_status):
+    """Move the outstanding payments of the sessions to ``new_status`` and
+    queue the side effects. Returns the number of payments changed."""
+    payments = Payment.objects.filter(
+        session_id__in=session_ids, status__in=Payment.OUTSTANDING_STATUSES
+    )
+    rows = list(payments.values_list("session_id", "user_id"))
+    updated = payments.update(status=new_status, updated_at=timezone.now())
+    if not updated:
+        return 0
+
+    refresh_on_commit(user_id for _, user_id in rows)
+    if new_status == Payment.Status.PAID:
+        # Keyed by session, so the webhook, the redirect and the
+        # reconciliation job notify about a payment only once between them.
+        Notification.objects.bulk_create(
+            [
+                Notification(
+                    event=Notification.Event.PAYMENT_SUCCEEDED,
+                    dedup_key=f"payment-succeeded:{session_id}",
+                    payload={"session_id": session_id},
+                )
+                for session_id in dict.fromkeys(
+                    session_id for session_id, _ in rows
+                )
+            ],
+            ignore_conflicts=True,
+        )
+    return updated
+
+
+def settle_session(session_id, new_status):
+    return settle_sessions([session_id], new_status)
+
+
+def session_status(event):
+    new_status = SESSION_STATUSES.get(event["type"])
+    session = event["data"]["object"]
+    if (
+        event["type"] == "checkout.session.completed"
+        and session.get("payment_status") not in PAID_SESSION_STATES
+    ):
+        return None
+    return new_status
+
+
+def handle_event(event):
+    """Apply a verified Stripe event once; return False for a replay."""
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                StripeEvent.objects.create(
+                    event_id=event["id"], type=event["type"]
+                )
+        except IntegrityError:
+            return False
+
+        new_status = session_status(event)
+        if new_status is not None:
+            settle_session(event["data"]["object"]["id"], new_status)
+    return True
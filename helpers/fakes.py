@@ -0,0 +1,230 @@
+"""Local HTTP stand-ins for third-party APIs, used by tests and benchmarks."""
+
+import hashlib
+import hmac
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+class FakeServer:
+    """Run a ``ThreadingHTTPServer`` on a free local port in a thread."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def handle(self, handler, method):
+        raise NotImplementedError
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake._dispatch(self, "GET")
+
+            def do_POST(self):
+                fake._dispatch(self, "POST")
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            kwargs={"poll_interval": 0.05},
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _dispatch(self, handler, method):
+        if self.latency:
+            time.sleep(self.latency)
+        status, payload = self.handle(handler, method)
+        body = json.dumps(payload).encode()
+        try:
+            handler.send_response(status)
+            handler.send_header("Content-Type", "application/json")
+            handler.send_header("Content-Length", str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up waiting, e.g. a cancelled request.
+            pass
+
+    @staticmethod
+    def read_params(handler):
+        length = int(handler.headers.get("Content-Length") or 0)
+        raw = handler.rfile.read(length).decode()
+        if handler.headers.get("Content-Type", "").startswith(
+            "application/json"
+        ):
+            return json.loads(raw or "{}")
+        return dict(parse_qsl(raw))
+
+
+class FakeTelegramServer(FakeServer):
+    """Bot API stand-in that records every ``sendMessage`` call.
+
+    Point a bot at ``base_url``; ``messages`` and ``timestamps`` record what
+    was sent and when, and ``throughput`` reports messages per second.
+    Messages containing ``reject`` are answered with 400 Bad Request.
+    """
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.messages = []
+        self.timestamps = []
+        self.reject = None
+
+    @property
+    def base_url(self):
+        return f"{self.url}/bot"
+
+    def handle(self, handler, method):
+        params = self.read_params(handler)
+        if not handler.path.endswith("/sendMessage"):
+            return 404, {"ok": False, "error_code": 404}
+        if self.reject and self.reject in params["text"]:
+            return 400, {
+                "ok": False,
+                "error_code": 400,
+                "description": "Bad Request: message is rejected",
+            }
+        with self.lock:
+            self.messages.append(params["text"])
+            self.timestamps.append(time.perf_counter())
+            message_id = len(self.messages)
+        return 200, {
+            "ok": True,
+            "result": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": int(params["chat_id"]), "type": "private"},
+                "text": params["text"],
+            },
+        }
+
+    @property
+    def throughput(self):
+        if len(self.timestamps) < 2:
+            return float(len(self.timestamps))
+        elapsed = self.timestamps[-1] - self.timestamps[0]
+        return (len(self.timestamps) - 1) / elapsed if elapsed else 0.0
+
+
+class FakeStripeServer(FakeServer):
+    """Checkout Sessions API stand-in.
+
+    Point ``stripe.api_base`` at ``url`` and register sessions with
+    ``add_session``. Sessions can be created, retrieved and expired;
+    ``requests`` records every call, ``max_in_flight`` the most calls
+    served at once, and the next ``rate_limited`` calls are answered with
+    429 Too Many Requests.
+    """
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.sessions = {}
+        self.requests = []
+        self.rate_limited = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _dispatch(self, handler, method):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            super()._dispatch(handler, method)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def add_session(
+        self, session_id, status="open", payment_status=None, created=None
+    ):
+        self.sessions[session_id] = {
+            "id": session_id,
+            "object": "checkout.session",
+            "status": status,
+            "payment_status": payment_status
+            or ("paid" if status == "complete" else "unpaid"),
+            "created": int(time.time()) if created is None else created,
+            "url": f"https://checkout.stripe.com/c/pay/{session_id}",
+        }
+        return self.sessions[session_id]
+
+    @staticmethod
+    def error(status, error_type, message, code=None):
+        return status, {
+            "error": {"type": error_type, "message": message, "code": code}
+        }
+
+    def handle(self, handler, method):
+        path = urlsplit(handler.path).path
+        parts = path.strip("/").split("/")
+        with self.lock:
+            self.requests.append((method, path))
+            if self.rate_limited:
+                self.rate_limited -= 1
+                return self.error(
+                    429, "invalid_request_error", "Too many requests"
+                )
+            if parts[:3] != ["v1", "checkout", "sessions"]:
+                return self.error(404, "invalid_request_error", "Not found")
+            if method == "POST" and len(parts) == 3:
+                self.read_params(handler)
+                session_id = f"cs_fake_{uuid.uuid4().hex}"
+                return 200, dict(self.add_session(session_id))
+            session = self.sessions.get(parts[3])
+            if session is None:
+                return self.error(
+                    404,
+                    "invalid_request_error",
+                    f"No such checkout.session: {parts[3]}",
+                    "resource_missing",
+                )
+            if method == "POST" and parts[4:] == ["expire"]:
+                if session["status"] != "open":
+                    return self.error(
+                        400,
+                        "invalid_request_error",
+                        "Only open sessions can be expired.",
+                    )
+                session["status"] = "expired"
+            return 200, dict(session)
+
+
+def stripe_signature(payload, secret, timestamp=None):
+    """A ``Stripe-Signature`` header for ``payload``, signed like Stripe
+    signs webhook deliveries."""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signature = hmac.new(
+        secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256
+    ).hexdigest()
+    return f"t={timestamp},v1={signature}"
@@ -1,70 +1,393 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
 import stripe
+from asgiref.sync import sync_to_async
 from decimal import Decimal
 from django.conf import settings
+from django.db import transaction
 from django.urls import reverse
-from borrowings.models import Payment
+from books.models import Book
+from borrowings.models import Borrowing, Payment
+from borrowings.summaries import refresh_on_commit
+from library_service.metrics import track_outbound
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
+STRIPE_TRANSIENT_ERRORS = (
+    stripe.error.APIConnectionError,
+    stripe.error.APIError,
+    stripe.error.RateLimitError,
+)
+STRIPE_MAX_ATTEMPTS = 4
+# Seconds before the first retry of a transient error, doubled each time.
+STRIPE_RETRY_DELAY = 0.5
 
-def create_payment_session(
-    borrowing, request, payment_type=Payment.Type.PAYMENT, fine_amount=None
-):
-    try:
-        if payment_type == Payment.Type.FINE and fine_amount is not None:
-            total_price = fine_amount
-        else:
-            days_borrowed = (
-                borrowing.expected_returning_date - borrowing.borrowing_date
-            ).days
-            total_price = Decimal(borrowing.book.daily_fee) * Decimal(
-                days_borrowed + 1
-            )
+logger = logging.getLogger(__name__)
 
-        success_url = (
-            request.build_absolute_uri(
-                reverse("borrowings:payments-payment-success")
-            )
-            + "?session_id={CHECKOUT_SESSION_ID}"
+
+def get_payment_amount(borrowing, payment_type, fine_amount=None):
+    if payment_type == Payment.Type.FINE and fine_amount is not None:
+        return fine_amount
+    days_borrowed = (
+        borrowing.expected_returning_date - borrowing.borrowing_date
+    ).days
+    return Decimal(borrowing.book.daily_fee) * Decimal(days_borrowed + 1)
+
+
+def get_checkout_urls(request):
+    success_url = (
+        request.build_absolute_uri(
+            reverse("borrowings:payments-payment-success")
         )
-        cancel_url = (
-            request.build_absolute_uri(
-                reverse("borrowings:payments-payment-cancel")
-            )
-            + "?session_id={CHECKOUT_SESSION_ID}"
+        + "?session_id={CHECKOUT_SESSION_ID}"
+    )
+    cancel_url = (
+        request.build_absolute_uri(
+            reverse("borrowings:payments-payment-cancel")
         )
+        + "?session_id={CHECKOUT_SESSION_ID}"
+    )
+    return success_url, cancel_url
 
-        checkout_session = stripe.checkout.Session.create(
-            payment_method_types=["card"],
-            line_items=[
-                {
-                    "price_data": {
-                        "currency": "usd",
-                        "product_data": {
-                            "name": borrowing.book.title,
-                        },
-                        "unit_amount": int(total_price * 100),
+
+def checkout_session_params(items, success_url, cancel_url):
+    return {
+        "payment_method_types": ["card"],
+        "line_items": [
+            {
+                "price_data": {
+                    "currency": "usd",
+                    "product_data": {
+                        "name": title,
                     },
-                    "quantity": 1,
+                    "unit_amount": int(amount * 100),
                 },
+                "quantity": 1,
+            }
+            for title, amount in items
+        ],
+        "mode": "payment",
+        "success_url": success_url,
+        "cancel_url": cancel_url,
+    }
+
+
+def start_checkout_session(
+    items, success_url, cancel_url, idempotency_key=None
+):
+    """Create one Stripe checkout session for ``(title, amount)`` items."""
+    params = {}
+    if idempotency_key:
+        params["idempotency_key"] = idempotency_key
+    with track_outbound("stripe"):
+        return stripe.checkout.Session.create(
+            **checkout_session_params(items, success_url, cancel_url),
+            **params,
+        )
+
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_stripe_client():
+    """The ``StripeClient`` of the running event loop.
+
+    Its ``httpx.AsyncClient`` keeps one connection pool for every request
+    made on the loop. Pooled connections belong to the loop that opened
+    them, so each loop gets its own client.
+    """
+    loop = asyncio.get_running_loop()
+    config = (stripe.api_key, stripe.api_base)
+    cached = _async_clients.get(loop)
+    if cached is None or cached[0] != config:
+        client = stripe.StripeClient(
+            stripe.api_key,
+            base_addresses={"api": stripe.api_base},
+            http_client=stripe.HTTPXClient(),
+        )
+        cached = _async_clients[loop] = (config, client)
+    return cached[1]
+
+
+async def astart_checkout_session(
+    items, success_url, cancel_url, idempotency_key=None
+):
+    """``start_checkout_session`` for async code."""
+    options = {}
+    if idempotency_key:
+        options["idempotency_key"] = idempotency_key
+    client = get_async_stripe_client()
+    with track_outbound("stripe"):
+        return await client.checkout.sessions.create_async(
+            params=checkout_session_params(items, success_url, cancel_url),
+            options=options,
+        )
+
+
+def create_payment_placeholders(
+    borrowings, request, payment_type=Payment.Type.PAYMENT, fine_amounts=None
+):
+    """Record the payments now and create their Stripe session in Celery.
+
+    The payments start in the CREATING state with no session; the
+    ``create_checkout_session`` task fills in ``session_url`` and moves them
+    to PENDING once the transaction has committed.
+    """
+    from borrowings.tasks import create_checkout_session
+
+    fine_amounts = fine_amounts or [None] * len(borrowings)
+    payments = Payment.objects.bulk_create(
+        [
+            Payment(
+                status=Payment.Status.CREATING,
+                type=payment_type,
+                borrowing=borrowing,
+                money_to_pay=get_payment_amount(
+                    borrowing, payment_type, fine_amount
+                ),
+                user_id=borrowing.user_id,
+            )
+            for borrowing, fine_amount in zip(borrowings, fine_amounts)
+        ]
+    )
+    payment_ids = [payment.pk for payment in payments]
+    refresh_on_commit(payment.user_id for payment in payments)
+    success_url, cancel_url = get_checkout_urls(request)
+    transaction.on_commit(
+        lambda: create_checkout_session.delay(
+            payment_ids, success_url, cancel_url
+        )
+    )
+    return payments
+
+
+def create_payment_sessions(
+    borrowings, request, payment_type=Payment.Type.PAYMENT, fine_amounts=None
+):
+    """Charge for several borrowings of one user in one checkout session.
+
+    Each borrowing becomes a line item and gets its own ``Payment``; the
+    payments share the session. Returns the payments, or an empty list if
+    Stripe could not be reached.
+    """
+    if settings.STRIPE_ASYNC_CHECKOUT:
+        return create_payment_placeholders(
+            borrowings, request, payment_type, fine_amounts
+        )
+
+    fine_amounts = fine_amounts or [None] * len(borrowings)
+    try:
+        amounts = [
+            get_payment_amount(borrowing, payment_type, fine_amount)
+            for borrowing, fine_amount in zip(borrowings, fine_amounts)
+        ]
+        success_url, cancel_url = get_checkout_urls(request)
+
+        checkout_session = start_checkout_session(
+            [
+                (borrowing.book.title, amount)
+                for borrowing, amount in zip(borrowings, amounts)
             ],
-            mode="payment",
-            success_url=success_url,
-            cancel_url=cancel_url,
+            success_url,
+            cancel_url,
         )
 
-        payment = Payment.objects.create(
-            status=Payment.Status.PENDING,
-            type=payment_type,
-            borrowing=borrowing,
-            session_url=checkout_session.url,
-            session_id=checkout_session.id,
-            money_to_pay=total_price,
-            user=borrowing.user,
+        payments = Payment.objects.bulk_create(
+            [
+                Payment(
+                    status=Payment.Status.PENDING,
+                    type=payment_type,
+                    borrowing=borrowing,
+                    session_url=checkout_session.url,
+                    session_id=checkout_session.id,
+                    money_to_pay=amount,
+                    user_id=borrowing.user_id,
+                )
+                for borrowing, amount in zip(borrowings, amounts)
+            ]
         )
+        refresh_on_commit(payment.user_id for payment in payments)
+        return payments
 
-        return payment
+    except Exception as e:
+        logger.warning("Error creating Stripe session: %s", e)
+        return []
+
+
+def create_payment_session(
+    borrowing, request, payment_type=Payment.Type.PAYMENT, fine_amount=None
+):
+    payments = create_payment_sessions(
+        [borrowing], request, payment_type, [fine_amount]
+    )
+    return payments[0] if payments else None
+
+
+async def aload_books(borrowings):
+    """Attach their books to borrowings that do not have them loaded yet;
+    async code cannot load them lazily."""
+    missing = [
+        borrowing
+        for borrowing in borrowings
+        if not Borrowing.book.is_cached(borrowing)
+    ]
+    if missing:
+        books = await Book.objects.ain_bulk(
+            {borrowing.book_id for borrowing in missing}
+        )
+        for borrowing in missing:
+            borrowing.book = books[borrowing.book_id]
+
+
+async def acreate_payment_sessions(
+    borrowings, request, payment_type=Payment.Type.PAYMENT, fine_amounts=None
+):
+    """``create_payment_sessions`` for async views."""
+    if settings.STRIPE_ASYNC_CHECKOUT:
+        return await sync_to_async(create_payment_placeholders)(
+            borrowings, request, payment_type, fine_amounts
+        )
+
+    fine_amounts = fine_amounts or [None] * len(borrowings)
+    try:
+        await aload_books(borrowings)
+        amounts = [
+            get_payment_amount(borrowing, payment_type, fine_amount)
+            for borrowing, fine_amount in zip(borrowings, fine_amounts)
+        ]
+        success_url, cancel_url = get_checkout_urls(request)
+
+        checkout_session = await astart_checkout_session(
+            [
+                (borrowing.book.title, amount)
+                for borrowing, amount in zip(borrowings, amounts)
+            ],
+            success_url,
+            cancel_url,
+        )
+
+        payments = await Payment.objects.abulk_create(
+            [
+                Payment(
+                    status=Payment.Status.PENDING,
+                    type=payment_type,
+                    borrowing=borrowing,
+                    session_url=checkout_session.url,
+                    session_id=checkout_session.id,
+                    money_to_pay=amount,
+                    user_id=borrowing.user_id,
+                )
+                for borrowing, amount in zip(borrowings, amounts)
+            ]
+        )
+        await sync_to_async(refresh_on_commit)(
+            [payment.user_id for payment in payments]
+        )
+        return payments
 
     except Exception as e:
-        print(f"Error creating Stripe session: {str(e)}")
-        return None
+        logger.warning("Error creating Stripe session: %s", e)
+        return []
+
+
+async def acreate_payment_session(
+    borrowing, request, payment_type=Payment.Type.PAYMENT, fine_amount=None
+):
+    payments = await acreate_payment_sessions(
+        [borrowing], request, payment_type, [fine_amount]
+    )
+    return payments[0] if payments else None
+
+
+class Throttle:
+    """Space out calls from any number of threads so at most ``rate``
+    start per second, and let a rate-limited call pause all of them."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+
+def call_stripe(throttle, func, *args):
+    """Call ``func`` under ``throttle``, retrying transient errors with
+    jittered exponential backoff."""
+    for attempt in range(STRIPE_MAX_ATTEMPTS):
+        throttle.wait()
+        try:
+            with track_outbound("stripe"):
+                return func(*args)
+        except STRIPE_TRANSIENT_ERRORS as e:
+            if attempt == STRIPE_MAX_ATTEMPTS - 1:
+                raise
+            delay = STRIPE_RETRY_DELAY * 2**attempt * random.uniform(1, 1.5)
+            if isinstance(e, stripe.error.RateLimitError):
+                # Every thread shares the rate limit, so all of them wait.
+                throttle.pause(delay)
+            else:
+                time.sleep(delay)
+
+
+def sync_checkout_session(throttle, session_id, expire_before):
+    """The current state of a checkout session, or None if Stripe does not
+    know it. Sessions still open from before the ``expire_before`` unix
+    time are expired first."""
+    try:
+        session = call_stripe(
+            throttle, stripe.checkout.Session.retrieve, session_id
+        )
+        if session.status == "open" and session.created < expire_before:
+            session = call_stripe(
+                throttle, stripe.checkout.Session.expire, session_id
+            )
+    except stripe.error.InvalidRequestError as e:
+        if e.code == "resource_missing":
+            return None
+        raise
+    return session
+
+
+def sync_checkout_sessions(session_ids, expire_before):
+    """Look up many checkout sessions concurrently, at most
+    ``STRIPE_CONCURRENCY`` at a time and ``STRIPE_RATE_LIMIT`` per second.
+
+    Returns ``{session_id: session or None}``; sessions whose lookup kept
+    failing are left out, to be tried again on the next run.
+    """
+    throttle = Throttle(settings.STRIPE_RATE_LIMIT)
+    results = {}
+    with ThreadPoolExecutor(
+        max_workers=settings.STRIPE_CONCURRENCY
+    ) as executor:
+        futures = {
+            session_id: executor.submit(
+                sync_checkout_session, throttle, session_id, expire_before
+            )
+            for session_id in session_ids
+        }
+        for session_id, future in futures.items():
+            try:
+                results[session_id] = future.result()
+            except stripe.error.StripeError as e:
+                logger.warning(
+                    "Error syncing Stripe session %s: %s", session_id, e
+                )
+    return results
@@ -1,18 +1,299 @@
+import asyncio
+import atexit
+import concurrent.futures
+import logging
 import os
+import threading
+
 from dotenv import load_dotenv
 from telegram import Bot
-import asyncio
+from telegram.constants import MessageLimit
+from telegram.error import RetryAfter
+from telegram.request import HTTPXRequest
+
+from library_service.metrics import track_outbound
 
 load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+TELEGRAM_API_URL = os.getenv(
+    "TELEGRAM_API_URL", "https://api.telegram.org/bot"
+)
+# Sent messages per second; Telegram allows about one per second per chat.
+TELEGRAM_RATE_LIMIT = float(os.getenv("TELEGRAM_RATE_LIMIT", "1"))
+TELEGRAM_CONCURRENCY = int(os.getenv("TELEGRAM_CONCURRENCY", "4"))
+TELEGRAM_QUEUE_SIZE = int(os.getenv("TELEGRAM_QUEUE_SIZE", "10000"))
+
+MAX_MESSAGE_LENGTH = MessageLimit.MAX_TEXT_LENGTH
+DIGEST_SEPARATOR = "\n\n"
+MAX_RETRY_AFTER_ATTEMPTS = 3
+
+logger = logging.getLogger(__name__)
+
+
+def _split_message(message, max_length):
+    while len(message) > max_length:
+        cut = message.rfind("\n", 0, max_length)
+        if cut <= 0:
+            cut = max_length
+        yield message[:cut]
+        message = message[cut:].lstrip("\n")
+    if message:
+        yield message
+
+
+def pack_digests(messages, max_length=MAX_MESSAGE_LENGTH):
+    """Pack ``(key, message)`` pairs into as few texts as possible, none
+    over max_length, and return ``(digest, keys it holds)`` pairs.
+
+    Messages keep their order; a single message that is itself too long is
+    split on line breaks, and its key is in every digest holding a part.
+    """
+    digests = []
+    current, keys = "", []
+    for key, message in messages:
+        for part in _split_message(message, max_length):
+            if not current:
+                current = part
+            elif (
+                len(current) + len(DIGEST_SEPARATOR) + len(part) <= max_length
+            ):
+                current += DIGEST_SEPARATOR + part
+            else:
+                digests.append((current, keys))
+                current, keys = part, []
+            if key not in keys:
+                keys.append(key)
+    if current:
+        digests.append((current, keys))
+    return digests
+
+
+def build_digests(messages, max_length=MAX_MESSAGE_LENGTH):
+    """Pack messages into as few texts as possible, none over max_length."""
+    return [
+        digest for digest, _ in pack_digests(enumerate(messages), max_length)
+    ]
+
+
+class RateLimiter:
+    """Space out acquisitions so at most ``rate`` happen per second."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            now = loop.time()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class TelegramDispatcher:
+    """Process-wide Telegram sender running on its own event loop thread.
+
+    One ``Bot`` and its HTTP connection pool live for the lifetime of the
+    dispatcher. Queued messages are coalesced into digests that fit in a
+    single Telegram message and sent concurrently under a rate limit.
+    """
+
+    def __init__(
+        self,
+        token,
+        chat_id,
+        base_url=TELEGRAM_API_URL,
+        rate_limit=TELEGRAM_RATE_LIMIT,
+        concurrency=TELEGRAM_CONCURRENCY,
+        queue_size=TELEGRAM_QUEUE_SIZE,
+        max_length=MAX_MESSAGE_LENGTH,
+        linger=0.05,
+    ):
+        self.bot = Bot(
+            token=token,
+            base_url=base_url,
+            request=HTTPXRequest(connection_pool_size=concurrency),
+        )
+        self.chat_id = chat_id
+        self.rate_limit = rate_limit
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.max_length = max_length
+        self.linger = linger
+        self.failed = 0
+        self._loop = None
+        self._thread = None
+        self._tasks = set()
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(ready,),
+                name="telegram-dispatcher",
+                daemon=True,
+            )
+            self._thread.start()
+            ready.wait()
 
+    def _run(self, ready):
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._limiter = RateLimiter(self.rate_limit)
+        self._consumer = self._loop.create_task(self._consume())
+        ready.set()
+        self._loop.run_forever()
 
-async def send_telegram_message(message):
-    bot = Bot(token=TELEGRAM_BOT_TOKEN)
-    await bot.send_message(chat_id=TELEGRAM_CHAT_ID, text=message)
+    def _call(self, coroutine, timeout=None):
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            # Stop the coroutine too, or it keeps sending after the caller
+            # has given up and may send the same messages again.
+            future.cancel()
+            raise
+
+    async def _acall(self, coroutine):
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        return await asyncio.wrap_future(future)
+
+    def send(self, message):
+        """Queue a message; blocks only while the queue is full."""
+        self.start()
+        self._call(self._queue.put(message))
+
+    async def asend(self, message):
+        """``send`` for async code; the event loop stays free while the
+        queue is full."""
+        self.start()
+        await self._acall(self._queue.put(message))
+
+    def deliver(self, messages, timeout=None):
+        """Send messages as digests now and wait.
+
+        ``messages`` maps keys to texts (a list is keyed by position).
+        Returns the keys of the messages in digests that could not be
+        sent, mapped to the error, so only those need sending again. Past
+        ``timeout`` the digests not sent yet are cancelled and
+        ``TimeoutError`` is raised.
+        """
+        if not isinstance(messages, dict):
+            messages = dict(enumerate(messages))
+        self.start()
+        return self._call(self._send_all(messages), timeout)
+
+    def flush(self, timeout=None):
+        """Wait until every queued message has been sent or given up on."""
+        if self._thread is None:
+            return
+        self._call(self._queue.join(), timeout)
+
+    def close(self, timeout=None):
+        if self._thread is None:
+            return
+        try:
+            self.flush(timeout)
+            self._call(self._shutdown(), timeout)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout)
+            self._thread = None
+
+    async def _shutdown(self):
+        self._consumer.cancel()
+        await self.bot.shutdown()
+
+    async def _consume(self):
+        while True:
+            batch = [await self._queue.get()]
+            # Give a burst of messages a moment to arrive so it is coalesced.
+            await asyncio.sleep(self.linger)
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            task = self._loop.create_task(self._deliver_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _deliver_batch(self, batch):
+        try:
+            await self._send_all(dict(enumerate(batch)))
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _send_all(self, messages):
+        digests = pack_digests(messages.items(), self.max_length)
+        results = await asyncio.gather(
+            *(self._send(digest) for digest, _ in digests),
+            return_exceptions=True,
+        )
+        failed = {}
+        for (_, keys), result in zip(digests, results):
+            if isinstance(result, Exception):
+                self.failed += 1
+                logger.error("Error sending Telegram message: %s", result)
+                for key in keys:
+                    failed.setdefault(key, result)
+        return failed
+
+    async def _send(self, text):
+        async with self._semaphore:
+            for attempt in range(MAX_RETRY_AFTER_ATTEMPTS):
+                await self._limiter.acquire()
+                try:
+                    with track_outbound("telegram"):
+                        return await self.bot.send_message(
+                            chat_id=self.chat_id, text=text
+                        )
+                except RetryAfter as e:
+                    if attempt == MAX_RETRY_AFTER_ATTEMPTS - 1:
+                        raise
+                    await asyncio.sleep(e.retry_after)
+
+
+_dispatcher = None
+_dispatcher_pid = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """Return this process's dispatcher, creating it on first use.
+
+    A forked worker (e.g. Celery prefork) gets its own dispatcher because
+    the parent's event loop thread does not survive the fork.
+    """
+    global _dispatcher, _dispatcher_pid
+    with _dispatcher_lock:
+        if _dispatcher is None or _dispatcher_pid != os.getpid():
+            _dispatcher = TelegramDispatcher(
+                TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID
+            )
+            _dispatcher_pid = os.getpid()
+            atexit.register(_dispatcher.close, 30)
+        return _dispatcher
 
 
 def send_message(message):
-    asyncio.run(send_telegram_message(message))
+    get_dispatcher().send(message)
+
+
+async def asend_message(message):
+    await get_dispatcher().asend(message)
+
+
+def flush_messages(timeout=None):
+    get_dispatcher().flush(timeout)
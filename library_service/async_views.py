@@ -0,0 +1,100 @@
+"""Async entry points for read-heavy viewset actions.
+
+DRF only has sync views, so under ASGI each request to a viewset holds a
+worker thread until it is done, including while it waits on a slow
+client. ``async_action`` runs a viewset's ``a<action>()`` coroutine as a
+native async Django view instead, doing what DRF's dispatch would:
+JWT authentication, permission checks, replica routing, JSON rendering
+and error responses.
+
+The viewset keeps building querysets and serializing as usual; only the
+database access is awaited (``apaginate_queryset``, ``aget_books``). The
+async ORM still runs each query in a thread, but the thread is released
+as soon as the query returns.
+"""
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse, HttpResponseNotAllowed
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from library_service.replicas import (
+    ReplicaReadMixin,
+    ais_pinned,
+    replica_reads,
+)
+
+ASYNC_METHODS = ("GET", "HEAD")
+
+
+async def aauthenticate(request):
+    """The user of the request's JWT, or ``AnonymousUser`` without one."""
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = header and authentication.get_raw_token(header)
+    if not raw_token:
+        return AnonymousUser()
+    token = authentication.get_validated_token(raw_token)
+    return await sync_to_async(authentication.get_user)(token)
+
+
+def check_permissions(viewset, request):
+    for permission in viewset.get_permissions():
+        if not permission.has_permission(request, viewset):
+            if not request.user.is_authenticated:
+                raise exceptions.NotAuthenticated()
+            raise exceptions.PermissionDenied(
+                getattr(permission, "message", None)
+            )
+
+
+def rendered(response):
+    """A plain response, so Django does not hop to a thread to render."""
+    if not isinstance(response, Response):
+        return response
+    response.render()
+    return HttpResponse(
+        response.content,
+        status=response.status_code,
+        headers=dict(response.items()),
+    )
+
+
+def async_action(viewset_class, action):
+    """An async view serving ``viewset_class.a<action>()`` for GET."""
+
+    async def view(request, *args, **kwargs):
+        if request.method not in ASYNC_METHODS:
+            return HttpResponseNotAllowed(ASYNC_METHODS)
+        request = Request(request, authenticators=())
+        request.accepted_renderer = JSONRenderer()
+        request.accepted_media_type = JSONRenderer.media_type
+        viewset = viewset_class(
+            request=request,
+            args=args,
+            kwargs=kwargs,
+            format_kwarg=None,
+            action=action,
+            headers={},
+        )
+        handler = getattr(viewset, f"a{action}")
+        try:
+            request.user = await aauthenticate(request)
+            check_permissions(viewset, request)
+            if isinstance(viewset, ReplicaReadMixin) and not (
+                await ais_pinned(request.user)
+            ):
+                with replica_reads():
+                    response = await handler(request, *args, **kwargs)
+            else:
+                response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = viewset.handle_exception(exc)
+        return rendered(viewset.finalize_response(request, response))
+
+    view.csrf_exempt = True
+    return view
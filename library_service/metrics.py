@@ -0,0 +1,359 @@
+"""In-process request metrics in the Prometheus text format.
+
+``MetricsMiddleware`` times every request into a per-view latency
+histogram. A sample of requests (``METRICS_SAMPLE_RATE``) also counts the
+SQL queries they run and the time spent in the database and in outbound
+calls to Stripe and Telegram; leaving the rest unsampled keeps the
+overhead of running this in production to a clock read and a lock.
+Outbound calls are timed wherever they happen, including in workers.
+
+``GET /metrics/`` serves the metrics of the process that answers it, to
+requests bearing ``METRICS_TOKEN`` or, without one, to staff sessions. With
+several worker processes, scrape each of them or run a single one per
+host.
+
+A request sent with ``X-Request-Timing: 1`` is always sampled when
+``METRICS_DEBUG_HEADER`` is on, and gets its breakdown back in a
+``Server-Timing`` header.
+"""
+
+import contextlib
+import contextvars
+import hmac
+import random
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+DEBUG_HEADER = "X-Request-Timing"
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value)
+            .replace("\\", "\\\\")
+            .replace('"', '\\"')
+            .replace("\n", "\\n"),
+        )
+        for name, value in labels
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float) and value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+
+    def inc(self, labels=(), amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in sorted(self._values.items()):
+            yield self.name, zip(self.labelnames, labels), value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._values = {}
+
+    def observe(self, value, labels=()):
+        state = self._values.get(labels)
+        if state is None:
+            state = self._values[labels] = [[0] * len(self.buckets), 0.0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def samples(self):
+        for labels, (counts, total) in sorted(self._values.items()):
+            named = list(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket",
+                    named + [("le", _format_value(float(bound)))],
+                    cumulative,
+                )
+            yield f"{self.name}_sum", named, total
+            yield f"{self.name}_count", named, cumulative
+
+
+class Registry:
+    """Metrics of this process; every update happens under one lock."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                lines.append(f"# HELP {metric.name} {metric.documentation}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                for name, labels, value in metric.samples():
+                    lines.append(
+                        f"{name}{_format_labels(list(labels))} "
+                        f"{_format_value(value)}"
+                    )
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self.lock:
+            for metric in self.metrics:
+                metric._values.clear()
+
+
+registry = Registry()
+REQUESTS = registry.add(
+    Counter(
+        "http_requests_total",
+        "Requests by view, method and status code.",
+        ("view", "method", "status"),
+    )
+)
+REQUEST_DURATION = registry.add(
+    Histogram(
+        "http_request_duration_seconds",
+        "Request latency by view.",
+        ("view", "method"),
+        LATENCY_BUCKETS,
+    )
+)
+REQUEST_QUERIES = registry.add(
+    Histogram(
+        "http_request_db_queries",
+        "SQL queries per sampled request.",
+        ("view", "method"),
+        QUERY_BUCKETS,
+    )
+)
+REQUEST_DB_DURATION = registry.add(
+    Histogram(
+        "http_request_db_duration_seconds",
+        "Time in SQL queries per sampled request.",
+        ("view", "method"),
+        LATENCY_BUCKETS,
+    )
+)
+REQUEST_OUTBOUND_DURATION = registry.add(
+    Histogram(
+        "http_request_outbound_duration_seconds",
+        "Time in outbound calls per sampled request, by service.",
+        ("view", "method", "service"),
+        LATENCY_BUCKETS,
+    )
+)
+OUTBOUND_DURATION = registry.add(
+    Histogram(
+        "outbound_request_duration_seconds",
+        "Latency of every call to an external service.",
+        ("service", "outcome"),
+        LATENCY_BUCKETS,
+    )
+)
+
+
+class RequestMetrics:
+    """Breakdown of one sampled request."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.outbound = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        # A database execute_wrapper.
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+    def server_timing(self, total):
+        entries = [
+            f"total;dur={total * 1000:.1f}",
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+        ]
+        entries += [
+            f"{service};dur={seconds * 1000:.1f}"
+            for service, seconds in sorted(self.outbound.items())
+        ]
+        return ", ".join(entries)
+
+
+@contextlib.contextmanager
+def track_outbound(service):
+    """Time a call to an external service, e.g. ``stripe``."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - start
+        with registry.lock:
+            OUTBOUND_DURATION.observe(elapsed, (service, outcome))
+        current = _current.get()
+        if current is not None:
+            current.outbound[service] = (
+                current.outbound.get(service, 0.0) + elapsed
+            )
+
+
+def view_label(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return match.view_name or match._func_path
+
+
+def count_queries(execute, sql, params, many, context):
+    """Execute wrapper that counts into the sampled request, if any."""
+    current = _current.get()
+    if current is None:
+        return execute(sql, params, many, context)
+    return current(execute, sql, params, many, context)
+
+
+def install_query_counter(connection, **kwargs):
+    # Outermost, so that it outlives any execute_wrapper() block around
+    # the query that opened the connection.
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, count_queries)
+
+
+# Async views run their queries on other threads, so every connection
+# gets the counter rather than just those of the request's thread.
+connection_created.connect(install_query_counter)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def should_sample(self, request, debug):
+        return debug or random.random() < settings.METRICS_SAMPLE_RATE
+
+    def begin(self, request):
+        debug = settings.METRICS_DEBUG_HEADER and bool(
+            request.headers.get(DEBUG_HEADER)
+        )
+        breakdown = None
+        if self.should_sample(request, debug):
+            breakdown = RequestMetrics()
+            for connection in connections.all():
+                install_query_counter(connection)
+        return debug, breakdown
+
+    def end(self, request, response, elapsed, debug, breakdown):
+        self.record(request, response, elapsed, breakdown)
+        if debug and breakdown is not None:
+            response["Server-Timing"] = breakdown.server_timing(elapsed)
+        return response
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        debug, breakdown = self.begin(request)
+        start = time.perf_counter()
+        token = _current.set(breakdown)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        elapsed = time.perf_counter() - start
+        return self.end(request, response, elapsed, debug, breakdown)
+
+    async def __acall__(self, request):
+        debug, breakdown = self.begin(request)
+        start = time.perf_counter()
+        token = _current.set(breakdown)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        elapsed = time.perf_counter() - start
+        return self.end(request, response, elapsed, debug, breakdown)
+
+    def record(self, request, response, elapsed, breakdown=None):
+        labels = (view_label(request), request.method)
+        with registry.lock:
+            REQUESTS.inc(labels + (str(response.status_code),))
+            REQUEST_DURATION.observe(elapsed, labels)
+            if breakdown is None:
+                return
+            REQUEST_QUERIES.observe(breakdown.queries, labels)
+            REQUEST_DB_DURATION.observe(breakdown.db_time, labels)
+            for service, seconds in breakdown.outbound.items():
+                REQUEST_OUTBOUND_DURATION.observe(seconds, labels + (service,))
+
+
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if token:
+        allowed = hmac.compare_digest(
+            request.headers.get("Authorization", "").encode(),
+            f"Bearer {token}".encode(),
+        )
+    else:
+        allowed = request.user.is_staff
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4"
+    )
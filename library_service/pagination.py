@@ -0,0 +1,207 @@
+import base64
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination that seeks on the full ordering key.
+
+    DRF's ``CursorPagination`` encodes only the first ordering field plus
+    an offset, which turns back into an OFFSET scan when many rows share a
+    value (e.g. borrowings made on the same day). Here the cursor carries
+    every ordering value and the next page is fetched with a
+    ``WHERE (a, b) > (x, y)`` seek, so each page costs the same no matter
+    how deep the client has paged.
+
+    Views set ``ordering`` (or return it from ``get_ordering()``) to a
+    unique, indexed key ending in ``id``.
+    """
+
+    cursor_query_param = "cursor"
+    cursor_query_description = "The pagination cursor value."
+    page_size_query_param = "page_size"
+    page_size_query_description = "Number of results to return per page."
+    invalid_cursor_message = "Invalid cursor"
+    ordering = ("id",)
+
+    def get_ordering(self, request, queryset, view):
+        if hasattr(view, "get_ordering"):
+            return tuple(view.get_ordering())
+        return tuple(getattr(view, "ordering", None) or self.ordering)
+
+    def get_page_size(self, request):
+        page_size = api_settings.PAGE_SIZE
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            requested = 0
+        if requested > 0:
+            page_size = requested
+        return min(page_size, settings.PAGINATION_MAX_PAGE_SIZE)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.page_queryset(queryset, request, view)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """``paginate_queryset`` for async views."""
+        queryset = self.page_queryset(queryset, request, view)
+        return self.set_page([item async for item in queryset])
+
+    def page_queryset(self, queryset, request, view=None):
+        """The unevaluated query for the requested page plus one row."""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.keys = [
+            (field.lstrip("-"), field.startswith("-"))
+            for field in self.ordering
+        ]
+
+        position, reverse = self.decode_cursor(request, queryset)
+        order_by = [
+            f"{'-' if descending != reverse else ''}{name}"
+            for name, descending in self.keys
+        ]
+        queryset = queryset.order_by(*order_by)
+        if position is not None:
+            queryset = queryset.filter(self.seek_filter(position, reverse))
+
+        self.position = position
+        self.reverse = reverse
+        return queryset[: self.page_size + 1]
+
+    def set_page(self, results):
+        has_more = len(results) > self.page_size
+        results = results[: self.page_size]
+        if self.reverse:
+            results.reverse()
+
+        if self.reverse:
+            self.has_next = self.position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.position is not None
+
+        self.page = results
+        return results
+
+    def seek_filter(self, position, reverse):
+        """``(a, b) > (x, y)`` spelled out for mixed sort directions."""
+        condition = Q()
+        equal = Q()
+        for (name, descending), value in zip(self.keys, position):
+            lookup = "lt" if descending != reverse else "gt"
+            condition |= equal & Q(**{f"{name}__{lookup}": value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def get_position(self, item):
+        if isinstance(item, dict):
+            return [item[name] for name, _ in self.keys]
+        return [getattr(item, name) for name, _ in self.keys]
+
+    def encode_cursor(self, item, reverse):
+        data = {"p": self.get_position(item)}
+        if reverse:
+            data["r"] = 1
+        raw = json.dumps(data, cls=DjangoJSONEncoder, separators=(",", ":"))
+        cursor = base64.urlsafe_b64encode(raw.encode()).decode()
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, cursor
+        )
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            raw_position = data["p"]
+            if len(raw_position) != len(self.keys):
+                raise ValueError
+            position = [
+                self.get_field(queryset, name).to_python(value)
+                for (name, _), value in zip(self.keys, raw_position)
+            ]
+        except (
+            TypeError,
+            ValueError,
+            KeyError,
+            FieldDoesNotExist,
+            ValidationError,
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        return position, bool(data.get("r"))
+
+    @staticmethod
+    def get_field(queryset, name):
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        return queryset.model._meta.get_field(name)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {
+                    "type": "string",
+                    "nullable": True,
+                    "format": "uri",
+                },
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": self.cursor_query_description,
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": self.page_size_query_description,
+                "schema": {"type": "integer"},
+            },
+        ]
@@ -0,0 +1,274 @@
+"""Render list responses straight from ``values()`` rows.
+
+A ``ModelSerializer`` instantiates a model per row, then walks its fields
+again for every object to get, convert and nest each value. For a page
+of borrowings with their books and payments that walk is most of the
+request's CPU time.
+
+``ValuesPlan`` does the walk once per serializer: it turns the fields
+into the list of columns to select and the conversion each needs. Rows
+are then read with ``values()``, nested objects from the same row
+(``book__title``) and nested lists with one extra query, and rendered
+into exactly the JSON the serializer would produce.
+
+Supported fields are model fields, primary-key related fields (or lists
+of them over a reverse foreign key) and nested model serializers;
+anything else raises ``ImproperlyConfigured`` when the plan is built.
+"""
+
+from collections import defaultdict
+
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from rest_framework import serializers
+from rest_framework.response import Response
+
+# Fields whose value from the database is already what they render.
+VERBATIM_FIELDS = (
+    serializers.BooleanField,
+    serializers.CharField,
+    serializers.IntegerField,
+)
+
+VALUE, ONE, MANY = "value", "one", "many"
+
+
+class ValuesPlan:
+    """The columns and conversions that render a serializer's output."""
+
+    _cache = {}
+
+    def __init__(self, serializer):
+        self.model = serializer.Meta.model
+        self.pk = self.model._meta.pk.name
+        self.columns = []
+        # (name, query over the related model, its plan, the foreign key
+        # back to this model) of every nested list.
+        self.children = []
+        self.steps = self.compile(serializer, self.model, "")
+        self.add_column(self.pk)
+
+    @classmethod
+    def for_serializer(cls, serializer_class, **kwargs):
+        """The plan of ``serializer_class(**kwargs)``, built on first use.
+
+        ``kwargs`` must be hashable.
+        """
+        key = (serializer_class, *sorted(kwargs.items()))
+        plan = cls._cache.get(key)
+        if plan is None:
+            plan = cls._cache[key] = cls(serializer_class(**kwargs))
+        return plan
+
+    def add_column(self, column):
+        if column not in self.columns:
+            self.columns.append(column)
+        return column
+
+    def compile(self, serializer, model, prefix):
+        steps = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            source = field.source
+            if isinstance(
+                field,
+                (serializers.ListSerializer, serializers.ManyRelatedField),
+            ):
+                if prefix:
+                    raise ImproperlyConfigured(
+                        f"{name}: nested lists are only supported at the "
+                        "top level."
+                    )
+                related = self.reverse_relation(model, source, name)
+                if isinstance(field, serializers.ListSerializer):
+                    child = ValuesPlan(field.child)
+                elif isinstance(
+                    field.child_relation, serializers.PrimaryKeyRelatedField
+                ):
+                    self.check_pk_field(field.child_relation, name)
+                    child = KeysPlan(related.related_model)
+                else:
+                    raise ImproperlyConfigured(f"{name}: unsupported field.")
+                if child.children:
+                    raise ImproperlyConfigured(
+                        f"{name}: nested lists cannot nest lists."
+                    )
+                key = child.add_column(related.field.name)
+                self.children.append(
+                    (name, related.related_model._default_manager, child, key)
+                )
+                steps.append((MANY, name, self.add_column(self.pk), None))
+            elif isinstance(field, serializers.ModelSerializer):
+                self.model_field(model, source, name)
+                related = field.Meta.model
+                nested = f"{prefix}{source}__"
+                steps.append(
+                    (
+                        ONE,
+                        name,
+                        self.add_column(nested + related._meta.pk.name),
+                        self.compile(field, related, nested),
+                    )
+                )
+            elif isinstance(field, serializers.PrimaryKeyRelatedField):
+                self.check_pk_field(field, name)
+                self.model_field(model, source, name)
+                column = self.add_column(prefix + source)
+                steps.append((VALUE, name, column, None))
+            elif isinstance(field, serializers.ModelField):
+                raise ImproperlyConfigured(f"{name}: unsupported field.")
+            else:
+                model_field = self.model_field(model, source, name)
+                if model_field.is_relation:
+                    raise ImproperlyConfigured(f"{name}: unsupported field.")
+                convert = (
+                    None
+                    if isinstance(field, VERBATIM_FIELDS)
+                    else field.to_representation
+                )
+                column = self.add_column(prefix + source)
+                steps.append((VALUE, name, column, convert))
+        return steps
+
+    @staticmethod
+    def check_pk_field(field, name):
+        if field.pk_field is not None:
+            raise ImproperlyConfigured(f"{name}: pk_field is set.")
+
+    @staticmethod
+    def model_field(model, source, name):
+        try:
+            return model._meta.get_field(source)
+        except FieldDoesNotExist:
+            raise ImproperlyConfigured(
+                f"{name}: {source!r} is not a field of {model.__name__}."
+            )
+
+    @staticmethod
+    def reverse_relation(model, source, name):
+        for related in model._meta.related_objects:
+            if related.get_accessor_name() == source and related.one_to_many:
+                return related
+        raise ImproperlyConfigured(
+            f"{name}: {source!r} is not a reverse foreign key of "
+            f"{model.__name__}."
+        )
+
+    def values(self, queryset, *extra):
+        """``queryset`` as rows of the plan's columns and ``extra``
+        ones (e.g. the ordering key)."""
+        columns = self.columns + [
+            name for name in extra if name not in self.columns
+        ]
+        return (
+            queryset.select_related(None)
+            .prefetch_related(None)
+            .values(*columns)
+        )
+
+    def child_rows(self, manager, plan, key, ids):
+        return plan.values(manager.filter(**{f"{key}__in": ids})).order_by(
+            plan.pk
+        )
+
+    def render(self, rows):
+        """The serializer's output for ``rows`` of ``values()``."""
+        children = {}
+        if self.children and rows:
+            ids = [row[self.pk] for row in rows]
+            for name, manager, plan, key in self.children:
+                children[name] = plan.group(
+                    self.child_rows(manager, plan, key, ids), key
+                )
+        return [render_row(self.steps, row, children) for row in rows]
+
+    async def arender(self, rows):
+        """``render`` for async views."""
+        children = {}
+        if self.children and rows:
+            ids = [row[self.pk] for row in rows]
+            for name, manager, plan, key in self.children:
+                children[name] = plan.group(
+                    [
+                        row
+                        async for row in self.child_rows(
+                            manager, plan, key, ids
+                        )
+                    ],
+                    key,
+                )
+        return [render_row(self.steps, row, children) for row in rows]
+
+    def group(self, rows, key):
+        grouped = defaultdict(list)
+        for row in rows:
+            grouped[row[key]].append(render_row(self.steps, row, {}))
+        return grouped
+
+
+class KeysPlan(ValuesPlan):
+    """Renders each row of ``model`` as its bare primary key, for nested
+    lists of primary keys."""
+
+    def __init__(self, model):
+        self.model = model
+        self.pk = model._meta.pk.name
+        self.columns = [self.pk]
+        self.children = []
+        self.steps = []
+
+    def group(self, rows, key):
+        grouped = defaultdict(list)
+        for row in rows:
+            grouped[row[key]].append(row[self.pk])
+        return grouped
+
+
+def render_row(steps, row, children):
+    item = {}
+    for kind, name, column, extra in steps:
+        value = row[column]
+        if kind is VALUE:
+            if extra is not None and value is not None:
+                value = extra(value)
+            item[name] = value
+        elif kind is ONE:
+            item[name] = (
+                None if value is None else render_row(extra, row, children)
+            )
+        else:
+            item[name] = children[name].get(value, [])
+    return item
+
+
+class ValuesListMixin:
+    """Serve the ``list`` action from ``values()`` rows through the
+    serializer's ``ValuesPlan``, skipping model instances."""
+
+    def get_values_plan(self):
+        serializer_class = self.get_serializer_class()
+        kwargs = {}
+        if hasattr(serializer_class, "sparse_options"):
+            kwargs = serializer_class.sparse_options(self.request)
+        return ValuesPlan.for_serializer(serializer_class, **kwargs)
+
+    def values_queryset(self, plan, queryset, *extra):
+        """``queryset`` as plan rows, with the pagination key and
+        ``extra`` columns too."""
+        ordering = ()
+        if self.paginator is not None:
+            ordering = self.paginator.get_ordering(
+                self.request, queryset, self
+            )
+        return plan.values(
+            queryset, *(name.lstrip("-") for name in ordering), *extra
+        )
+
+    def list(self, request, *args, **kwargs):
+        plan = self.get_values_plan()
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = self.values_queryset(plan, queryset)
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(plan.render(list(rows)))
+        return self.get_paginated_response(plan.render(page))
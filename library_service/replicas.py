@@ -0,0 +1,149 @@
+"""Routing of read-only traffic to a read replica.
+
+Reads go to the primary unless a view opts in with ``ReplicaReadMixin``.
+The catalog and the staff analytics do, for their GET requests: they are
+the bulk of the read traffic and tolerate a little replication lag. All
+writes, and every read inside a write flow, stay on the primary.
+
+After a user changes something, ``PinPrimaryMiddleware`` keeps that
+user's reads on the primary for ``DB_REPLICA_PIN_SECONDS``, so they see
+their own writes (e.g. a book's inventory right after borrowing it).
+
+Without a ``replica`` database, or with one that is the primary itself
+(as when the test runner mirrors it), everything uses the primary.
+"""
+
+import contextlib
+import contextvars
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.functional import SimpleLazyObject, empty
+from rest_framework.permissions import SAFE_METHODS
+
+REPLICA_DATABASE = "replica"
+
+_use_replica = contextvars.ContextVar("use_replica", default=False)
+
+
+def replica_available():
+    if REPLICA_DATABASE not in settings.DATABASES:
+        return False
+    primary = connections[DEFAULT_DB_ALIAS].settings_dict
+    replica = connections[REPLICA_DATABASE].settings_dict
+    return any(
+        primary.get(key) != replica.get(key)
+        for key in ("HOST", "PORT", "NAME")
+    )
+
+
+def read_database():
+    """The alias reads go to in the current context."""
+    if _use_replica.get() and replica_available():
+        return REPLICA_DATABASE
+    return DEFAULT_DB_ALIAS
+
+
+@contextlib.contextmanager
+def replica_reads():
+    """Send the reads made inside the block to the replica, if any."""
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return read_database()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def pin_key(user_id):
+    return f"db-pin:{user_id}"
+
+
+def is_pinned(user):
+    return user.is_authenticated and bool(cache.get(pin_key(user.pk)))
+
+
+async def ais_pinned(user):
+    return user.is_authenticated and bool(await cache.aget(pin_key(user.pk)))
+
+
+class ReplicaReadMixin:
+    """Serve the view's safe requests from the replica, unless the user
+    has just written something."""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and not is_pinned(request.user):
+            self._replica_token = _use_replica.set(True)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, "_replica_token", None)
+        if token is not None:
+            _use_replica.reset(token)
+            self._replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class PinPrimaryMiddleware:
+    """Pin the reads of a user who just made a successful write to the
+    primary."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        user = self.writer(request, response)
+        if user is not None:
+            cache.set(pin_key(user.pk), True, settings.DB_REPLICA_PIN_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        user = self.writer(request, response)
+        if user is not None:
+            await cache.aset(
+                pin_key(user.pk), True, settings.DB_REPLICA_PIN_SECONDS
+            )
+        return response
+
+    def writer(self, request, response):
+        """The user who just wrote something, if their reads need pinning."""
+        # DRF sets the authenticated user on the underlying request. A
+        # session user nobody looked up did not write anything.
+        user = getattr(request, "user", None)
+        if isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+            return None
+        if (
+            request.method not in SAFE_METHODS
+            and response.status_code < 400
+            and user is not None
+            and user.is_authenticated
+            and replica_available()
+        ):
+            return user
+        return None
@@ -36,10 +36,14 @@ INSTALLED_APPS = [
     "books",
     "users",
     "borrowings",
+    "analytics",
+    "benchmarks",
     "django_celery_beat",
 ]
 
 MIDDLEWARE = [
+    "library_service.metrics.MetricsMiddleware",
+    "library_service.replicas.PinPrimaryMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -80,6 +84,60 @@ DATABASES = {
     }
 }
 
+# PostgreSQL when POSTGRES_DB is set. Connections are kept open for
+# DB_CONN_MAX_AGE seconds and checked before reuse.
+if os.getenv("POSTGRES_DB"):
+    DATABASES["default"] = {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": os.getenv("POSTGRES_DB"),
+        "USER": os.getenv("POSTGRES_USER", "postgres"),
+        "PASSWORD": os.getenv("POSTGRES_PASSWORD", ""),
+        "HOST": os.getenv("POSTGRES_HOST", "localhost"),
+        "PORT": os.getenv("POSTGRES_PORT", "5432"),
+        "CONN_MAX_AGE": int(os.getenv("DB_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": True,
+    }
+
+# A read replica of the default database, used for catalog and analytics
+# reads (see library_service/replicas.py). In tests it mirrors default.
+if os.getenv("DB_REPLICA_HOST") or os.getenv("DB_REPLICA_NAME"):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "HOST": os.getenv(
+            "DB_REPLICA_HOST", DATABASES["default"].get("HOST", "")
+        ),
+        "PORT": os.getenv(
+            "DB_REPLICA_PORT", DATABASES["default"].get("PORT", "")
+        ),
+        "NAME": os.getenv("DB_REPLICA_NAME", DATABASES["default"]["NAME"]),
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_ROUTERS = ["library_service.replicas.PrimaryReplicaRouter"]
+# Seconds a user's reads stay on the primary after they changed something,
+# so they read their own writes despite replication lag.
+DB_REPLICA_PIN_SECONDS = int(os.getenv("DB_REPLICA_PIN_SECONDS", 5))
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+if os.getenv("REDIS_CACHE_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_CACHE_URL"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+CATALOG_CACHE_TIMEOUT = int(os.getenv("CATALOG_CACHE_TIMEOUT", 300))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -127,8 +185,12 @@ REST_FRAMEWORK = {
         "rest_framework_simplejwt.authentication.JWTAuthentication",
     ),
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
+    "DEFAULT_PAGINATION_CLASS": "library_service.pagination.KeysetPagination",
+    "PAGE_SIZE": int(os.getenv("PAGINATION_PAGE_SIZE", 20)),
 }
 
+PAGINATION_MAX_PAGE_SIZE = int(os.getenv("PAGINATION_MAX_PAGE_SIZE", 100))
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=60),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),
@@ -146,15 +208,55 @@ CELERY_BEAT_SCHEDULE = {
         "task": "borrowings.tasks.check_borrowings_overdue",
         "schedule": crontab(hour=10, minute=0),
     },
+    "send-pending-notifications": {
+        "task": "borrowings.tasks.send_pending_notifications",
+        "schedule": timedelta(seconds=15),
+    },
+    "refresh-borrowing-summaries": {
+        "task": "borrowings.tasks.refresh_borrowing_summaries",
+        "schedule": crontab(hour=0, minute=5),
+    },
+    "reconcile-pending-payments": {
+        "task": "borrowings.tasks.reconcile_pending_payments",
+        "schedule": crontab(minute="*/15"),
+    },
+    "rollup-daily-stats": {
+        "task": "analytics.tasks.rollup_daily_stats",
+        "schedule": crontab(minute=15),
+    },
 }
+# Days before today that every analytics rollup recomputes, to pick up
+# payments settled after the day they were created.
+ANALYTICS_ROLLUP_DAYS = int(os.getenv("ANALYTICS_ROLLUP_DAYS", 7))
 
 
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
 STRIPE_PUBLIC_KEY = os.getenv("STRIPE_PUBLIC_KEY")
+# Signing secret of the /api/payments/webhook/ endpoint. Once set, payments
+# are only marked paid by the webhook, not by the success redirect.
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
+# Concurrent requests and requests per second of batch Stripe lookups.
+STRIPE_CONCURRENCY = int(os.getenv("STRIPE_CONCURRENCY", 4))
+STRIPE_RATE_LIMIT = float(os.getenv("STRIPE_RATE_LIMIT", 20))
+# Age after which a PENDING payment is checked against Stripe, in case its
+# webhook or redirect never arrived.
+STRIPE_RECONCILE_AFTER = timedelta(
+    minutes=int(os.getenv("STRIPE_RECONCILE_AFTER_MINUTES", 30))
+)
+# Create checkout sessions in Celery instead of during the request.
+STRIPE_ASYNC_CHECKOUT = os.getenv("STRIPE_ASYNC_CHECKOUT") == "True"
 
 
 FINE_MULTIPLIER = 2
 
+# Share of requests whose SQL queries and outbound calls are measured;
+# every request is timed regardless.
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", 0.1))
+# Honour the X-Request-Timing header (per-request Server-Timing breakdown).
+METRICS_DEBUG_HEADER = os.getenv("METRICS_DEBUG_HEADER", str(DEBUG)) == "True"
+# Bearer token required to read /metrics/; without one, only staff can.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
 SPECTACULAR_SETTINGS = {
     "TITLE": "Library Service API",
     "DESCRIPTION": "Borrowing and returning books, managing users and books.",
@@ -0,0 +1,368 @@
+from datetime import date, timedelta
+from unittest.mock import MagicMock, patch
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from books.models import Book
+from books.serializers import BookSerializer
+from borrowings.models import Borrowing, Payment
+from borrowings.serializers import BorrowingReadSerializer, PaymentSerializer
+from library_service import replicas
+from library_service.metrics import Histogram, registry, track_outbound
+from library_service.records import ValuesPlan
+from library_service.replicas import PrimaryReplicaRouter
+
+
+@override_settings(METRICS_SAMPLE_RATE=1.0, METRICS_DEBUG_HEADER=True)
+class MetricsMiddlewareTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear()
+        self.client = APIClient()
+        self.scraper = APIClient()
+        self.scraper.force_login(
+            get_user_model().objects.create_superuser(
+                email="admin@example.com", password="adminpass"
+            )
+        )
+        self.book = Book.objects.create(
+            title="Test Book",
+            author="Author Name",
+            cover=Book.HARD,
+            inventory=10,
+            daily_fee="1.00",
+        )
+
+    def metrics(self, client=None, **headers):
+        response = (client or self.scraper).get("/metrics/", **headers)
+        return response.status_code, response.content.decode()
+
+    def test_records_latency_and_queries_per_view(self):
+        self.client.get("/api/books/")
+
+        status_code, text = self.metrics()
+
+        self.assertEqual(status_code, 200)
+        self.assertIn(
+            'http_requests_total{view="books:book-list",method="GET",'
+            'status="200"} 1',
+            text,
+        )
+        self.assertIn(
+            'http_request_duration_seconds_count{view="books:book-list",'
+            'method="GET"} 1',
+            text,
+        )
+        self.assertIn(
+            'http_request_db_queries_count{view="books:book-list",'
+            'method="GET"} 1',
+            text,
+        )
+
+    def test_debug_header_returns_breakdown(self):
+        response = self.client.get("/api/books/", HTTP_X_REQUEST_TIMING="1")
+
+        timing = response["Server-Timing"]
+        self.assertIn("total;dur=", timing)
+        self.assertIn('desc="1 queries"', timing)
+
+    async def test_async_views_are_measured(self):
+        response = await self.async_client.get(
+            "/api/async/books/", headers={"X-Request-Timing": "1"}
+        )
+
+        self.assertIn('desc="1 queries"', response["Server-Timing"])
+        status_code, text = await sync_to_async(self.metrics)()
+        self.assertIn(
+            'http_request_db_queries_count{view="books:book-list-async",'
+            'method="GET"} 1',
+            text,
+        )
+
+    @override_settings(METRICS_DEBUG_HEADER=False)
+    def test_debug_header_can_be_disabled(self):
+        response = self.client.get("/api/books/", HTTP_X_REQUEST_TIMING="1")
+        self.assertFalse(response.has_header("Server-Timing"))
+
+    @override_settings(METRICS_SAMPLE_RATE=0.0)
+    def test_unsampled_requests_are_only_timed(self):
+        self.client.get("/api/books/")
+
+        _, text = self.metrics()
+
+        self.assertIn(
+            'http_request_duration_seconds_count{view="books:book-list",'
+            'method="GET"} 1',
+            text,
+        )
+        self.assertNotIn('http_request_db_queries_count{view="books', text)
+
+    @patch("stripe.checkout.Session.create")
+    def test_outbound_stripe_time_is_attributed_to_request(
+        self, mock_create_session
+    ):
+        mock_create_session.return_value = MagicMock(
+            url="https://checkout.stripe.com/pay/cs_test", id="cs_test"
+        )
+        user = get_user_model().objects.create_user(
+            email="user@example.com", password="userpass"
+        )
+        self.client.force_authenticate(user=user)
+
+        response = self.client.post(
+            "/api/borrowings/",
+            {
+                "book": self.book.id,
+                "expected_returning_date": date.today() + timedelta(days=3),
+            },
+            HTTP_X_REQUEST_TIMING="1",
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertIn("stripe;dur=", response["Server-Timing"])
+        _, text = self.metrics()
+        self.assertIn(
+            'outbound_request_duration_seconds_count{service="stripe",'
+            'outcome="ok"} 1',
+            text,
+        )
+
+    def test_metrics_are_staff_only_without_token(self):
+        self.assertEqual(self.metrics(self.client)[0], 403)
+        self.client.force_login(
+            get_user_model().objects.create_user(
+                email="user@example.com", password="userpass"
+            )
+        )
+        self.assertEqual(self.metrics(self.client)[0], 403)
+        self.assertEqual(self.metrics()[0], 200)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_metrics_token(self):
+        self.assertEqual(self.metrics(self.client)[0], 403)
+        self.assertEqual(
+            self.metrics(self.client, HTTP_AUTHORIZATION="Bearer wrong")[0],
+            403,
+        )
+        self.assertEqual(
+            self.metrics(self.client, HTTP_AUTHORIZATION="Bearer secret")[0],
+            200,
+        )
+
+
+class MetricsTest(TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("test_seconds", "Test.", ("view",), (0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, ("a",))
+
+        samples = {
+            (name, dict(labels).get("le")): value
+            for name, labels, value in histogram.samples()
+        }
+
+        self.assertEqual(samples[("test_seconds_bucket", "0.1")], 2)
+        self.assertEqual(samples[("test_seconds_bucket", "1.0")], 3)
+        self.assertEqual(samples[("test_seconds_bucket", "+Inf")], 4)
+        self.assertEqual(samples[("test_seconds_count", None)], 4)
+
+    def test_failed_outbound_call_is_labelled(self):
+        registry.clear()
+        with self.assertRaises(ValueError):
+            with track_outbound("telegram"):
+                raise ValueError
+
+        self.assertIn(
+            'outbound_request_duration_seconds_count{service="telegram",'
+            'outcome="error"} 1',
+            registry.render(),
+        )
+
+
+class ReplicaRoutingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.router = PrimaryReplicaRouter()
+        self.book = Book.objects.create(
+            title="Test Book",
+            author="Author Name",
+            cover=Book.HARD,
+            inventory=10,
+            daily_fee="1.00",
+        )
+        self.user = get_user_model().objects.create_user(
+            email="user@example.com", password="userpass"
+        )
+        self.staff = get_user_model().objects.create_user(
+            email="staff@example.com", password="staffpass", is_staff=True
+        )
+        self.replica = patch.object(
+            replicas, "replica_available", return_value=True
+        )
+        self.replica.start()
+        self.addCleanup(self.replica.stop)
+
+    def replica_reads(self, method, path, data=None, user=None):
+        """Whether each query of the request was sent to the replica.
+
+        The test database has no replica, so every read still runs on the
+        primary; only the routing decision is recorded.
+        """
+        decisions = []
+
+        def db_for_read(router, model, **hints):
+            decisions.append(replicas.read_database())
+            return "default"
+
+        self.client.force_authenticate(user=user)
+        with patch.object(PrimaryReplicaRouter, "db_for_read", db_for_read):
+            getattr(self.client, method)(path, data)
+        return set(decisions)
+
+    def test_router_sends_only_opted_in_reads_to_replica(self):
+        self.assertEqual(self.router.db_for_read(Book), "default")
+        token = replicas._use_replica.set(True)
+        try:
+            self.assertEqual(self.router.db_for_read(Book), "replica")
+            self.assertEqual(self.router.db_for_write(Book), "default")
+        finally:
+            replicas._use_replica.reset(token)
+        self.assertFalse(self.router.allow_migrate("replica", "books"))
+
+    def test_catalog_and_analytics_reads_use_replica(self):
+        self.assertEqual(
+            self.replica_reads("get", "/api/books/", {"search": "test"}),
+            {"replica"},
+        )
+        self.assertEqual(
+            self.replica_reads(
+                "get", "/api/analytics/circulation/", user=self.staff
+            ),
+            {"replica"},
+        )
+        self.assertEqual(
+            self.replica_reads("get", "/api/borrowings/", user=self.user),
+            {"default"},
+        )
+
+    @patch("stripe.checkout.Session.create")
+    def test_user_reads_own_writes_from_primary(self, mock_create_session):
+        mock_create_session.return_value = MagicMock(
+            url="https://checkout.stripe.com/pay/cs_test", id="cs_test"
+        )
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(
+            "/api/borrowings/",
+            {
+                "book": self.book.id,
+                "expected_returning_date": date.today() + timedelta(days=3),
+            },
+        )
+        self.assertEqual(response.status_code, 201)
+
+        self.assertEqual(
+            self.replica_reads(
+                "get", "/api/books/", {"search": "test"}, user=self.user
+            ),
+            {"default"},
+        )
+        # Other users are not pinned.
+        self.assertEqual(
+            self.replica_reads("get", "/api/books/", {"search": "author"}),
+            {"replica"},
+        )
+
+    def test_replica_is_skipped_when_not_configured(self):
+        self.replica.stop()
+        self.assertFalse(replicas.replica_available())
+        token = replicas._use_replica.set(True)
+        try:
+            self.assertEqual(self.router.db_for_read(Book), "default")
+        finally:
+            replicas._use_replica.reset(token)
+
+
+class ValuesPlanTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email="user@example.com", password="userpass"
+        )
+        self.book = Book.objects.create(
+            title="Test Book",
+            author="Author Name",
+            cover=Book.HARD,
+            inventory=10,
+            daily_fee="1.5",
+        )
+        self.returned = Borrowing.objects.create(
+            book=self.book,
+            user=self.user,
+            expected_returning_date=date.today() + timedelta(days=2),
+            actual_returning_date=date.today(),
+        )
+        self.active = Borrowing.objects.create(
+            book=self.book,
+            user=self.user,
+            expected_returning_date=date.today() + timedelta(days=7),
+        )
+        for payment_type, amount in (("PAYMENT", "3.00"), ("FINE", "4.5")):
+            Payment.objects.create(
+                status=Payment.Status.PENDING,
+                type=payment_type,
+                borrowing=self.returned,
+                session_id="cs_test_123",
+                money_to_pay=amount,
+                user=self.user,
+            )
+
+    def assert_renders_like(self, serializer_class, queryset):
+        plan = ValuesPlan.for_serializer(serializer_class)
+        serializer = serializer_class()
+        if hasattr(serializer, "setup_eager_loading"):
+            queryset = serializer.setup_eager_loading(queryset)
+        expected = serializer_class(queryset, many=True).data
+
+        rendered = plan.render(list(plan.values(queryset)))
+
+        self.assertEqual(
+            JSONRenderer().render(rendered), JSONRenderer().render(expected)
+        )
+
+    def test_renders_like_the_serializers(self):
+        self.assert_renders_like(
+            BorrowingReadSerializer, Borrowing.objects.order_by("id")
+        )
+        self.assert_renders_like(
+            PaymentSerializer, Payment.objects.order_by("id")
+        )
+        self.assert_renders_like(BookSerializer, Book.objects.all())
+
+    def test_nested_list_costs_one_query(self):
+        plan = ValuesPlan.for_serializer(BorrowingReadSerializer)
+
+        with self.assertNumQueries(2):
+            rendered = plan.render(list(plan.values(Borrowing.objects.all())))
+
+        self.assertEqual([len(item["payments"]) for item in rendered], [2, 0])
+
+    def test_unsupported_fields_are_rejected(self):
+        class TitleSerializer(serializers.ModelSerializer):
+            shout = serializers.SerializerMethodField()
+
+            class Meta:
+                model = Book
+                fields = ["id", "shout"]
+
+            def get_shout(self, book):
+                return book.title.upper()
+
+        with self.assertRaises(ImproperlyConfigured):
+            ValuesPlan(TitleSerializer())
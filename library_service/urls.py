@@ -6,11 +6,15 @@ from drf_spectacular.views import (
 from django.contrib import admin
 from django.urls import path, include
 
+from library_service.metrics import metrics_view
+
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("metrics/", metrics_view, name="metrics"),
     path("api/", include("books.urls")),
     path("api/users/", include("users.urls")),
     path("api/", include("borrowings.urls")),
+    path("api/", include("analytics.urls")),
     path("api/schema/", SpectacularAPIView.as_view(), name="schema"),
     path(
         "api/doc/swagger/",
@@ -1,6 +1,8 @@
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
 
+from borrowings.models import BorrowingSummary
+
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -22,3 +24,14 @@ class UserSerializer(serializers.ModelSerializer):
             user.save()
 
         return user
+
+
+class BorrowingSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BorrowingSummary
+        fields = (
+            "active_count",
+            "overdue_count",
+            "outstanding_total",
+            "last_borrowing_date",
+        )
@@ -2,7 +2,8 @@ from rest_framework import generics
 from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
-from users.serializers import UserSerializer
+from borrowings.summaries import get_summary
+from users.serializers import BorrowingSummarySerializer, UserSerializer
 
 
 class CreateUserView(generics.CreateAPIView):
@@ -16,3 +17,14 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
 
     def get_object(self):
         return self.request.user
+
+
+class UserSummaryView(generics.RetrieveAPIView):
+    """Counters for the account screen, read from one summary row."""
+
+    serializer_class = BorrowingSummarySerializer
+    authentication_classes = (JWTAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get_object(self):
+        return get_summary(self.request.user.pk)